@@ -0,0 +1,128 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import json
+
+from simple_supply_addressing import addresser
+from simple_supply_addressing.addresser import AddressSpace
+
+
+# Every address derived from a key contains at least this many characters of
+# its hash, which is enough to tell keys apart
+HASH_LENGTH = 32
+
+# The address space of the key each address space is derived from
+KEY_SPACES = {
+    AddressSpace.AGENT: AddressSpace.AGENT,
+    AddressSpace.RECORD: AddressSpace.RECORD,
+    AddressSpace.RECORD_SEGMENT: AddressSpace.RECORD,
+    AddressSpace.GEOHASH_INDEX: AddressSpace.RECORD,
+    AddressSpace.GEOFENCE: AddressSpace.GEOFENCE,
+    AddressSpace.HOLDING: AddressSpace.RECORD,
+}
+
+
+class AddressIndex(object):
+    """Maps Simple Supply state addresses back to the public key or id they
+    were derived from, so the agent, record, or geofence a state change
+    belongs to can be told from its address alone. Every address derived
+    from a key is found once the key is added: a record's segment,
+    location index, and holding addresses, as well as its own, in any
+    tenant.
+
+    Args:
+        keys (iterable of tuple): The (AddressSpace, key) of each public
+            key, record id, and geofence id to add
+    """
+    def __init__(self, keys=()):
+        self._keys = {space: {} for space in set(KEY_SPACES.values())}
+        for space, key in keys:
+            self.add(space, key)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+    def __iter__(self):
+        for space, keys in self._keys.items():
+            for key in keys.values():
+                yield space, key
+
+    def add(self, space, key):
+        """Adds a key, returning whether it was new
+
+        Args:
+            space (AddressSpace): AGENT, RECORD, or GEOFENCE
+            key (str): A public key, record id, or geofence id
+        """
+        digest = _get_hash(space, _ADDRESS_FUNCTIONS[space](key))
+        keys = self._keys[space]
+        if digest in keys:
+            return False
+        keys[digest] = key
+        return True
+
+    def lookup(self, address):
+        """Returns the address space of an address and the key it was
+        derived from, or None if the key is not known
+
+        Returns:
+            tuple: The AddressSpace and the key. Record segment, location
+                index, and holding addresses resolve to the record's id
+        """
+        space = addresser.get_address_type(address)
+        if space not in KEY_SPACES:
+            return None
+
+        key = self._keys[KEY_SPACES[space]].get(_get_hash(space, address))
+        if key is None:
+            return None
+        return space, key
+
+    def save(self, path):
+        """Writes the keys to a file, from which the index can be loaded
+        """
+        with open(path, 'w') as outfile:
+            json.dump(
+                {space.name: sorted(keys.values())
+                 for space, keys in self._keys.items()},
+                outfile)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as infile:
+            keys = json.load(infile)
+        return cls(
+            (AddressSpace[name], key)
+            for name, space_keys in keys.items()
+            for key in space_keys)
+
+
+_ADDRESS_FUNCTIONS = {
+    AddressSpace.AGENT: addresser.get_agent_address,
+    AddressSpace.RECORD: addresser.get_record_address,
+    AddressSpace.GEOFENCE: addresser.get_geofence_address,
+}
+
+
+def _get_hash(space, address):
+    # Holding addresses end with the record's hash, after the owner's.
+    # Every other address has its hash right after the namespace, which
+    # may include a tenant's, and prefix, or after the geohash cell
+    if space == AddressSpace.HOLDING:
+        return address[-HASH_LENGTH:]
+    start = len(addresser.get_address_namespace(address)) + 2
+    if space == AddressSpace.GEOHASH_INDEX:
+        start += 2 * addresser.GEOHASH_PRECISION
+    return address[start:start + HASH_LENGTH]
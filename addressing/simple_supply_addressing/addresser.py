@@ -14,43 +14,253 @@
 # -----------------------------------------------------------------------------
 
 import enum
+import functools
 import hashlib
 
+from simple_supply_addressing import geohash
+
 
 FAMILY_NAME = 'simple_supply'
-FAMILY_VERSION = '0.1'
+FAMILY_VERSION = '0.2'
+# The versions the processor registers for. 0.2 changed how transactions
+# write state, so a 0.1 transaction would not produce the state a 0.1
+# processor does; every validator has to switch to 0.2 at once. State
+# written by 0.1 is still read, and packed when it is next written
+FAMILY_VERSIONS = [FAMILY_VERSION]
 NAMESPACE = hashlib.sha512(FAMILY_NAME.encode('utf-8')).hexdigest()[:6]
+ADDRESS_LENGTH = 70
 AGENT_PREFIX = '00'
 RECORD_PREFIX = '01'
+RECORD_SEGMENT_PREFIX = '02'
+GEOHASH_INDEX_PREFIX = '03'
+GEOFENCE_PREFIX = '04'
+HOLDING_PREFIX = '05'
+
+# Every tenant other than the default one has a sub-namespace of its own:
+# this prefix followed by the first characters of the hash of its name.
+# The prefixes of the address spaces above all start with 0, so addresses
+# outside any tenant can be told apart by their first character
+TENANT_PREFIX = 'ff'
+TENANT_HASH_LENGTH = 8
+
+# The Sawtooth setting listing the tenants, comma separated, transactions
+# may be submitted for. Transactions for the default tenant, '', are always
+# accepted
+TENANTS_SETTING = 'simple_supply.tenants'
+
+# Records are indexed by the geohash cell of their latest location, at this
+# many characters (cells of roughly 1.2 by 0.6 km)
+GEOHASH_PRECISION = 6
+
+# The number of characters of the record's hash at the end of a holding
+# address. The rest, after the prefix, is taken from the owner's
+HOLDING_RECORD_HASH_LENGTH = 32
+
+# The Sawtooth setting listing the public keys, comma separated, allowed to
+# change geofences
+GEOFENCE_ADMINS_SETTING = 'simple_supply.geofence_admins'
+SETTINGS_NAMESPACE = '000000'
+
+# The number of public keys and ids whose hashes are kept. Each is hashed
+# once for every address derived from it, so a record's address, segment
+# prefix, and index addresses share one hash
+HASH_CACHE_SIZE = 65536
 
 
 @enum.unique
 class AddressSpace(enum.IntEnum):
     AGENT = 0
     RECORD = 1
+    RECORD_SEGMENT = 2
+    GEOHASH_INDEX = 3
+    GEOFENCE = 4
+    HOLDING = 5
 
     OTHER_FAMILY = 100
 
 
-def get_agent_address(public_key):
-    return NAMESPACE + AGENT_PREFIX + hashlib.sha512(
-        public_key.encode('utf-8')).hexdigest()[:62]
+def get_namespace(tenant=''):
+    """Returns the prefix of every address of a tenant. Each address space
+    prefix follows it, and the hashes that follow are shortened to keep
+    addresses ADDRESS_LENGTH long.
+    """
+    if not tenant:
+        return NAMESPACE
+    return NAMESPACE + TENANT_PREFIX + _hash(tenant)[:TENANT_HASH_LENGTH]
+
+
+def get_namespace_regex(tenant=''):
+    """Returns a regular expression matching the addresses of a tenant,
+    and no other tenant's
+    """
+    if not tenant:
+        return '^{}0'.format(NAMESPACE)
+    return '^{}'.format(get_namespace(tenant))
+
+
+def get_address_namespace(address):
+    """Returns the namespace of a Simple Supply address, including the
+    tenant's sub-namespace if it has one
+    """
+    if address[6:8] == TENANT_PREFIX:
+        return address[:8 + TENANT_HASH_LENGTH]
+    return address[:6]
+
+
+def get_agent_address(public_key, tenant=''):
+    return _fill(get_namespace(tenant) + AGENT_PREFIX, _hash(public_key))
+
+
+def get_agent_addresses(public_keys, tenant=''):
+    """Returns the address of each agent, in order
+    """
+    prefix = get_namespace(tenant) + AGENT_PREFIX
+    return [_fill(prefix, _hash(public_key)) for public_key in public_keys]
+
+
+def get_record_address(record_id, tenant=''):
+    return _fill(get_namespace(tenant) + RECORD_PREFIX, _hash(record_id))
+
+
+def get_record_addresses(record_ids, tenant=''):
+    """Returns the address of each record, in order
+    """
+    prefix = get_namespace(tenant) + RECORD_PREFIX
+    return [_fill(prefix, _hash(record_id)) for record_id in record_ids]
+
+
+def get_record_segment_prefix(record_id, tenant=''):
+    """Returns the address prefix shared by every history segment of a
+    record. Transactions that may seal a new segment declare this prefix,
+    since the index of the next segment is only known from state.
+    """
+    prefix = get_namespace(tenant) + RECORD_SEGMENT_PREFIX
+    return prefix + _hash(record_id)[:ADDRESS_LENGTH - len(prefix) - 8]
+
+
+def get_record_segment_address(record_id, index, tenant=''):
+    return get_record_segment_prefix(record_id, tenant) + \
+        '{:08x}'.format(index)
+
 
+def get_geohash(latitude, longitude):
+    """Returns the geohash cell a location is indexed under
+    """
+    return geohash.encode(latitude, longitude, GEOHASH_PRECISION)
 
-def get_record_address(record_id):
-    return NAMESPACE + RECORD_PREFIX + hashlib.sha512(
-        record_id.encode('utf-8')).hexdigest()[:62]
+
+def get_geohash_index_prefix(cell='', tenant=''):
+    """Returns the address prefix of every index entry in a geohash cell.
+    Cells may be given at any precision up to GEOHASH_PRECISION; each
+    character of the geohash adds two hex digits to the prefix, so reading
+    a coarser cell's prefix returns every finer cell inside it.
+    """
+    return get_namespace(tenant) + GEOHASH_INDEX_PREFIX + ''.join(
+        '{:02x}'.format(geohash.BASE32.index(char)) for char in cell)
+
+
+def get_geohash_index_address(cell, record_id, tenant=''):
+    return _fill(get_geohash_index_prefix(cell, tenant), _hash(record_id))
+
+
+def get_geohash_index_prefixes(min_lat,
+                               min_lng,
+                               max_lat,
+                               max_lng,
+                               precision,
+                               tenant=''):
+    """Returns the index prefixes to read to find the records whose latest
+    location is inside a bounding box, given in millionths of a degree
+
+    Args:
+        precision (int): Geohash precision of the cells to read, up to
+            GEOHASH_PRECISION. Lower precisions need fewer reads, but may
+            return more records from outside the box.
+    """
+    return [
+        get_geohash_index_prefix(cell, tenant)
+        for cell in geohash.cells_in_box(
+            min_lat, min_lng, max_lat, max_lng, precision)
+    ]
+
+
+def get_geofence_prefix(tenant=''):
+    return get_namespace(tenant) + GEOFENCE_PREFIX
+
+
+def get_geofence_address(geofence_id, tenant=''):
+    return _fill(get_geofence_prefix(tenant), _hash(geofence_id))
+
+
+def get_geofence_registry_address(tenant=''):
+    """Returns the address holding the maximum speed and a digest of the
+    geofence catalog, so a cached index of the geofences can be checked
+    with a single small read
+    """
+    return _fill(get_geofence_prefix(tenant), '0' * ADDRESS_LENGTH)
+
+
+def get_geofence_catalog_address(tenant=''):
+    """Returns the address listing every geofence, with a digest of each.
+    It is only read when the geofences have changed, to rebuild the index.
+    """
+    return get_geofence_registry_address(tenant)[:-1] + '1'
+
+
+def get_holding_prefix(public_key=None, tenant=''):
+    """Returns the address prefix of every record held by an agent, so that
+    listing state under it returns the agent's holdings, or of every
+    agent's holdings if no public key is given. An agent holds the records
+    it owns directly, whether or not they are attached to another record.
+    """
+    prefix = get_namespace(tenant) + HOLDING_PREFIX
+    if public_key is None:
+        return prefix
+    return prefix + _hash(public_key)[
+        :ADDRESS_LENGTH - len(prefix) - HOLDING_RECORD_HASH_LENGTH]
+
+
+def get_holding_address(public_key, record_id, tenant=''):
+    return _fill(get_holding_prefix(public_key, tenant), _hash(record_id))
+
+
+def get_setting_address(key):
+    """Returns the address of a setting of the Sawtooth settings family
+    """
+    parts = key.split('.', maxsplit=3)
+    parts.extend([''] * (4 - len(parts)))
+    return SETTINGS_NAMESPACE + ''.join(
+        hashlib.sha256(part.encode('utf-8')).hexdigest()[:16]
+        for part in parts)
 
 
 def get_address_type(address):
     if address[:len(NAMESPACE)] != NAMESPACE:
         return AddressSpace.OTHER_FAMILY
 
-    infix = address[6:8]
+    namespace = get_address_namespace(address)
+    infix = address[len(namespace):len(namespace) + 2]
 
     if infix == '00':
         return AddressSpace.AGENT
     if infix == '01':
         return AddressSpace.RECORD
+    if infix == '02':
+        return AddressSpace.RECORD_SEGMENT
+    if infix == '03':
+        return AddressSpace.GEOHASH_INDEX
+    if infix == '04':
+        return AddressSpace.GEOFENCE
+    if infix == '05':
+        return AddressSpace.HOLDING
 
     return AddressSpace.OTHER_FAMILY
+
+
+def _fill(prefix, digest):
+    return prefix + digest[:ADDRESS_LENGTH - len(prefix)]
+
+
+@functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+def _hash(value):
+    return hashlib.sha512(value.encode('utf-8')).hexdigest()
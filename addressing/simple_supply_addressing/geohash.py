@@ -0,0 +1,98 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_LAT = 90 * 1e6
+MAX_LNG = 180 * 1e6
+
+
+def encode(latitude, longitude, precision):
+    """Returns the geohash of a location
+
+    Args:
+        latitude (int): Latitude in millionths of a degree
+        longitude (int): Longitude in millionths of a degree
+        precision (int): The number of characters in the geohash
+
+    Returns:
+        str: The geohash of the cell containing the location
+    """
+    lat_range = [-MAX_LAT, MAX_LAT]
+    lng_range = [-MAX_LNG, MAX_LNG]
+    chars = []
+    value = 0
+    bits = 0
+    is_lng = True
+    while len(chars) < precision:
+        value <<= 1
+        if is_lng:
+            middle = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= middle:
+                value |= 1
+                lng_range[0] = middle
+            else:
+                lng_range[1] = middle
+        else:
+            middle = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= middle:
+                value |= 1
+                lat_range[0] = middle
+            else:
+                lat_range[1] = middle
+        is_lng = not is_lng
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            value = 0
+            bits = 0
+
+    return ''.join(chars)
+
+
+def cells_in_box(min_lat, min_lng, max_lat, max_lng, precision):
+    """Returns the geohashes of every cell that overlaps a bounding box
+
+    Args:
+        min_lat (int): Southern edge, in millionths of a degree
+        min_lng (int): Western edge, in millionths of a degree
+        max_lat (int): Northern edge, in millionths of a degree
+        max_lng (int): Eastern edge, in millionths of a degree
+        precision (int): The number of characters in each geohash. Smaller
+            precisions return fewer, larger cells
+
+    Returns:
+        list of str: The geohashes, without duplicates
+    """
+    lng_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    cell_height = 2 * MAX_LAT / 2 ** lat_bits
+    cell_width = 2 * MAX_LNG / 2 ** lng_bits
+
+    cells = []
+    latitude = min_lat
+    while True:
+        longitude = min_lng
+        while True:
+            cell = encode(latitude, longitude, precision)
+            if cell not in cells:
+                cells.append(cell)
+            if longitude >= max_lng:
+                break
+            longitude = min(longitude + cell_width, max_lng)
+        if latitude >= max_lat:
+            break
+        latitude = min(latitude + cell_height, max_lat)
+
+    return cells
@@ -0,0 +1,42 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+from simple_supply_protobuf import agent_pb2
+from simple_supply_protobuf import record_pb2
+
+
+AGENT_CREATED = 'simple_supply/agent-created'
+RECORD_CREATED = 'simple_supply/record-created'
+RECORD_UPDATED = 'simple_supply/record-updated'
+RECORD_TRANSFERRED = 'simple_supply/record-transferred'
+HISTORY_ARCHIVED = 'simple_supply/history-archived'
+RECORD_ATTACHED = 'simple_supply/record-attached'
+RECORD_DETACHED = 'simple_supply/record-detached'
+
+# The message each event type carries as its data. Record events only carry
+# what changed; the record_id, agent, and geohash are event attributes, so
+# subscriptions can filter on them
+EVENT_DATA = {
+    AGENT_CREATED: agent_pb2.Agent,
+    RECORD_CREATED: record_pb2.Record,
+    RECORD_UPDATED: record_pb2.Record.Location,
+    RECORD_TRANSFERRED: record_pb2.Record.Owner,
+    # Only the entries archived from the record's own address. Those from
+    # its archived segments were already published when they were sealed
+    HISTORY_ARCHIVED: record_pb2.RecordSegment,
+    # Only the record_id and parent_id, which is empty once detached
+    RECORD_ATTACHED: record_pb2.Record,
+    RECORD_DETACHED: record_pb2.Record,
+}
@@ -0,0 +1,118 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import hashlib
+
+from simple_supply_protobuf import record_pb2
+
+
+def pack_history(message):
+    """Moves the owners and locations of a Record or RecordSegment into its
+    packed history, the family version 0.2 encoding. Coordinates and
+    timestamps are delta encoded, and each owner's public key is stored
+    once. Messages that are already packed are left as they are.
+
+    Args:
+        message (record_pb2.Record or record_pb2.RecordSegment): The message
+            to pack, in place
+    """
+    if not message.owners and not message.locations:
+        return
+
+    unpack_history(message)
+    history = message.history
+    agent_indexes = {}
+
+    previous = 0
+    for owner in message.owners:
+        if owner.agent_id not in agent_indexes:
+            agent_indexes[owner.agent_id] = len(agent_indexes)
+            history.agent_ids.append(owner.agent_id)
+        history.owner_agents.append(agent_indexes[owner.agent_id])
+        history.owner_timestamps.append(owner.timestamp - previous)
+        previous = owner.timestamp
+
+    previous = (0, 0, 0)
+    for location in message.locations:
+        history.latitudes.append(location.latitude - previous[0])
+        history.longitudes.append(location.longitude - previous[1])
+        history.location_timestamps.append(location.timestamp - previous[2])
+        previous = (location.latitude, location.longitude, location.timestamp)
+
+    del message.owners[:]
+    del message.locations[:]
+
+
+def unpack_history(message):
+    """Restores the owners and locations of a Record or RecordSegment from
+    its packed history. Messages in the family version 0.1 encoding are left
+    as they are.
+
+    Args:
+        message (record_pb2.Record or record_pb2.RecordSegment): The message
+            to unpack, in place
+    """
+    if not message.HasField('history'):
+        return
+
+    history = message.history
+    owners = []
+    timestamp = 0
+    for agent, delta in zip(history.owner_agents, history.owner_timestamps):
+        timestamp += delta
+        owners.append(record_pb2.Record.Owner(
+            agent_id=history.agent_ids[agent],
+            timestamp=timestamp))
+
+    locations = []
+    latitude = longitude = timestamp = 0
+    for deltas in zip(history.latitudes,
+                      history.longitudes,
+                      history.location_timestamps):
+        latitude += deltas[0]
+        longitude += deltas[1]
+        timestamp += deltas[2]
+        locations.append(record_pb2.Record.Location(
+            latitude=latitude,
+            longitude=longitude,
+            timestamp=timestamp))
+
+    # Any entries appended since the message was read come after the packed
+    # ones
+    owners.extend(message.owners)
+    locations.extend(message.locations)
+    message.ClearField('history')
+    del message.owners[:]
+    del message.locations[:]
+    message.owners.extend(owners)
+    message.locations.extend(locations)
+
+
+def commit_history(commitment, archived):
+    """Returns a record's history commitment after more of its history is
+    archived. Anyone holding the archived entries, such as the subscriber's
+    database, can recompute it.
+
+    Args:
+        commitment (str): The record's previous commitment, if any
+        archived (record_pb2.RecordSegment): The record_id, and the owners
+            and locations archived, in order and unpacked. No other fields
+            may be set
+
+    Returns:
+        str: The new commitment
+    """
+    return hashlib.sha512(
+        commitment.encode() + archived.SerializeToString()).hexdigest()
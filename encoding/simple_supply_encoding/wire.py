@@ -0,0 +1,395 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import collections
+
+from google.protobuf.message import DecodeError
+
+
+# The latest state of a record, as read from a serialized RecordContainer
+# without parsing the rest of its history. owner is the last owner entry
+# and latest_owner the one with the greatest timestamp, the earliest of
+# them if several share it, as (agent_id, timestamp). location is the last
+# location entry, as (latitude, longitude, timestamp). The counts are of
+# the entries at the record's own address, not those in its segments
+RecordHead = collections.namedtuple('RecordHead', [
+    'record_id',
+    'parent_id',
+    'owner',
+    'latest_owner',
+    'location',
+    'owner_count',
+    'location_count',
+])
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# Field numbers, from protos/record.proto
+CONTAINER_ENTRIES = 1
+RECORD_ID = 1
+RECORD_OWNERS = 2
+RECORD_LOCATIONS = 3
+RECORD_HISTORY = 5
+RECORD_PARENT_ID = 7
+OWNER_AGENT_ID = 1
+OWNER_TIMESTAMP = 2
+LOCATION_LATITUDE = 1
+LOCATION_LONGITUDE = 2
+LOCATION_TIMESTAMP = 3
+HISTORY_AGENT_IDS = 1
+HISTORY_OWNER_AGENTS = 2
+HISTORY_OWNER_TIMESTAMPS = 3
+HISTORY_LATITUDES = 4
+HISTORY_LONGITUDES = 5
+HISTORY_LOCATION_TIMESTAMPS = 6
+
+
+def scan_record(data, record_id):
+    """Reads the head of a record from a serialized RecordContainer, in
+    either history encoding. Only the record's id, parent, and latest owner
+    and location are decoded; other entries of the container are skipped
+    once their id is known not to match, and no messages are built.
+
+    Args:
+        data (bytes or memoryview): The serialized RecordContainer
+        record_id (str): The id of the record to read
+
+    Returns:
+        RecordHead: The record's head, or None if it is not in the container
+
+    Raises:
+        DecodeError: If the data is not a valid RecordContainer
+    """
+    buffer = memoryview(data)
+    wanted = record_id.encode()
+    for start, end in _fields(buffer, 0, len(buffer), CONTAINER_ENTRIES):
+        fields = _collect(buffer, start, end)
+        if _text(buffer, fields, RECORD_ID, encoded=True) == wanted:
+            return _make_head(buffer, fields)
+    return None
+
+
+def scan_records(data):
+    """Reads the head of every record in a serialized RecordContainer, as
+    scan_record does
+
+    Args:
+        data (bytes or memoryview): The serialized RecordContainer
+
+    Returns:
+        list of RecordHead: The heads, in the order of the container
+    """
+    buffer = memoryview(data)
+    return [
+        _make_head(buffer, _collect(buffer, start, end))
+        for start, end in _fields(buffer, 0, len(buffer), CONTAINER_ENTRIES)
+    ]
+
+
+def get_record_head(record):
+    """Returns the head of a parsed and unpacked record_pb2.Record, the same
+    as scan_record would return for it once packed and serialized
+    """
+    owner = latest_owner = location = None
+    if record.owners:
+        last = record.owners[-1]
+        latest = max(record.owners, key=lambda entry: entry.timestamp)
+        owner = (last.agent_id, last.timestamp)
+        latest_owner = (latest.agent_id, latest.timestamp)
+    if record.locations:
+        last = record.locations[-1]
+        location = (last.latitude, last.longitude, last.timestamp)
+    return RecordHead(
+        record_id=record.record_id,
+        parent_id=record.parent_id,
+        owner=owner,
+        latest_owner=latest_owner,
+        location=location,
+        owner_count=len(record.owners),
+        location_count=len(record.locations))
+
+
+def _make_head(buffer, fields):
+    # Unpacking puts the packed entries first, then any unpacked ones
+    history = _collect_all(buffer, fields.get(RECORD_HISTORY, ()))
+    packed_owners = _scan_packed_owners(buffer, history)
+    owners = _scan_owners(buffer, fields.get(RECORD_OWNERS, ()))
+    packed_location, packed_count = _scan_packed_locations(buffer, history)
+    location, location_count = _scan_locations(
+        buffer, fields.get(RECORD_LOCATIONS, ()))
+
+    owner = owners[0] or packed_owners[0]
+    latest_owner = packed_owners[1]
+    if owners[1] is not None and (
+            latest_owner is None or owners[1][1] > latest_owner[1]):
+        latest_owner = owners[1]
+
+    return RecordHead(
+        record_id=_text(buffer, fields, RECORD_ID),
+        parent_id=_text(buffer, fields, RECORD_PARENT_ID),
+        owner=owner,
+        latest_owner=latest_owner,
+        location=location or packed_location,
+        owner_count=packed_owners[2] + owners[2],
+        location_count=packed_count + location_count)
+
+
+def _scan_packed_owners(buffer, history):
+    """Returns the last and latest owners of a packed history, and the
+    number of owner entries in it
+    """
+    agents = list(_varints(buffer, history.get(HISTORY_OWNER_AGENTS, ())))
+    if not agents:
+        return None, None, 0
+
+    last = latest = None
+    timestamp = 0
+    count = 0
+    for delta in _varints(
+            buffer, history.get(HISTORY_OWNER_TIMESTAMPS, ())):
+        if count == len(agents):
+            break
+        timestamp += _zigzag(delta)
+        last = (count, timestamp)
+        if latest is None or timestamp > latest[1]:
+            latest = last
+        count += 1
+    if last is None:
+        return None, None, 0
+
+    agent_ids = history.get(HISTORY_AGENT_IDS, [])
+    try:
+        return (
+            (_decode(buffer, agent_ids[agents[last[0]]]), last[1]),
+            (_decode(buffer, agent_ids[agents[latest[0]]]), latest[1]),
+            count)
+    except IndexError:
+        raise DecodeError('Owner agent out of range')
+
+
+def _scan_owners(buffer, owners):
+    """Returns the last and latest of a record's unpacked owners, and how
+    many there are
+    """
+    last = latest = None
+    for start, end in owners:
+        agent_id = None
+        timestamp = 0
+        position = start
+        while position < end:
+            key, position = _read_varint(buffer, position)
+            if key == OWNER_AGENT_ID << 3 | LENGTH_DELIMITED:
+                length, position = _read_varint(buffer, position)
+                agent_id = (position, position + length)
+                position += length
+            elif key == OWNER_TIMESTAMP << 3 | VARINT:
+                timestamp, position = _read_varint(buffer, position)
+            else:
+                position = _skip(buffer, position, key & 7)
+        if position > end:
+            raise DecodeError('Truncated message')
+        last = (agent_id, timestamp)
+        if latest is None or timestamp > latest[1]:
+            latest = last
+    if last is None:
+        return None, None, 0
+    return (
+        (_decode(buffer, last[0]), last[1]),
+        (_decode(buffer, latest[0]), latest[1]),
+        len(owners))
+
+
+def _scan_packed_locations(buffer, history):
+    """Returns the last location of a packed history, and the number of
+    location entries in it
+    """
+    columns = [
+        _varints(buffer, history.get(number, ()))
+        for number in (HISTORY_LATITUDES,
+                       HISTORY_LONGITUDES,
+                       HISTORY_LOCATION_TIMESTAMPS)
+    ]
+    latitude = longitude = timestamp = 0
+    count = 0
+    for deltas in zip(*columns):
+        latitude += _zigzag(deltas[0])
+        longitude += _zigzag(deltas[1])
+        timestamp += _zigzag(deltas[2])
+        count += 1
+    if not count:
+        return None, 0
+    return (latitude, longitude, timestamp), count
+
+
+def _scan_locations(buffer, locations):
+    """Returns the last of a record's unpacked locations, and how many
+    there are
+    """
+    if not locations:
+        return None, 0
+    start, end = locations[-1]
+    location = [0, 0, 0]
+    for number, wire_type, value in _iter(buffer, start, end):
+        if wire_type != VARINT:
+            continue
+        if number == LOCATION_LATITUDE:
+            location[0] = _zigzag(value)
+        elif number == LOCATION_LONGITUDE:
+            location[1] = _zigzag(value)
+        elif number == LOCATION_TIMESTAMP:
+            location[2] = value
+    return tuple(location), len(locations)
+
+
+def _collect(buffer, start, end):
+    """Returns the position of each field of a message, by field number.
+    Length delimited fields are given as the (start, end) of their
+    contents, and varints as the (start, end) of their encoding, so that
+    unpacked and packed repeated varints can be read the same way.
+    """
+    fields = {}
+    position = start
+    while position < end:
+        key, position = _read_varint(buffer, position)
+        wire_type = key & 7
+        if wire_type == VARINT:
+            value_start = position
+            _, position = _read_varint(buffer, position)
+        elif wire_type == LENGTH_DELIMITED:
+            length, value_start = _read_varint(buffer, position)
+            position = value_start + length
+        else:
+            position = _skip(buffer, position, wire_type)
+            continue
+        if position > end:
+            raise DecodeError('Truncated message')
+        fields.setdefault(key >> 3, []).append((value_start, position))
+    return fields
+
+
+def _collect_all(buffer, messages):
+    """Collects the fields of several occurrences of an embedded message,
+    which are merged in order when it is parsed
+    """
+    fields = {}
+    for start, end in messages:
+        for number, positions in _collect(buffer, start, end).items():
+            fields.setdefault(number, []).extend(positions)
+    return fields
+
+
+def _fields(buffer, start, end, field_number):
+    """Yields the (start, end) of the contents of each length delimited
+    field of a message with the field number
+    """
+    position = start
+    while position < end:
+        key, position = _read_varint(buffer, position)
+        if key & 7 != LENGTH_DELIMITED:
+            position = _skip(buffer, position, key & 7)
+            continue
+        length, position = _read_varint(buffer, position)
+        if position + length > end:
+            raise DecodeError('Truncated message')
+        if key >> 3 == field_number:
+            yield position, position + length
+        position += length
+
+
+def _iter(buffer, start, end):
+    """Yields the number, wire type, and value of each varint and length
+    delimited field of a message. Length delimited values are given as
+    their (start, end).
+    """
+    position = start
+    while position < end:
+        key, position = _read_varint(buffer, position)
+        wire_type = key & 7
+        if wire_type == VARINT:
+            value, position = _read_varint(buffer, position)
+            yield key >> 3, wire_type, value
+        elif wire_type == LENGTH_DELIMITED:
+            length, position = _read_varint(buffer, position)
+            yield key >> 3, wire_type, (position, position + length)
+            position += length
+        else:
+            position = _skip(buffer, position, wire_type)
+    if position > end:
+        raise DecodeError('Truncated message')
+
+
+def _varints(buffer, runs):
+    """Yields the varints of each (start, end) run, in order
+    """
+    for start, end in runs:
+        position = start
+        while position < end:
+            value, position = _read_varint(buffer, position)
+            yield value
+        if position > end:
+            raise DecodeError('Truncated packed field')
+
+
+def _read_varint(buffer, position):
+    result = 0
+    shift = 0
+    try:
+        while True:
+            byte = buffer[position]
+            position += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result, position
+            shift += 7
+    except IndexError:
+        raise DecodeError('Truncated varint')
+
+
+def _skip(buffer, position, wire_type):
+    if wire_type == VARINT:
+        return _read_varint(buffer, position)[1]
+    if wire_type == FIXED64:
+        return position + 8
+    if wire_type == LENGTH_DELIMITED:
+        length, position = _read_varint(buffer, position)
+        return position + length
+    if wire_type == FIXED32:
+        return position + 4
+    raise DecodeError('Unsupported wire type {}'.format(wire_type))
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _text(buffer, fields, field_number, encoded=False):
+    # The last occurrence of a singular field is the one that counts
+    positions = fields.get(field_number)
+    if not positions:
+        return b'' if encoded else ''
+    start, end = positions[-1]
+    if encoded:
+        return buffer[start:end].tobytes()
+    return str(buffer[start:end], 'utf-8')
+
+
+def _decode(buffer, positions):
+    if positions is None:
+        return ''
+    start, end = positions
+    return str(buffer[start:end], 'utf-8')
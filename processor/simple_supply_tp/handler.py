@@ -13,7 +13,7 @@
 # limitations under the License.
 # -----------------------------------------------------------------------------
 
-import datetime
+import logging
 import time
 
 from sawtooth_sdk.processor.handler import TransactionHandler
@@ -23,15 +23,34 @@ from simple_supply_addressing import addresser
 
 from simple_supply_protobuf import payload_pb2
 
+from simple_supply_tp import metrics
 from simple_supply_tp.payload import SimpleSupplyPayload
 from simple_supply_tp.state import SimpleSupplyState
 
+from simple_supply_validation import rules
+from simple_supply_validation.rules import ValidationError
 
-SYNC_TOLERANCE = 60 * 5
-MAX_LAT = 90 * 1e6
-MIN_LAT = -90 * 1e6
-MAX_LNG = 180 * 1e6
-MIN_LNG = -180 * 1e6
+
+LOGGER = logging.getLogger(__name__)
+
+BUNDLE_ACTIONS = (
+    payload_pb2.SimpleSupplyPayload.CREATE_RECORD,
+    payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
+    payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD,
+)
+
+metrics.REGISTRY.describe(
+    'simple_supply_apply_seconds',
+    'Time spent applying transactions, by action and phase')
+metrics.REGISTRY.describe(
+    'simple_supply_container_bytes',
+    'Size of the state containers read and written, by action')
+metrics.REGISTRY.describe(
+    'simple_supply_state_round_trips_saved_total',
+    'State round-trips to the validator avoided by the state cache')
+metrics.REGISTRY.describe(
+    'simple_supply_invalid_transactions_total',
+    'Transactions rejected as invalid, by action')
 
 
 class SimpleSupplyHandler(TransactionHandler):
@@ -42,47 +61,131 @@ class SimpleSupplyHandler(TransactionHandler):
 
     @property
     def family_versions(self):
-        return [addresser.FAMILY_VERSION]
+        return addresser.FAMILY_VERSIONS
 
     @property
     def namespaces(self):
         return [addresser.NAMESPACE]
 
     def apply(self, transaction, context):
+        start = time.perf_counter()
         header = transaction.header
         payload = SimpleSupplyPayload(transaction.payload)
-        state = SimpleSupplyState(context)
-
-        _validate_timestamp(payload.timestamp)
-
-        if payload.action == payload_pb2.SimpleSupplyPayload.CREATE_AGENT:
-            _create_agent(
-                state=state,
-                public_key=header.signer_public_key,
-                payload=payload)
-        elif payload.action == payload_pb2.SimpleSupplyPayload.CREATE_RECORD:
-            _create_record(
-                state=state,
-                public_key=header.signer_public_key,
-                payload=payload)
-        elif payload.action == payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD:
-            _transfer_record(
-                state=state,
-                public_key=header.signer_public_key,
-                payload=payload)
-        elif payload.action == payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
-            _update_record(
-                state=state,
-                public_key=header.signer_public_key,
-                payload=payload)
-        else:
-            raise InvalidTransaction('Unhandled action')
+        state = SimpleSupplyState(context, tenant=payload.tenant)
+        parsed = time.perf_counter()
+
+        action_name = _get_action_name(payload.action)
+        try:
+            rules.validate_timestamp(payload.timestamp)
+            if payload.tenant:
+                rules.validate_tenant(
+                    tenant=payload.tenant,
+                    tenants=state.get_setting(addresser.TENANTS_SETTING))
+
+            if payload.action == payload_pb2.SimpleSupplyPayload.BUNDLE:
+                _bundle(
+                    state=state,
+                    public_key=header.signer_public_key,
+                    payload=payload)
+            else:
+                _apply_action(
+                    state=state,
+                    public_key=header.signer_public_key,
+                    payload=payload)
+
+            state.flush()
+        except (InvalidTransaction, ValidationError) as err:
+            metrics.REGISTRY.increment(
+                'simple_supply_invalid_transactions_total',
+                {'action': action_name})
+            if isinstance(err, ValidationError):
+                raise InvalidTransaction(str(err)) from err
+            raise
+
+        _record_metrics(
+            action_name=action_name,
+            parse_time=parsed - start,
+            handle_time=time.perf_counter() - parsed,
+            state=state)
+        LOGGER.debug(
+            '%s saved %s state round-trips',
+            action_name,
+            state.round_trips_saved)
+
+
+def _apply_action(state, public_key, payload):
+    if payload.action == payload_pb2.SimpleSupplyPayload.CREATE_AGENT:
+        _create_agent(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.CREATE_RECORD:
+        _create_record(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD:
+        _transfer_record(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
+        _update_record(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.ARCHIVE_HISTORY:
+        _archive_history(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.SET_GEOFENCE:
+        _set_geofence(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.SET_MAX_SPEED:
+        _set_max_speed(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.ATTACH_RECORD:
+        _attach_record(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    elif payload.action == payload_pb2.SimpleSupplyPayload.DETACH_RECORD:
+        _detach_record(
+            state=state,
+            public_key=public_key,
+            payload=payload)
+    else:
+        raise InvalidTransaction('Unhandled action')
+
+
+def _bundle(state, public_key, payload):
+    """Applies each action of a bundle in order. Any invalid action
+    invalidates the whole bundle, and since state is only flushed once the
+    handler is done, none of the bundle's changes are written.
+    """
+    actions = payload.actions
+    if not actions:
+        raise InvalidTransaction('Bundle contains no actions')
+
+    for action in actions:
+        if action.action not in BUNDLE_ACTIONS:
+            raise InvalidTransaction(
+                'Bundles may only contain create record, update record, '
+                'and transfer record actions')
+        rules.validate_timestamp(action.timestamp)
+        _apply_action(state=state, public_key=public_key, payload=action)
 
 
 def _create_agent(state, public_key, payload):
-    if state.get_agent(public_key):
-        raise InvalidTransaction('Agent with the public key {} already '
-                                 'exists'.format(public_key))
+    rules.validate_create_agent(
+        public_key=public_key,
+        agent=state.get_agent(public_key))
+
     state.set_agent(
         public_key=public_key,
         name=payload.data.name,
@@ -90,18 +193,17 @@ def _create_agent(state, public_key, payload):
 
 
 def _create_record(state, public_key, payload):
-    if state.get_agent(public_key) is None:
-        raise InvalidTransaction('Agent with the public key {} does '
-                                 'not exist'.format(public_key))
-
-    if payload.data.record_id == '':
-        raise InvalidTransaction('No record ID provided')
-
-    if state.get_record(payload.data.record_id):
-        raise InvalidTransaction('Identifier {} belongs to an existing '
-                                 'record'.format(payload.data.record_id))
-
-    _validate_latlng(payload.data.latitude, payload.data.longitude)
+    rules.validate_create_record(
+        public_key=public_key,
+        agent=state.get_agent(public_key),
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        latitude=payload.data.latitude,
+        longitude=payload.data.longitude)
+    rules.validate_geofences(
+        geofences=state.get_geofences(),
+        latitude=payload.data.latitude,
+        longitude=payload.data.longitude)
 
     state.set_record(
         public_key=public_key,
@@ -112,20 +214,13 @@ def _create_record(state, public_key, payload):
 
 
 def _transfer_record(state, public_key, payload):
-    if state.get_agent(payload.data.receiving_agent) is None:
-        raise InvalidTransaction(
-            'Agent with the public key {} does '
-            'not exist'.format(payload.data.receiving_agent))
-
-    record = state.get_record(payload.data.record_id)
-    if record is None:
-        raise InvalidTransaction('Record with the record id {} does not '
-                                 'exist'.format(payload.data.record_id))
-
-    if not _validate_record_owner(signer_public_key=public_key,
-                                  record=record):
-        raise InvalidTransaction(
-            'Transaction signer is not the owner of the record')
+    rules.validate_transfer_record(
+        public_key=public_key,
+        receiving_agent=payload.data.receiving_agent,
+        receiver=state.get_agent(payload.data.receiving_agent),
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        parent_id=_get_parent_id(state, payload.data.record_id))
 
     state.transfer_record(
         receiving_agent=payload.data.receiving_agent,
@@ -134,17 +229,26 @@ def _transfer_record(state, public_key, payload):
 
 
 def _update_record(state, public_key, payload):
-    record = state.get_record(payload.data.record_id)
-    if record is None:
-        raise InvalidTransaction('Record with the record id {} does not '
-                                 'exist'.format(payload.data.record_id))
-
-    if not _validate_record_owner(signer_public_key=public_key,
-                                  record=record):
-        raise InvalidTransaction(
-            'Transaction signer is not the owner of the record')
-
-    _validate_latlng(payload.data.latitude, payload.data.longitude)
+    rules.validate_update_record(
+        public_key=public_key,
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        latitude=payload.data.latitude,
+        longitude=payload.data.longitude,
+        parent_id=_get_parent_id(state, payload.data.record_id))
+    geofences = state.get_geofences()
+    rules.validate_geofences(
+        geofences=geofences,
+        latitude=payload.data.latitude,
+        longitude=payload.data.longitude)
+    previous = state.get_record(payload.data.record_id).locations[-1]
+    rules.validate_speed(
+        previous=(previous.latitude, previous.longitude, previous.timestamp),
+        location=(
+            payload.data.latitude,
+            payload.data.longitude,
+            payload.timestamp),
+        max_speed=geofences.max_speed)
 
     state.update_record(
         latitude=payload.data.latitude,
@@ -153,34 +257,142 @@ def _update_record(state, public_key, payload):
         timestamp=payload.timestamp)
 
 
-def _validate_record_owner(signer_public_key, record):
-    """Validates that the public key of the signer is the latest (i.e.
-    current) owner of the record
+def _archive_history(state, public_key, payload):
+    rules.validate_archive_history(
+        public_key=public_key,
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        parent_id=_get_parent_id(state, payload.data.record_id))
+
+    if not state.archive_history(
+            record_id=payload.data.record_id,
+            cutoff=payload.data.cutoff):
+        raise InvalidTransaction(
+            'Record with the record id {} has no history from before {} '
+            'to archive'.format(payload.data.record_id, payload.data.cutoff))
+
+
+def _set_geofence(state, public_key, payload):
+    rules.validate_set_geofence(
+        public_key=public_key,
+        admins=state.get_setting(addresser.GEOFENCE_ADMINS_SETTING),
+        geofence_id=payload.data.geofence_id,
+        vertices=[
+            (vertex.latitude, vertex.longitude)
+            for vertex in payload.data.vertices
+        ])
+
+    if not state.set_geofence(
+            geofence_id=payload.data.geofence_id,
+            vertices=payload.data.vertices):
+        raise InvalidTransaction('Geofence with the geofence id {} does not '
+                                 'exist'.format(payload.data.geofence_id))
+
+
+def _set_max_speed(state, public_key, payload):
+    rules.validate_geofence_admin(
+        public_key=public_key,
+        admins=state.get_setting(addresser.GEOFENCE_ADMINS_SETTING))
+
+    state.set_max_speed(max_speed=payload.data.max_speed)
+
+
+def _attach_record(state, public_key, payload):
+    ancestors = [
+        ancestor.record_id
+        for ancestor in state.get_ancestors(payload.data.parent_id)
+    ] if payload.data.parent_id else []
+    rules.validate_attach_record(
+        public_key=public_key,
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        attached_to=_get_parent_id(state, payload.data.record_id),
+        parent_id=payload.data.parent_id,
+        parent_owners=_get_latest_owner(
+            state, (ancestors or [payload.data.parent_id])[-1]),
+        ancestors=ancestors)
+
+    state.attach_record(
+        record_id=payload.data.record_id,
+        parent_id=payload.data.parent_id)
+
+
+def _detach_record(state, public_key, payload):
+    ancestors = state.get_ancestors(payload.data.record_id)
+    rules.validate_detach_record(
+        public_key=public_key,
+        record_id=payload.data.record_id,
+        owners=_get_owners(state, payload.data.record_id),
+        root_owners=_get_latest_owner(
+            state, ancestors[-1].record_id) if ancestors else None)
+
+    state.detach_record(
+        record_id=payload.data.record_id,
+        timestamp=payload.timestamp)
+
+
+def _get_owners(state, record_id):
+    """Returns the (agent_id, timestamp) of each owner of a record, or None
+    if it does not exist
     """
-    latest_owner = max(record.owners, key=lambda obj: obj.timestamp).agent_id
-    return latest_owner == signer_public_key
+    if record_id == '':
+        return None
+    record = state.get_record(record_id)
+    if record is None:
+        return None
+    return [(owner.agent_id, owner.timestamp) for owner in record.owners]
 
 
-def _validate_latlng(latitude, longitude):
-    if not MIN_LAT <= latitude <= MAX_LAT:
-        raise InvalidTransaction('Latitude must be between -90 and 90. '
-                                 'Got {}'.format(latitude/1e6))
-    if not MIN_LNG <= longitude <= MAX_LNG:
-        raise InvalidTransaction('Longitude must be between -180 and 180. '
-                                 'Got {}'.format(longitude/1e6))
+def _get_latest_owner(state, record_id):
+    """Returns a list of only the latest owner of a record, which the rules
+    treat the same as all of its owners, or None if it does not exist. The
+    rest of its history is not parsed, so it is used for records the
+    transaction reads but does not write.
+    """
+    if record_id == '':
+        return None
+    head = state.get_record_head(record_id)
+    if head is None or head.latest_owner is None:
+        return None
+    return [head.latest_owner]
+
 
+def _get_parent_id(state, record_id):
+    record = state.get_record(record_id) if record_id else None
+    return record.parent_id if record is not None else ''
 
-def _validate_timestamp(timestamp):
-    """Validates that the client submitted timestamp for a transaction is not
-    greater than current time, within a tolerance defined by SYNC_TOLERANCE
 
-    NOTE: Timestamp validation can be challenging since the machines that are
-    submitting and validating transactions may have different system times
+def _get_action_name(action):
+    try:
+        return payload_pb2.SimpleSupplyPayload.Action.Name(action)
+    except ValueError:
+        return 'UNKNOWN'
+
+
+def _record_metrics(action_name, parse_time, handle_time, state):
+    """Reports how long each phase of applying a transaction took. Time not
+    spent waiting on the validator or (de)serializing containers is
+    attributed to validation.
     """
-    dts = datetime.datetime.utcnow()
-    current_time = round(time.mktime(dts.timetuple()) + dts.microsecond/1e6)
-    if (timestamp - current_time) > SYNC_TOLERANCE:
-        raise InvalidTransaction(
-            'Timestamp must be less than local time.'
-            ' Expected {0} in ({1}-{2}, {1}+{2})'.format(
-                timestamp, current_time, SYNC_TOLERANCE))
+    phases = dict(state.timings)
+    phases['payload_parse'] = parse_time
+    phases['validation'] = max(handle_time - sum(state.timings.values()), 0)
+    for phase, seconds in phases.items():
+        metrics.REGISTRY.observe(
+            'simple_supply_apply_seconds',
+            {'action': action_name, 'phase': phase},
+            seconds)
+
+    for direction, sizes in (('read', state.bytes_read),
+                             ('write', state.bytes_written)):
+        for size in sizes:
+            metrics.REGISTRY.observe(
+                'simple_supply_container_bytes',
+                {'action': action_name, 'direction': direction},
+                size,
+                buckets=metrics.SIZE_BUCKETS)
+
+    metrics.REGISTRY.increment(
+        'simple_supply_state_round_trips_saved_total',
+        {'action': action_name},
+        state.round_trips_saved)
@@ -14,12 +14,16 @@
 # -----------------------------------------------------------------------------
 
 import argparse
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
 import sys
 
-from sawtooth_sdk.processor.core import TransactionProcessor
-from sawtooth_sdk.processor.log import init_console_logging
 
-from simple_supply_tp.handler import SimpleSupplyHandler
+LOGGER = logging.getLogger(__name__)
+WORKER_STOP_TIMEOUT = 10
 
 
 def parse_args(args):
@@ -31,6 +35,23 @@ def parse_args(args):
         default='tcp://localhost:4004',
         help='Endpoint for the validator connection')
 
+    parser.add_argument(
+        '-w', '--workers',
+        type=_positive_int,
+        default=1,
+        help='Number of transaction processor processes to start')
+
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve Prometheus metrics on this port. With several workers,\n'
+             'each worker uses the next port after the previous one')
+
+    parser.add_argument(
+        '--metrics-host',
+        default='localhost',
+        help='Interface the metrics endpoint binds to')
+
     parser.add_argument(
         '-v', '--verbose',
         action='count',
@@ -40,13 +61,47 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            'must be at least 1, got {}'.format(value))
+    return number
+
+
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
     opts = parse_args(args)
+
+    # The SDK, the handler, and the protobuf modules they load are imported
+    # where they are used, so that bad arguments fail fast and a supervisor
+    # of several workers only loads what it needs to start them
+    from sawtooth_sdk.processor.log import init_console_logging
+    init_console_logging(verbose_level=opts.verbose)
+
+    if opts.workers > 1:
+        run_workers(opts)
+    else:
+        run_processor(opts)
+
+
+def run_processor(opts, index=0):
+    """Registers a SimpleSupplyHandler with the validator and processes
+    transactions until interrupted
+
+    Args:
+        opts (argparse.Namespace): The parsed command line options
+        index (int): The worker number, used to pick the metrics port
+    """
+    from sawtooth_sdk.processor.core import TransactionProcessor
+    from simple_supply_tp.handler import SimpleSupplyHandler
+    from simple_supply_tp.metrics import start_metrics_server
+
     processor = None
     try:
-        init_console_logging(verbose_level=opts.verbose)
+        if opts.metrics_port is not None:
+            start_metrics_server(opts.metrics_host, opts.metrics_port + index)
 
         processor = TransactionProcessor(url=opts.connect)
         handler = SimpleSupplyHandler()
@@ -59,3 +114,80 @@ def main(args=None):
     finally:
         if processor is not None:
             processor.stop()
+
+
+def run_workers(opts):
+    """Starts opts.workers processor processes, each registered with the
+    validator for the simple_supply family, and supervises them. SIGINT and
+    SIGTERM are forwarded to every worker, and if one worker exits the
+    others are stopped as well. Each worker registers with the validator on
+    its own, and logs the outcome, once it has started.
+    """
+    stopping = []
+
+    def stop(signum, _frame):
+        if not stopping:
+            LOGGER.info('Received signal %s, stopping workers', signum)
+            stopping.append(signum)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    workers = []
+    for index in range(opts.workers):
+        worker = multiprocessing.Process(
+            target=_run_worker,
+            name='worker-{}'.format(index),
+            args=(opts, index))
+        worker.start()
+        workers.append(worker)
+    LOGGER.info('Started %s transaction processor workers', len(workers))
+
+    while not stopping and all(worker.is_alive() for worker in workers):
+        multiprocessing.connection.wait(
+            [worker.sentinel for worker in workers], timeout=1)
+
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+        else:
+            LOGGER.warning('%s exited with code %s',
+                           worker.name, worker.exitcode)
+
+    for worker in workers:
+        worker.join(WORKER_STOP_TIMEOUT)
+        if worker.is_alive():
+            LOGGER.warning('%s did not stop, killing it', worker.name)
+            # Process.kill() is only available from Python 3.7
+            os.kill(worker.pid, signal.SIGKILL)
+            worker.join()
+
+
+def _run_worker(opts, index):
+    name = 'worker-{}'.format(index)
+    for log_handler in logging.getLogger().handlers:
+        log_handler.setFormatter(
+            _WorkerFormatter(name, log_handler.formatter))
+
+    # The supervisor decides when workers stop; SIGTERM is how it says so
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    run_processor(opts, index=index)
+
+
+def _raise_keyboard_interrupt(_signum, _frame):
+    raise KeyboardInterrupt()
+
+
+class _WorkerFormatter(logging.Formatter):
+    """Prefixes every formatted log line with the name of the worker
+    process, leaving the record itself unchanged for other handlers
+    """
+    def __init__(self, prefix, formatter=None):
+        super().__init__()
+        self._prefix = '[{}] '.format(prefix)
+        self._formatter = formatter or logging.Formatter()
+
+    def format(self, record):
+        return self._prefix + self._formatter.format(record)
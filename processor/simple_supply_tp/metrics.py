@@ -0,0 +1,160 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import logging
+from socketserver import ThreadingMixIn
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (
+    64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram(object):
+    """Cumulative histogram in the shape Prometheus expects
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry(object):
+    """Holds the counters and histograms of a process and renders them in
+    the Prometheus text exposition format
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def increment(self, name, labels, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.extend(self._header(name, 'counter'))
+                for (key_name, labels), value in sorted(
+                        self._counters.items()):
+                    if key_name == name:
+                        lines.append('{}{} {}'.format(
+                            name, _format_labels(labels), value))
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.extend(self._header(name, 'histogram'))
+                for (key_name, labels), histogram in sorted(
+                        self._histograms.items()):
+                    if key_name == name:
+                        lines.extend(_render_histogram(
+                            name, labels, histogram))
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, name, metric_type):
+        if name in self._help:
+            yield '# HELP {} {}'.format(name, self._help[name])
+        yield '# TYPE {} {}'.format(name, metric_type)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def start_metrics_server(host, port, registry=REGISTRY):
+    """Serves the registry's metrics at http://host:port/metrics from a
+    daemon thread
+
+    Returns:
+        HTTPServer: The running server
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header(
+                'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            LOGGER.debug(format, *args)
+
+    server = _ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    LOGGER.info('Serving metrics on http://%s:%s/metrics', host, port)
+    return server
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, value) for key, value in pairs) + '}'
+
+
+def _render_histogram(name, labels, histogram):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        yield '{}_bucket{} {}'.format(
+            name, _format_labels(labels, [('le', repr(float(bound)))]), count)
+    yield '{}_bucket{} {}'.format(
+        name, _format_labels(labels, [('le', '+Inf')]), histogram.count)
+    yield '{}_sum{} {}'.format(name, _format_labels(labels), histogram.sum)
+    yield '{}_count{} {}'.format(
+        name, _format_labels(labels), histogram.count)
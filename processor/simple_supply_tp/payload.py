@@ -21,13 +21,20 @@ from simple_supply_protobuf import payload_pb2
 class SimpleSupplyPayload(object):
 
     def __init__(self, payload):
-        self._transaction = payload_pb2.SimpleSupplyPayload()
-        self._transaction.ParseFromString(payload)
+        if isinstance(payload, payload_pb2.SimpleSupplyPayload):
+            self._transaction = payload
+        else:
+            self._transaction = payload_pb2.SimpleSupplyPayload()
+            self._transaction.ParseFromString(payload)
 
     @property
     def action(self):
         return self._transaction.action
 
+    @property
+    def tenant(self):
+        return self._transaction.tenant
+
     @property
     def data(self):
         if self._transaction.HasField('create_agent') and \
@@ -50,8 +57,44 @@ class SimpleSupplyPayload(object):
                 payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
             return self._transaction.update_record
 
+        if self._transaction.HasField('bundle') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.BUNDLE:
+            return self._transaction.bundle
+
+        if self._transaction.HasField('archive_history') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.ARCHIVE_HISTORY:
+            return self._transaction.archive_history
+
+        if self._transaction.HasField('set_geofence') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.SET_GEOFENCE:
+            return self._transaction.set_geofence
+
+        if self._transaction.HasField('set_max_speed') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.SET_MAX_SPEED:
+            return self._transaction.set_max_speed
+
+        if self._transaction.HasField('attach_record') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.ATTACH_RECORD:
+            return self._transaction.attach_record
+
+        if self._transaction.HasField('detach_record') and \
+            self._transaction.action == \
+                payload_pb2.SimpleSupplyPayload.DETACH_RECORD:
+            return self._transaction.detach_record
+
         raise InvalidTransaction('Action does not match payload data')
 
+    @property
+    def actions(self):
+        """list of SimpleSupplyPayload: The ordered actions of a bundle
+        """
+        return [SimpleSupplyPayload(action) for action in self.data.actions]
+
     @property
     def timestamp(self):
         return self._transaction.timestamp
@@ -13,16 +13,145 @@
 # limitations under the License.
 # -----------------------------------------------------------------------------
 
+import bisect
+import collections
+import hashlib
+import itertools
+import time
+
+from sawtooth_sdk.protobuf import setting_pb2
+
 from simple_supply_addressing import addresser
 
+from simple_supply_encoding import events
+from simple_supply_encoding import wire
+from simple_supply_encoding.history import commit_history
+from simple_supply_encoding.history import pack_history
+from simple_supply_encoding.history import unpack_history
+
 from simple_supply_protobuf import agent_pb2
+from simple_supply_protobuf import geofence_pb2
+from simple_supply_protobuf import holding_pb2
+from simple_supply_protobuf import location_index_pb2
 from simple_supply_protobuf import record_pb2
 
+from simple_supply_validation.geofences import GeofenceIndex
+
+
+# The number of history entries, owners and locations combined, a record
+# keeps at its own address before they are sealed into a segment
+HISTORY_SEGMENT_SIZE = 64
+
+# Containers whose entries carry a record history, which is read in either
+# encoding but always written packed
+HISTORY_CONTAINERS = (
+    record_pb2.RecordContainer,
+    record_pb2.RecordSegmentContainer,
+)
+
+# Geofence indexes built by any transaction, keyed by the digest of the
+# catalog they were built from, so they are only rebuilt when the
+# geofences change. A few are kept so that indexes for competing forks do
+# not evict each other
+GEOFENCE_INDEX_CACHE_SIZE = 4
+_geofence_indexes = collections.OrderedDict()
+
 
 class SimpleSupplyState(object):
-    def __init__(self, context, timeout=2):
+    """Per-transaction view of Simple Supply state
+
+    Containers are parsed once and cached by address for the lifetime of the
+    object, so repeated reads of the same address do not go back to the
+    validator. Writes are applied to the cached containers and only sent to
+    the validator, in a single set_state call, when flush() is called.
+    Containers left empty are deleted instead. Events describing
+    each change are held back until then too, so invalid transactions never
+    emit any.
+    """
+    def __init__(self, context, timeout=2, tenant=''):
         self._context = context
         self._timeout = timeout
+        self._tenant = tenant
+        self._containers = {}
+        self._data = {}
+        self._heads = {}
+        self._dirty = set()
+        self._events = []
+        self._round_trips_saved = 0
+        self._timings = collections.Counter()
+        self._bytes_read = []
+        self._bytes_written = []
+
+    @property
+    def round_trips_saved(self):
+        """int: Number of get_state/set_state calls avoided by the cache
+        """
+        return self._round_trips_saved
+
+    @property
+    def timings(self):
+        """collections.Counter: Seconds spent waiting on get_state and
+        set_state, and (de)serializing containers
+        """
+        return self._timings
+
+    @property
+    def bytes_read(self):
+        """list of int: Size of each container read from state
+        """
+        return self._bytes_read
+
+    @property
+    def bytes_written(self):
+        """list of int: Size of each container written to state
+        """
+        return self._bytes_written
+
+    def flush(self):
+        """Writes every modified container back to state in one call, and
+        deletes any that were emptied in another, then sends the events
+        """
+        self._flush_state()
+
+        start = time.perf_counter()
+        for event_type, attributes, data in self._events:
+            self._context.add_event(
+                event_type=event_type,
+                attributes=attributes,
+                data=data,
+                timeout=self._timeout)
+        self._timings['add_event'] += time.perf_counter() - start
+        del self._events[:]
+
+    def _flush_state(self):
+        if not self._dirty:
+            return
+
+        start = time.perf_counter()
+        updated_state = {}
+        deleted_addresses = []
+        for address in self._dirty:
+            container = self._containers[address]
+            if container.ByteSize() == 0:
+                deleted_addresses.append(address)
+                continue
+            if isinstance(container, HISTORY_CONTAINERS):
+                for entry in container.entries:
+                    pack_history(entry)
+            updated_state[address] = container.SerializeToString()
+        serialized = time.perf_counter()
+        if updated_state:
+            self._context.set_state(updated_state, timeout=self._timeout)
+        if deleted_addresses:
+            self._context.delete_state(
+                deleted_addresses, timeout=self._timeout)
+        self._timings['serialize'] += serialized - start
+        self._timings['set_state'] += time.perf_counter() - serialized
+        self._bytes_written.extend(
+            len(data) for data in updated_state.values())
+        self._round_trips_saved -= \
+            bool(updated_state) + bool(deleted_addresses)
+        self._dirty.clear()
 
     def get_agent(self, public_key):
         """Gets the agent associated with the public_key
@@ -33,15 +162,11 @@ class SimpleSupplyState(object):
         Returns:
             agent_pb2.Agent: Agent with the provided public_key
         """
-        address = addresser.get_agent_address(public_key)
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container = agent_pb2.AgentContainer()
-            container.ParseFromString(state_entries[0].data)
-            for agent in container.entries:
-                if agent.public_key == public_key:
-                    return agent
+        address = addresser.get_agent_address(public_key, self._tenant)
+        container = self._get_container(address, agent_pb2.AgentContainer)
+        for agent in container.entries:
+            if agent.public_key == public_key:
+                return agent
 
         return None
 
@@ -53,21 +178,14 @@ class SimpleSupplyState(object):
             name (str): The human-readable name of the agent
             timestamp (int): Unix UTC timestamp of when the agent was created
         """
-        address = addresser.get_agent_address(public_key)
+        address = addresser.get_agent_address(public_key, self._tenant)
         agent = agent_pb2.Agent(
             public_key=public_key, name=name, timestamp=timestamp)
-        container = agent_pb2.AgentContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
+        container = self._get_container(address, agent_pb2.AgentContainer)
 
         container.entries.extend([agent])
-        data = container.SerializeToString()
-
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        self._mark_dirty(address)
+        self._add_event(events.AGENT_CREATED, agent, agent=public_key)
 
     def get_record(self, record_id):
         """Gets the record associated with the record_id
@@ -78,18 +196,41 @@ class SimpleSupplyState(object):
         Returns:
             record_pb2.Record: Record with the provided record_id
         """
-        address = addresser.get_record_address(record_id)
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container = record_pb2.RecordContainer()
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    return record
+        address = addresser.get_record_address(record_id, self._tenant)
+        container = self._get_container(address, record_pb2.RecordContainer)
+        for record in container.entries:
+            if record.record_id == record_id:
+                return record
 
         return None
 
+    def get_record_head(self, record_id):
+        """Gets the parent and latest owner and location of a record. Unless
+        its container was already parsed, they are scanned from its
+        serialized container, without parsing the rest of its history, so
+        records that are only read stay cheap however long their history.
+
+        Args:
+            record_id (str): The id of the record
+
+        Returns:
+            wire.RecordHead: The head of the record with the provided
+            record_id
+        """
+        address = addresser.get_record_address(record_id, self._tenant)
+        if address in self._containers:
+            record = self.get_record(record_id)
+            if record is None:
+                return None
+            return wire.get_record_head(record)
+
+        if record_id not in self._heads:
+            data = self._read(address)
+            start = time.perf_counter()
+            self._heads[record_id] = wire.scan_record(data, record_id)
+            self._timings['deserialize'] += time.perf_counter() - start
+        return self._heads[record_id]
+
     def set_record(self,
                    public_key,
                    latitude,
@@ -105,7 +246,7 @@ class SimpleSupplyState(object):
             record_id (str): Unique ID of the record
             timestamp (int): Unix UTC timestamp of when the agent was created
         """
-        address = addresser.get_record_address(record_id)
+        address = addresser.get_record_address(record_id, self._tenant)
         owner = record_pb2.Record.Owner(
             agent_id=public_key,
             timestamp=timestamp)
@@ -117,52 +258,515 @@ class SimpleSupplyState(object):
             record_id=record_id,
             owners=[owner],
             locations=[location])
-        container = record_pb2.RecordContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
+        container = self._get_container(address, record_pb2.RecordContainer)
 
+        self._add_event(
+            events.RECORD_CREATED,
+            record,
+            record_id=record_id,
+            agent=public_key,
+            geohash=addresser.get_geohash(latitude, longitude))
         container.entries.extend([record])
-        data = container.SerializeToString()
-
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        self._mark_dirty(address)
+        self._index_location(record_id, latitude, longitude)
+        self._add_holding(public_key, record_id, timestamp)
 
     def transfer_record(self, receiving_agent, record_id, timestamp):
         owner = record_pb2.Record.Owner(
             agent_id=receiving_agent,
             timestamp=timestamp)
-        address = addresser.get_record_address(record_id)
-        container = record_pb2.RecordContainer()
-        state_entries = self._context.get_state(
-            addresses=[address], timeout=self._timeout)
-        if state_entries:
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    record.owners.extend([owner])
-        data = container.SerializeToString()
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+        address = addresser.get_record_address(record_id, self._tenant)
+        container = self._get_container(address, record_pb2.RecordContainer)
+        for record in container.entries:
+            if record.record_id == record_id:
+                previous = _get_owner(record)
+                record.owners.extend([owner])
+                self._seal_history(record)
+                # A transfer back-dated before the current owner's does not
+                # change who the rules treat as the owner
+                current = _get_owner(record)
+                if current.agent_id != previous.agent_id:
+                    self._move_holding(previous.agent_id, current, record_id)
+                self._add_event(
+                    events.RECORD_TRANSFERRED,
+                    owner,
+                    record_id=record_id,
+                    agent=receiving_agent,
+                    geohash=addresser.get_geohash(
+                        record.locations[-1].latitude,
+                        record.locations[-1].longitude))
+        self._mark_dirty(address)
 
     def update_record(self, latitude, longitude, record_id, timestamp):
         location = record_pb2.Record.Location(
             latitude=latitude,
             longitude=longitude,
             timestamp=timestamp)
-        address = addresser.get_record_address(record_id)
-        container = record_pb2.RecordContainer()
+        address = addresser.get_record_address(record_id, self._tenant)
+        container = self._get_container(address, record_pb2.RecordContainer)
+        for record in container.entries:
+            if record.record_id == record_id:
+                previous = record.locations[-1]
+                record.locations.extend([location])
+                self._seal_history(record)
+                self._move_location(record_id, previous, location)
+                self._add_event(
+                    events.RECORD_UPDATED,
+                    location,
+                    record_id=record_id,
+                    agent=_get_owner(record).agent_id,
+                    geohash=addresser.get_geohash(latitude, longitude))
+        self._mark_dirty(address)
+
+    def get_ancestors(self, record_id):
+        """Gets the records a record is attached to, directly or through
+        other records
+
+        Args:
+            record_id (str): The id of the record
+
+        Returns:
+            list of wire.RecordHead: Its parent first, and the record at
+            the top of its hierarchy last
+        """
+        ancestors = []
+        record = self.get_record_head(record_id)
+        while record is not None and record.parent_id:
+            record = self.get_record_head(record.parent_id)
+            if record is not None:
+                ancestors.append(record)
+        return ancestors
+
+    def attach_record(self, record_id, parent_id):
+        """Attaches a record to a parent, whose owner and location it takes
+        until it is detached. Only the attached record is written.
+
+        Args:
+            record_id (str): The id of the record to attach
+            parent_id (str): The id of the record to attach it to
+        """
+        record = self.get_record(record_id)
+        record.parent_id = parent_id
+        self._mark_dirty(addresser.get_record_address(record_id, self._tenant))
+        self._add_event(
+            events.RECORD_ATTACHED,
+            record_pb2.Record(record_id=record_id, parent_id=parent_id),
+            record_id=record_id,
+            parent=parent_id,
+            agent=_get_owner(record).agent_id)
+
+    def detach_record(self, record_id, timestamp):
+        """Detaches a record from its parent. The owner and location it
+        inherited from the top of its hierarchy become its own, as of the
+        timestamp.
+
+        Args:
+            record_id (str): The id of the record to detach
+            timestamp (int): Unix UTC timestamp of when it was detached
+        """
+        root = self.get_ancestors(record_id)[-1]
+        agent_id = root.latest_owner[0]
+        latitude, longitude, _ = root.location
+
+        record = self.get_record(record_id)
+        record.parent_id = ''
+        self._mark_dirty(addresser.get_record_address(record_id, self._tenant))
+        self._add_event(
+            events.RECORD_DETACHED,
+            record_pb2.Record(record_id=record_id),
+            record_id=record_id,
+            agent=agent_id)
+
+        if _get_owner(record).agent_id != agent_id:
+            self.transfer_record(
+                receiving_agent=agent_id,
+                record_id=record_id,
+                timestamp=timestamp)
+        latest = record.locations[-1]
+        if (latest.latitude, latest.longitude) != (latitude, longitude):
+            self.update_record(
+                latitude=latitude,
+                longitude=longitude,
+                record_id=record_id,
+                timestamp=timestamp)
+
+    def archive_history(self, record_id, cutoff):
+        """Replaces the oldest part of a record's history, up to the first
+        entry from the cutoff or later, with a commitment to it. Sealed
+        segments are archived whole and removed from state. Entries at the
+        record's own address are only archived once all of its segments
+        are, and the latest owner and location are always kept.
+
+        Args:
+            record_id (str): Unique ID of the record
+            cutoff (int): Unix UTC timestamp history is archived before
+
+        Returns:
+            bool: Whether any history was archived
+        """
+        record = self.get_record(record_id)
+        archive = record.archive
+        archived = record_pb2.RecordSegment(record_id=record_id)
+
+        while archive.archived_segments < record.segment_count:
+            address = addresser.get_record_segment_address(
+                record_id, archive.archived_segments, self._tenant)
+            container = self._get_container(
+                address, record_pb2.RecordSegmentContainer)
+            segment = next(
+                (entry for entry in container.entries
+                 if entry.record_id == record_id),
+                None)
+            if segment is not None and any(
+                    entry.timestamp >= cutoff
+                    for entry in itertools.chain(
+                        segment.owners, segment.locations)):
+                break
+            if segment is not None:
+                archived.owners.extend(segment.owners)
+                archived.locations.extend(segment.locations)
+                container.entries.remove(segment)
+                self._mark_dirty(address)
+            archive.archived_segments += 1
+
+        owner_count = 0
+        location_count = 0
+        if archive.archived_segments == record.segment_count:
+            owner_count = _count_before(
+                record.owners[:_get_owner_index(record)], cutoff)
+            location_count = _count_before(record.locations[:-1], cutoff)
+        head = record_pb2.RecordSegment(
+            record_id=record_id,
+            owners=record.owners[:owner_count],
+            locations=record.locations[:location_count])
+        archived.owners.extend(head.owners)
+        archived.locations.extend(head.locations)
+        if not archived.owners and not archived.locations:
+            return False
+
+        archive.commitment = commit_history(archive.commitment, archived)
+        timestamps = [
+            entry.timestamp
+            for entry in itertools.chain(archived.owners, archived.locations)
+        ]
+        if archive.owner_count or archive.location_count:
+            timestamps.extend([archive.start_timestamp, archive.end_timestamp])
+        archive.start_timestamp = min(timestamps)
+        archive.end_timestamp = max(timestamps)
+        archive.owner_count += len(archived.owners)
+        archive.location_count += len(archived.locations)
+
+        del record.owners[:owner_count]
+        del record.locations[:location_count]
+        self._mark_dirty(addresser.get_record_address(record_id, self._tenant))
+        self._add_event(
+            events.HISTORY_ARCHIVED,
+            head,
+            record_id=record_id,
+            agent=_get_owner(record).agent_id)
+        return True
+
+    def get_setting(self, key):
+        """Gets the value of a Sawtooth setting
+
+        Args:
+            key (str): The setting's key
+
+        Returns:
+            str: The setting's value, or None if it is not set
+        """
+        setting = self._get_container(
+            addresser.get_setting_address(key), setting_pb2.Setting)
+        for entry in setting.entries:
+            if entry.key == key:
+                return entry.value
+
+        return None
+
+    def get_geofences(self):
+        """Gets an index of the current geofences, along with the maximum
+        speed. Only the geofence registry is read, unless the geofences
+        have changed since an index was last built.
+
+        Returns:
+            GeofenceIndex: The current geofences
+        """
+        registry = self._get_registry()
+        if not registry.catalog_digest:
+            return GeofenceIndex(max_speed=registry.max_speed)
+
+        key = (registry.catalog_digest, registry.max_speed)
+        if key in _geofence_indexes:
+            _geofence_indexes.move_to_end(key)
+            return _geofence_indexes[key]
+
+        geofences = []
+        for entry in self._get_catalog().entries:
+            geofence = self._get_geofence(entry.geofence_id)
+            geofences.append((
+                geofence.geofence_id,
+                [(vertex.latitude, vertex.longitude)
+                 for vertex in geofence.vertices]))
+        index = GeofenceIndex(geofences, max_speed=registry.max_speed)
+
+        _geofence_indexes[key] = index
+        if len(_geofence_indexes) > GEOFENCE_INDEX_CACHE_SIZE:
+            _geofence_indexes.popitem(last=False)
+        return index
+
+    def set_geofence(self, geofence_id, vertices):
+        """Creates or replaces a geofence, or removes it if it has no
+        vertices
+
+        Args:
+            geofence_id (str): The id of the geofence
+            vertices (list of geofence_pb2.Geofence.Vertex): The corners of
+                the geofence polygon, in order
+
+        Returns:
+            bool: False if a geofence to remove did not exist
+        """
+        address = addresser.get_geofence_address(geofence_id, self._tenant)
+        container = self._get_container(
+            address, geofence_pb2.GeofenceContainer)
+        catalog = self._get_catalog()
+        ids = [entry.geofence_id for entry in catalog.entries]
+        position = bisect.bisect_left(ids, geofence_id)
+        exists = position < len(ids) and ids[position] == geofence_id
+
+        for geofence in container.entries:
+            if geofence.geofence_id == geofence_id:
+                container.entries.remove(geofence)
+                break
+        if exists:
+            del catalog.entries[position]
+        elif not vertices:
+            return False
+
+        if vertices:
+            geofence = geofence_pb2.Geofence(
+                geofence_id=geofence_id, vertices=vertices)
+            container.entries.extend([geofence])
+            catalog.entries.insert(
+                position,
+                geofence_pb2.GeofenceCatalog.Entry(
+                    geofence_id=geofence_id,
+                    digest=_digest(geofence)))
+
+        registry = self._get_registry()
+        registry.catalog_digest = _digest(catalog) if catalog.entries else ''
+        registry.version += 1
+        self._mark_dirty(address)
+        self._mark_dirty(addresser.get_geofence_catalog_address(self._tenant))
+        self._mark_dirty(addresser.get_geofence_registry_address(self._tenant))
+        return True
+
+    def set_max_speed(self, max_speed):
+        """Sets the fastest records may move between consecutive locations
+
+        Args:
+            max_speed (int): In meters per second. Zero disables the check
+        """
+        registry = self._get_registry()
+        registry.max_speed = max_speed
+        registry.version += 1
+        self._mark_dirty(addresser.get_geofence_registry_address(self._tenant))
+
+    def _get_registry(self):
+        return self._get_container(
+            addresser.get_geofence_registry_address(self._tenant),
+            geofence_pb2.GeofenceRegistry)
+
+    def _get_catalog(self):
+        return self._get_container(
+            addresser.get_geofence_catalog_address(self._tenant),
+            geofence_pb2.GeofenceCatalog)
+
+    def _get_geofence(self, geofence_id):
+        container = self._get_container(
+            addresser.get_geofence_address(geofence_id, self._tenant),
+            geofence_pb2.GeofenceContainer)
+        for geofence in container.entries:
+            if geofence.geofence_id == geofence_id:
+                return geofence
+
+        return geofence_pb2.Geofence(geofence_id=geofence_id)
+
+    def _move_location(self, record_id, previous, location):
+        """Moves the record's location index entry when an update takes it
+        into a different geohash cell
+        """
+        previous_cell = addresser.get_geohash(
+            previous.latitude, previous.longitude)
+        cell = addresser.get_geohash(location.latitude, location.longitude)
+        if cell == previous_cell:
+            return
+
+        address = addresser.get_geohash_index_address(
+            previous_cell, record_id, self._tenant)
+        container = self._get_container(
+            address, location_index_pb2.LocationIndexContainer)
+        entries = [
+            entry for entry in container.entries
+            if entry.record_id != record_id
+        ]
+        # Records created before the index existed have no entry to remove
+        if len(entries) != len(container.entries):
+            del container.entries[:]
+            container.entries.extend(entries)
+            self._mark_dirty(address)
+
+        self._index_location(record_id, location.latitude, location.longitude)
+
+    def _index_location(self, record_id, latitude, longitude):
+        cell = addresser.get_geohash(latitude, longitude)
+        address = addresser.get_geohash_index_address(
+            cell, record_id, self._tenant)
+        container = self._get_container(
+            address, location_index_pb2.LocationIndexContainer)
+        container.entries.extend([
+            location_index_pb2.LocationIndexEntry(
+                record_id=record_id, geohash=cell)
+        ])
+        self._mark_dirty(address)
+
+    def _move_holding(self, previous_agent, owner, record_id):
+        """Moves a record from its previous owner's holdings to its new
+        owner's
+        """
+        address = addresser.get_holding_address(
+            previous_agent, record_id, self._tenant)
+        container = self._get_container(
+            address, holding_pb2.HoldingContainer)
+        entries = [
+            entry for entry in container.entries
+            if entry.record_id != record_id
+        ]
+        # Records created before holdings existed have no entry to remove
+        if len(entries) != len(container.entries):
+            del container.entries[:]
+            container.entries.extend(entries)
+            self._mark_dirty(address)
+
+        self._add_holding(owner.agent_id, record_id, owner.timestamp)
+
+    def _add_holding(self, public_key, record_id, timestamp):
+        address = addresser.get_holding_address(
+            public_key, record_id, self._tenant)
+        container = self._get_container(
+            address, holding_pb2.HoldingContainer)
+        container.entries.extend([
+            holding_pb2.Holding(record_id=record_id, timestamp=timestamp)
+        ])
+        self._mark_dirty(address)
+
+    def _seal_history(self, record):
+        """Moves the record's history, except for the current owner and the
+        latest location, into a new segment once it outgrows
+        HISTORY_SEGMENT_SIZE. Owners entered after the current one, by
+        back-dated transfers, are kept with it. This keeps the cost of
+        reading and writing the record constant however long its history
+        is. Records written before segments existed are migrated the first
+        time they are updated.
+        """
+        if len(record.owners) + len(record.locations) <= HISTORY_SEGMENT_SIZE:
+            return
+
+        owner_count = _get_owner_index(record)
+        address = addresser.get_record_segment_address(
+            record.record_id, record.segment_count, self._tenant)
+        segment = record_pb2.RecordSegment(
+            record_id=record.record_id,
+            index=record.segment_count,
+            owners=record.owners[:owner_count],
+            locations=record.locations[:-1])
+        container = self._get_container(
+            address, record_pb2.RecordSegmentContainer)
+        container.entries.extend([segment])
+        self._mark_dirty(address)
+
+        del record.owners[:owner_count]
+        del record.locations[:-1]
+        record.segment_count += 1
+
+    def _add_event(self, event_type, message, **attributes):
+        # Events outside the default tenant carry their tenant, so
+        # subscriptions can be limited to one
+        if self._tenant:
+            attributes['tenant'] = self._tenant
+        self._events.append((
+            event_type,
+            sorted(attributes.items()),
+            message.SerializeToString()))
+
+    def _get_container(self, address, container_class):
+        if address in self._containers:
+            self._round_trips_saved += 1
+            return self._containers[address]
+
+        container = container_class()
+        data = self._read(address)
+        start = time.perf_counter()
+        if data:
+            container.ParseFromString(data)
+            if isinstance(container, HISTORY_CONTAINERS):
+                for entry in container.entries:
+                    unpack_history(entry)
+        self._timings['deserialize'] += time.perf_counter() - start
+
+        self._containers[address] = container
+        return container
+
+    def _read(self, address):
+        """Returns the serialized data at an address, reading it from the
+        validator only once even if it is scanned before it is parsed
+        """
+        if address in self._data:
+            self._round_trips_saved += 1
+            return self._data[address]
+
+        start = time.perf_counter()
         state_entries = self._context.get_state(
             addresses=[address], timeout=self._timeout)
+        self._timings['get_state'] += time.perf_counter() - start
+        data = state_entries[0].data if state_entries else b''
         if state_entries:
-            container.ParseFromString(state_entries[0].data)
-            for record in container.entries:
-                if record.record_id == record_id:
-                    record.locations.extend([location])
-        data = container.SerializeToString()
-        updated_state = {}
-        updated_state[address] = data
-        self._context.set_state(updated_state, timeout=self._timeout)
+            self._bytes_read.append(len(data))
+
+        self._data[address] = data
+        return data
+
+    def _mark_dirty(self, address):
+        # Every write would have been its own set_state call; flush() takes
+        # one back when it sends them all together
+        self._dirty.add(address)
+        self._round_trips_saved += 1
+
+
+def _digest(message):
+    return hashlib.sha512(message.SerializeToString()).hexdigest()
+
+
+def _get_owner(record):
+    return record.owners[_get_owner_index(record)]
+
+
+def _get_owner_index(record):
+    """Returns the position of the record's current owner, the one with the
+    latest timestamp and the first of them if several share it, as
+    rules.validate_record_owner decides
+    """
+    return max(
+        range(len(record.owners)),
+        key=lambda index: record.owners[index].timestamp)
+
+
+def _count_before(entries, cutoff):
+    """Returns how many entries, from the first, are older than the cutoff
+    """
+    count = 0
+    for entry in entries:
+        if entry.timestamp >= cutoff:
+            break
+        count += 1
+    return count
@@ -26,6 +26,166 @@ SELECT max(block_num) FROM blocks
 """
 LOGGER = logging.getLogger(__name__)
 
+# The current owner and location of each record, which an attached record
+# takes from the record at the top of its hierarchy. Walks every record up
+# to the top in one query, so a listing of records does not query the
+# ancestors, owner and location of each in turn. The current location is
+# the last entry at the record's own address, where the segment is null,
+# and the current owner the first entry with the latest timestamp, as the
+# processor decides; the subscriber writes a record's entries in order, so
+# their ids follow it. Formatted with the latest block number and a
+# condition selecting the records to resolve
+RECORD_CUSTODY = """
+    WITH RECURSIVE custody (record_id, custodian_id, parent_id, depth) AS (
+        SELECT record_id, record_id, parent_id, 0 FROM records
+        WHERE ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        {1}
+        UNION ALL
+        SELECT custody.record_id, records.record_id, records.parent_id,
+            custody.depth + 1
+        FROM records JOIN custody
+        ON records.record_id = custody.parent_id
+        WHERE ({0}) >= records.start_block_num
+        AND ({0}) < records.end_block_num
+    ),
+    custodians AS (
+        SELECT record_id, custodian_id FROM (
+            SELECT record_id, custodian_id, row_number() OVER (
+                PARTITION BY record_id ORDER BY depth DESC) AS rank
+            FROM custody
+        ) AS ranked
+        WHERE rank = 1
+    ),
+    owners AS (
+        SELECT record_id, agent_id, timestamp, row_number() OVER (
+            PARTITION BY record_id ORDER BY timestamp DESC, id) AS rank
+        FROM record_owners
+        WHERE record_id IN (SELECT custodian_id FROM custodians)
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+    ),
+    locations AS (
+        SELECT record_id, latitude, longitude, timestamp, row_number() OVER (
+            PARTITION BY record_id ORDER BY id DESC) AS rank
+        FROM record_locations
+        WHERE record_id IN (SELECT custodian_id FROM custodians)
+        AND segment IS NULL
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+    )
+    SELECT
+        custodians.record_id,
+        owners.agent_id,
+        owners.timestamp AS owner_timestamp,
+        locations.latitude,
+        locations.longitude,
+        locations.timestamp AS location_timestamp
+    FROM custodians
+    LEFT JOIN owners
+    ON owners.record_id = custodians.custodian_id AND owners.rank = 1
+    LEFT JOIN locations
+    ON locations.record_id = custodians.custodian_id AND locations.rank = 1
+"""
+
+# The statements run by Database, by name, with the types of their
+# parameters. Each is prepared the first time it is executed on a
+# connection, so the server parses and plans it once rather than for every
+# request, and values are always passed as parameters
+STATEMENTS = {
+    'insert_auth': (('varchar', 'varchar', 'varchar'), """
+        INSERT INTO auth (
+            public_key,
+            encrypted_private_key,
+            hashed_password
+        )
+        VALUES ($1, $2, $3)
+        """),
+    'fetch_auth': (('varchar',), """
+        SELECT * FROM auth WHERE public_key = $1
+        """),
+
+    'fetch_agent': (('varchar',), """
+        SELECT public_key, name, timestamp FROM agents
+        WHERE public_key = $1
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_all_agents': ((), """
+        SELECT public_key, name, timestamp FROM agents
+        WHERE ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        """.format(LATEST_BLOCK_NUM)),
+
+    'fetch_record': (('varchar',), """
+        SELECT record_id, parent_id FROM records
+        WHERE record_id = $1
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_all_records': ((), """
+        SELECT record_id, parent_id FROM records
+        WHERE ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_record_locations': (('varchar',), """
+        SELECT latitude, longitude, timestamp FROM record_locations
+        WHERE record_id = $1
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        ORDER BY timestamp
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_record_owners': (('varchar',), """
+        SELECT agent_id, timestamp FROM record_owners
+        WHERE record_id = $1
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        ORDER BY timestamp
+        """.format(LATEST_BLOCK_NUM)),
+    # The current owner is the first entry with the latest timestamp, as the
+    # processor decides. The subscriber writes a record's entries in order,
+    # so their ids follow it
+    'fetch_record_owner': (('varchar',), """
+        SELECT agent_id, timestamp FROM record_owners
+        WHERE record_id = $1
+        AND ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        ORDER BY timestamp DESC, id
+        LIMIT 1
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_record_ancestors': (('varchar',), """
+        WITH RECURSIVE ancestors (record_id, parent_id, depth) AS (
+            SELECT record_id, parent_id, 0 FROM records
+            WHERE record_id = $1
+            AND ({0}) >= start_block_num
+            AND ({0}) < end_block_num
+            UNION ALL
+            SELECT records.record_id, records.parent_id, ancestors.depth + 1
+            FROM records JOIN ancestors
+            ON records.record_id = ancestors.parent_id
+            WHERE ({0}) >= records.start_block_num
+            AND ({0}) < records.end_block_num
+        )
+        SELECT record_id FROM ancestors WHERE depth > 0 ORDER BY depth
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_all_record_locations': ((), """
+        SELECT record_id, latitude, longitude, timestamp FROM record_locations
+        WHERE ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        ORDER BY record_id, timestamp
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_all_record_owners': ((), """
+        SELECT record_id, agent_id, timestamp FROM record_owners
+        WHERE ({0}) >= start_block_num
+        AND ({0}) < end_block_num
+        ORDER BY record_id, timestamp
+        """.format(LATEST_BLOCK_NUM)),
+    'fetch_record_custody': (('varchar',), RECORD_CUSTODY.format(
+        LATEST_BLOCK_NUM, 'AND record_id = $1')),
+    'fetch_all_record_custody': ((), RECORD_CUSTODY.format(
+        LATEST_BLOCK_NUM, '')),
+}
+
 
 class Database(object):
     """Manages connection to the postgres database and makes async queries
@@ -35,6 +195,9 @@ class Database(object):
             name, user, password, host, port)
         self._loop = loop
         self._conn = None
+        # The statements prepared, or being prepared, on the connection,
+        # each with a future of whether it was prepared
+        self._prepared = {}
 
     async def connect(self, retries=5, initial_delay=1, backoff=2):
         """Initializes a connection to the database
@@ -45,6 +208,7 @@ class Database(object):
             backoff (int): Multiplies the delay after each retry
         """
         LOGGER.info('Connecting to database')
+        self._prepared.clear()
 
         delay = initial_delay
         for attempt in range(retries):
@@ -75,127 +239,150 @@ class Database(object):
                                 public_key,
                                 encrypted_private_key,
                                 hashed_password):
-        insert = """
-        INSERT INTO auth (
-            public_key,
-            encrypted_private_key,
-            hashed_password
-        )
-        VALUES ('{}', '{}', '{}');
-        """.format(
-            public_key,
-            encrypted_private_key.hex(),
-            hashed_password.hex())
-
         async with self._conn.cursor() as cursor:
-            await cursor.execute(insert)
+            await self._execute(
+                cursor,
+                'insert_auth',
+                public_key,
+                encrypted_private_key.hex(),
+                hashed_password.hex())
 
         self._conn.commit()
 
     async def fetch_agent_resource(self, public_key):
-        fetch = """
-        SELECT public_key, name, timestamp FROM agents
-        WHERE public_key='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(public_key, LATEST_BLOCK_NUM)
-
         async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            await cursor.execute(fetch)
+            await self._execute(cursor, 'fetch_agent', public_key)
             return await cursor.fetchone()
 
     async def fetch_all_agent_resources(self):
-        fetch = """
-        SELECT public_key, name, timestamp FROM agents
-        WHERE ({0}) >= start_block_num
-        AND ({0}) < end_block_num;
-        """.format(LATEST_BLOCK_NUM)
-
         async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            await cursor.execute(fetch)
+            await self._execute(cursor, 'fetch_all_agents')
             return await cursor.fetchall()
 
     async def fetch_auth_resource(self, public_key):
-        fetch = """
-        SELECT * FROM auth WHERE public_key='{}'
-        """.format(public_key)
-
         async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            await cursor.execute(fetch)
+            await self._execute(cursor, 'fetch_auth', public_key)
             return await cursor.fetchone()
 
     async def fetch_record_resource(self, record_id):
-        fetch_record = """
-        SELECT record_id FROM records
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
-        fetch_record_locations = """
-        SELECT latitude, longitude, timestamp FROM record_locations
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
-        fetch_record_owners = """
-        SELECT agent_id, timestamp FROM record_owners
-        WHERE record_id='{0}'
-        AND ({1}) >= start_block_num
-        AND ({1}) < end_block_num;
-        """.format(record_id, LATEST_BLOCK_NUM)
-
         async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
             try:
-                await cursor.execute(fetch_record)
+                await self._execute(cursor, 'fetch_record', record_id)
                 record = await cursor.fetchone()
 
-                await cursor.execute(fetch_record_locations)
-                record['locations'] = await cursor.fetchall()
+                await self._fetch_history(cursor, record)
 
-                await cursor.execute(fetch_record_owners)
-                record['owners'] = await cursor.fetchall()
+                await self._execute(cursor, 'fetch_record_custody', record_id)
+                self._resolve_custody([record], await cursor.fetchall())
 
                 return record
             except TypeError:
                 return None
 
-    async def fetch_all_record_resources(self):
-        fetch_records = """
-        SELECT record_id FROM records
-        WHERE ({0}) >= start_block_num
-        AND ({0}) < end_block_num;
-        """.format(LATEST_BLOCK_NUM)
+    async def fetch_record_owner(self, record_id):
+        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            await self._execute(cursor, 'fetch_record_owner', record_id)
+            return await cursor.fetchone()
+
+    async def fetch_record_ancestors(self, record_id):
+        """Fetches the ids of the records a record is attached to, directly
+        or through other records, its parent first
+        """
+        async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            await self._execute(cursor, 'fetch_record_ancestors', record_id)
+            return [row['record_id'] for row in await cursor.fetchall()]
 
+    async def fetch_all_record_resources(self):
+        """Fetches every record with its history and custody, in a fixed
+        number of queries however many records there are
+        """
         async with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            await self._execute(cursor, 'fetch_all_records')
+            records = await cursor.fetchall()
+
+            await self._execute(cursor, 'fetch_all_record_locations')
+            locations = _group_by_record(await cursor.fetchall())
+
+            await self._execute(cursor, 'fetch_all_record_owners')
+            owners = _group_by_record(await cursor.fetchall())
+
+            for record in records:
+                record['locations'] = locations.get(record['record_id'], [])
+                record['owners'] = owners.get(record['record_id'], [])
+
+            await self._execute(cursor, 'fetch_all_record_custody')
+            self._resolve_custody(records, await cursor.fetchall())
+
+            return records
+
+    async def _fetch_history(self, cursor, record):
+        """Sets the record's locations and owners, oldest first
+        """
+        await self._execute(
+            cursor, 'fetch_record_locations', record['record_id'])
+        record['locations'] = await cursor.fetchall()
+
+        await self._execute(
+            cursor, 'fetch_record_owners', record['record_id'])
+        record['owners'] = await cursor.fetchall()
+
+    @staticmethod
+    def _resolve_custody(records, custody):
+        """Sets each record's current owner and location from the rows of
+        a custody statement
+        """
+        custody = {row['record_id']: row for row in custody}
+        for record in records:
+            row = custody.get(record['record_id'], {})
+            record['owner'] = {
+                'agent_id': row['agent_id'],
+                'timestamp': row['owner_timestamp'],
+            } if row.get('agent_id') is not None else None
+            record['location'] = {
+                'latitude': row['latitude'],
+                'longitude': row['longitude'],
+                'timestamp': row['location_timestamp'],
+            } if row.get('latitude') is not None else None
+
+    async def _execute(self, cursor, name, *params):
+        """Executes one of STATEMENTS, preparing it first if it has not been
+        prepared on this connection yet. Statements are prepared when first
+        used rather than on connecting, as the subscriber may not have
+        created the tables yet.
+        """
+        prepared = self._prepared.get(name)
+        if prepared is None:
+            # Requests sharing the connection wait for this PREPARE rather
+            # than sending their own, or executing before it completes
+            prepared = asyncio.Future(loop=self._loop)
+            self._prepared[name] = prepared
+            types, statement = STATEMENTS[name]
             try:
-                await cursor.execute(fetch_records)
-                records = await cursor.fetchall()
-
-                for record in records:
-                    fetch_record_locations = """
-                    SELECT latitude, longitude, timestamp
-                    FROM record_locations
-                    WHERE record_id='{0}'
-                    AND ({1}) >= start_block_num
-                    AND ({1}) < end_block_num;
-                    """.format(record['record_id'], LATEST_BLOCK_NUM)
-
-                    fetch_record_owners = """
-                    SELECT agent_id, timestamp
-                    FROM record_owners
-                    WHERE record_id='{0}'
-                    AND ({1}) >= start_block_num
-                    AND ({1}) < end_block_num;
-                    """.format(record['record_id'], LATEST_BLOCK_NUM)
-
-                    await cursor.execute(fetch_record_locations)
-                    record['locations'] = await cursor.fetchall()
-
-                    await cursor.execute(fetch_record_owners)
-                    record['owners'] = await cursor.fetchall()
-
-                return records
-            except TypeError:
-                return []
+                await cursor.execute('PREPARE {}{} AS {}'.format(
+                    name,
+                    '({})'.format(', '.join(types)) if types else '',
+                    statement))
+            except Exception:
+                self._prepared.pop(name, None)
+                prepared.set_result(False)
+                raise
+            prepared.set_result(True)
+        elif not await prepared:
+            await self._execute(cursor, name, *params)
+            return
+        await cursor.execute(
+            'EXECUTE {}{}'.format(
+                name,
+                '({})'.format(', '.join(['%s'] * len(params)))
+                if params else ''),
+            params)
+
+
+def _group_by_record(rows):
+    """Groups rows by their record, keeping their order, and drops the
+    record id from each
+    """
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.pop('record_id'), []).append(row)
+    return grouped
@@ -18,16 +18,6 @@ import asyncio
 import logging
 import sys
 
-from zmq.asyncio import ZMQEventLoop
-
-from sawtooth_sdk.processor.log import init_console_logging
-
-from aiohttp import web
-
-from simple_supply_rest_api.route_handler import RouteHandler
-from simple_supply_rest_api.database import Database
-from simple_supply_rest_api.messaging import Messenger
-
 
 LOGGER = logging.getLogger(__name__)
 
@@ -44,6 +34,11 @@ def parse_args(args):
         '-C', '--connect',
         help='specify URL to connect to a running validator',
         default='tcp://localhost:4004')
+    parser.add_argument(
+        '--tenant',
+        help='The tenant to submit transactions and read state for, whose '
+        'database this API serves. Omit for the default tenant',
+        default='')
     parser.add_argument(
         '-t', '--timeout',
         help='set time (in seconds) to wait for a validator response',
@@ -78,6 +73,9 @@ def parse_args(args):
 
 
 def start_rest_api(host, port, messenger, database):
+    from aiohttp import web
+    from simple_supply_rest_api.route_handler import RouteHandler
+
     loop = asyncio.get_event_loop()
     asyncio.ensure_future(database.connect())
 
@@ -96,6 +94,8 @@ def start_rest_api(host, port, messenger, database):
     app.router.add_post('/agents', handler.create_agent)
     app.router.add_get('/agents', handler.list_agents)
     app.router.add_get('/agents/{agent_id}', handler.fetch_agent)
+    app.router.add_get(
+        '/agents/{agent_id}/holdings', handler.fetch_agent_holdings)
 
     app.router.add_post('/records', handler.create_record)
     app.router.add_get('/records', handler.list_records)
@@ -103,6 +103,15 @@ def start_rest_api(host, port, messenger, database):
     app.router.add_post(
         '/records/{record_id}/transfer', handler.transfer_record)
     app.router.add_post('/records/{record_id}/update', handler.update_record)
+    app.router.add_post(
+        '/records/{record_id}/archive', handler.archive_history)
+    app.router.add_post(
+        '/records/{record_id}/attach', handler.attach_record)
+    app.router.add_post(
+        '/records/{record_id}/detach', handler.detach_record)
+
+    app.router.add_post('/geofences/max_speed', handler.set_max_speed)
+    app.router.add_put('/geofences/{geofence_id}', handler.set_geofence)
 
     LOGGER.info('Starting Simple Supply REST API on %s:%s', host, port)
     web.run_app(
@@ -114,18 +123,25 @@ def start_rest_api(host, port, messenger, database):
 
 
 def main():
+    opts = parse_args(sys.argv[1:])
+
+    # aiohttp, aiopg, ZeroMQ, and the SDK are imported once the arguments
+    # are known to be good, rather than when this module is
+    from zmq.asyncio import ZMQEventLoop
+    from sawtooth_sdk.processor.log import init_console_logging
+    from simple_supply_rest_api.database import Database
+    from simple_supply_rest_api.messaging import Messenger
+
     loop = ZMQEventLoop()
     asyncio.set_event_loop(loop)
 
     try:
-        opts = parse_args(sys.argv[1:])
-
         init_console_logging(verbose_level=opts.verbose)
 
         validator_url = opts.connect
         if "tcp://" not in validator_url:
             validator_url = "tcp://" + validator_url
-        messenger = Messenger(validator_url)
+        messenger = Messenger(validator_url, tenant=opts.tenant)
 
         database = Database(
             opts.db_host,
@@ -15,18 +15,37 @@
 
 from sawtooth_rest_api.messaging import Connection
 from sawtooth_rest_api.protobuf import client_batch_submit_pb2
+from sawtooth_rest_api.protobuf import client_list_control_pb2
+from sawtooth_rest_api.protobuf import client_state_pb2
 from sawtooth_rest_api.protobuf import validator_pb2
 
 from sawtooth_signing import create_context
 from sawtooth_signing import CryptoFactory
 from sawtooth_signing import secp256k1
 
+from simple_supply_addressing import addresser
+
+from simple_supply_encoding import wire
+
+from simple_supply_protobuf import agent_pb2
+from simple_supply_protobuf import holding_pb2
+
 from simple_supply_rest_api.errors import ApiBadRequest
 from simple_supply_rest_api.errors import ApiInternalError
+from simple_supply_rest_api.transaction_creation import \
+    make_archive_history_transaction
+from simple_supply_rest_api.transaction_creation import \
+    make_attach_record_transaction
 from simple_supply_rest_api.transaction_creation import \
     make_create_agent_transaction
 from simple_supply_rest_api.transaction_creation import \
     make_create_record_transaction
+from simple_supply_rest_api.transaction_creation import \
+    make_detach_record_transaction
+from simple_supply_rest_api.transaction_creation import \
+    make_set_geofence_transaction
+from simple_supply_rest_api.transaction_creation import \
+    make_set_max_speed_transaction
 from simple_supply_rest_api.transaction_creation import \
     make_transfer_record_transaction
 from simple_supply_rest_api.transaction_creation import \
@@ -34,8 +53,12 @@ from simple_supply_rest_api.transaction_creation import \
 
 
 class Messenger(object):
-    def __init__(self, validator_url):
+    """Submits transactions to, and reads state from, a validator on
+    behalf of one tenant, '' being the default tenant
+    """
+    def __init__(self, validator_url, tenant=''):
         self._connection = Connection(validator_url)
+        self._tenant = tenant
         self._context = create_context('secp256k1')
         self._crypto_factory = CryptoFactory(self._context)
         self._batch_signer = self._crypto_factory.new_signer(
@@ -63,7 +86,8 @@ class Messenger(object):
             transaction_signer=transaction_signer,
             batch_signer=self._batch_signer,
             name=name,
-            timestamp=timestamp)
+            timestamp=timestamp,
+            tenant=self._tenant)
         await self._send_and_wait_for_commit(batch)
 
     async def send_create_record_transaction(self,
@@ -81,7 +105,8 @@ class Messenger(object):
             latitude=latitude,
             longitude=longitude,
             record_id=record_id,
-            timestamp=timestamp)
+            timestamp=timestamp,
+            tenant=self._tenant)
         await self._send_and_wait_for_commit(batch)
 
     async def send_transfer_record_transaction(self,
@@ -97,7 +122,8 @@ class Messenger(object):
             batch_signer=self._batch_signer,
             receiving_agent=receiving_agent,
             record_id=record_id,
-            timestamp=timestamp)
+            timestamp=timestamp,
+            tenant=self._tenant)
         await self._send_and_wait_for_commit(batch)
 
     async def send_update_record_transaction(self,
@@ -105,7 +131,8 @@ class Messenger(object):
                                              latitude,
                                              longitude,
                                              record_id,
-                                             timestamp):
+                                             timestamp,
+                                             previous_location=None):
         transaction_signer = self._crypto_factory.new_signer(
             secp256k1.Secp256k1PrivateKey.from_hex(private_key))
         batch = make_update_record_transaction(
@@ -114,9 +141,181 @@ class Messenger(object):
             latitude=latitude,
             longitude=longitude,
             record_id=record_id,
-            timestamp=timestamp)
+            timestamp=timestamp,
+            previous_location=previous_location,
+            tenant=self._tenant)
+        await self._send_and_wait_for_commit(batch)
+
+    async def send_archive_history_transaction(self,
+                                               private_key,
+                                               record_id,
+                                               cutoff,
+                                               timestamp):
+        transaction_signer = self._crypto_factory.new_signer(
+            secp256k1.Secp256k1PrivateKey.from_hex(private_key))
+        batch = make_archive_history_transaction(
+            transaction_signer=transaction_signer,
+            batch_signer=self._batch_signer,
+            record_id=record_id,
+            cutoff=cutoff,
+            timestamp=timestamp,
+            tenant=self._tenant)
+        await self._send_and_wait_for_commit(batch)
+
+    async def send_attach_record_transaction(self,
+                                             private_key,
+                                             record_id,
+                                             parent_id,
+                                             timestamp,
+                                             ancestors=()):
+        transaction_signer = self._crypto_factory.new_signer(
+            secp256k1.Secp256k1PrivateKey.from_hex(private_key))
+        batch = make_attach_record_transaction(
+            transaction_signer=transaction_signer,
+            batch_signer=self._batch_signer,
+            record_id=record_id,
+            parent_id=parent_id,
+            timestamp=timestamp,
+            ancestors=ancestors,
+            tenant=self._tenant)
+        await self._send_and_wait_for_commit(batch)
+
+    async def send_detach_record_transaction(self,
+                                             private_key,
+                                             record_id,
+                                             timestamp,
+                                             ancestors=(),
+                                             owner=None):
+        transaction_signer = self._crypto_factory.new_signer(
+            secp256k1.Secp256k1PrivateKey.from_hex(private_key))
+        batch = make_detach_record_transaction(
+            transaction_signer=transaction_signer,
+            batch_signer=self._batch_signer,
+            record_id=record_id,
+            timestamp=timestamp,
+            ancestors=ancestors,
+            owner=owner,
+            tenant=self._tenant)
         await self._send_and_wait_for_commit(batch)
 
+    async def send_set_geofence_transaction(self,
+                                            private_key,
+                                            geofence_id,
+                                            vertices,
+                                            timestamp):
+        transaction_signer = self._crypto_factory.new_signer(
+            secp256k1.Secp256k1PrivateKey.from_hex(private_key))
+        batch = make_set_geofence_transaction(
+            transaction_signer=transaction_signer,
+            batch_signer=self._batch_signer,
+            geofence_id=geofence_id,
+            vertices=vertices,
+            timestamp=timestamp,
+            tenant=self._tenant)
+        await self._send_and_wait_for_commit(batch)
+
+    async def send_set_max_speed_transaction(self,
+                                             private_key,
+                                             max_speed,
+                                             timestamp):
+        transaction_signer = self._crypto_factory.new_signer(
+            secp256k1.Secp256k1PrivateKey.from_hex(private_key))
+        batch = make_set_max_speed_transaction(
+            transaction_signer=transaction_signer,
+            batch_signer=self._batch_signer,
+            max_speed=max_speed,
+            timestamp=timestamp,
+            tenant=self._tenant)
+        await self._send_and_wait_for_commit(batch)
+
+    async def fetch_holdings(self, public_key):
+        """Lists the records an agent holds straight from validator state,
+        so they are current without waiting for the subscriber. These are
+        the records the agent owns directly: records attached to another are
+        listed under their own owner, not under the owner of the record
+        carrying them, which the record resources report as their owner.
+
+        Returns:
+            list of dict: The record_id of each record, and the timestamp
+                of when the agent took ownership
+        """
+        holdings = []
+        paging = client_list_control_pb2.ClientPagingControls()
+        while True:
+            list_request = client_state_pb2.ClientStateListRequest(
+                address=addresser.get_holding_prefix(
+                    public_key, self._tenant),
+                paging=paging)
+            validator_response = await self._connection.send(
+                validator_pb2.Message.CLIENT_STATE_LIST_REQUEST,
+                list_request.SerializeToString())
+
+            list_response = client_state_pb2.ClientStateListResponse()
+            list_response.ParseFromString(validator_response.content)
+            if list_response.status == \
+                    client_state_pb2.ClientStateListResponse.NO_RESOURCE:
+                break
+            if list_response.status != \
+                    client_state_pb2.ClientStateListResponse.OK:
+                raise ApiInternalError(
+                    'Unable to read state. Try again later')
+
+            for entry in list_response.entries:
+                container = holding_pb2.HoldingContainer()
+                container.ParseFromString(entry.data)
+                holdings.extend(
+                    {'record_id': holding.record_id,
+                     'timestamp': holding.timestamp}
+                    for holding in container.entries)
+
+            if not list_response.paging.next:
+                break
+            paging = client_list_control_pb2.ClientPagingControls(
+                start=list_response.paging.next)
+
+        return holdings
+
+    async def fetch_agent(self, public_key):
+        """Gets an agent straight from validator state
+
+        Returns:
+            agent_pb2.Agent: The agent with the public key, or None
+        """
+        data = await self._fetch_state(
+            addresser.get_agent_address(public_key, self._tenant))
+        container = agent_pb2.AgentContainer()
+        container.ParseFromString(data)
+        for agent in container.entries:
+            if agent.public_key == public_key:
+                return agent
+        return None
+
+    async def fetch_record_head(self, record_id):
+        """Gets the parent and latest owner and location of a record
+        straight from validator state, without parsing its history
+
+        Returns:
+            wire.RecordHead: The head of the record, or None
+        """
+        data = await self._fetch_state(
+            addresser.get_record_address(record_id, self._tenant))
+        return wire.scan_record(data, record_id)
+
+    async def _fetch_state(self, address):
+        get_request = client_state_pb2.ClientStateGetRequest(address=address)
+        validator_response = await self._connection.send(
+            validator_pb2.Message.CLIENT_STATE_GET_REQUEST,
+            get_request.SerializeToString())
+
+        get_response = client_state_pb2.ClientStateGetResponse()
+        get_response.ParseFromString(validator_response.content)
+        if get_response.status == \
+                client_state_pb2.ClientStateGetResponse.NO_RESOURCE:
+            return b''
+        if get_response.status != client_state_pb2.ClientStateGetResponse.OK:
+            raise ApiInternalError('Unable to read state. Try again later')
+        return get_response.value
+
     async def _send_and_wait_for_commit(self, batch):
         # Send transaction to validator
         submit_request = client_batch_submit_pb2.ClientBatchSubmitRequest(
@@ -18,15 +18,15 @@ import logging
 import time
 
 from aiohttp.web import json_response
-import bcrypt
-from Crypto.Cipher import AES
-from itsdangerous import BadSignature
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
 from simple_supply_rest_api.errors import ApiBadRequest
 from simple_supply_rest_api.errors import ApiNotFound
 from simple_supply_rest_api.errors import ApiUnauthorized
 
+from simple_supply_validation import rules
+from simple_supply_validation.rules import NotFoundError
+from simple_supply_validation.rules import ValidationError
+
 
 LOGGER = logging.getLogger(__name__)
 
@@ -36,6 +36,7 @@ class RouteHandler(object):
         self._loop = loop
         self._messenger = messenger
         self._database = database
+        self._database_view = _DatabaseView(database)
 
     async def authenticate(self, request):
         body = await decode_request(request)
@@ -50,7 +51,7 @@ class RouteHandler(object):
             raise ApiUnauthorized('No agent with that public key exists')
 
         hashed_password = auth_info.get('hashed_password')
-        if not bcrypt.checkpw(password, bytes.fromhex(hashed_password)):
+        if not check_password(password, bytes.fromhex(hashed_password)):
             raise ApiUnauthorized('Incorrect public key or password')
 
         token = generate_auth_token(
@@ -94,13 +95,31 @@ class RouteHandler(object):
                 'Agent with public key {} was not found'.format(public_key))
         return json_response(agent)
 
+    async def fetch_agent_holdings(self, request):
+        # Holdings are the records the agent owns directly, including any
+        # attached to records of other agents
+        public_key = request.match_info.get('agent_id', '')
+        holdings = await self._messenger.fetch_holdings(public_key)
+        return json_response(holdings)
+
     async def create_record(self, request):
-        private_key = await self._authorize(request)
+        public_key, private_key = await self._authorize(request)
 
         body = await decode_request(request)
         required_fields = ['latitude', 'longitude', 'record_id']
         validate_fields(required_fields, body)
 
+        await self._dry_run(
+            rules.validate_create_record,
+            lambda view: {
+                'agent': view.fetch_agent(public_key),
+                'owners': view.fetch_owners(body['record_id']),
+            },
+            public_key=public_key,
+            record_id=body['record_id'],
+            latitude=body['latitude'],
+            longitude=body['longitude'])
+
         await self._messenger.send_create_record_transaction(
             private_key=private_key,
             latitude=body.get('latitude'),
@@ -125,7 +144,7 @@ class RouteHandler(object):
         return json_response(record)
 
     async def transfer_record(self, request):
-        private_key = await self._authorize(request)
+        public_key, private_key = await self._authorize(request)
 
         body = await decode_request(request)
         required_fields = ['receiving_agent']
@@ -133,6 +152,17 @@ class RouteHandler(object):
 
         record_id = request.match_info.get('record_id', '')
 
+        await self._dry_run(
+            rules.validate_transfer_record,
+            lambda view: {
+                'receiver': view.fetch_agent(body['receiving_agent']),
+                'owners': view.fetch_owners(record_id),
+                'parent_id': view.fetch_parent_id(record_id),
+            },
+            public_key=public_key,
+            receiving_agent=body['receiving_agent'],
+            record_id=record_id)
+
         await self._messenger.send_transfer_record_transaction(
             private_key=private_key,
             receiving_agent=body['receiving_agent'],
@@ -143,25 +173,180 @@ class RouteHandler(object):
             {'data': 'Transfer record transaction submitted'})
 
     async def update_record(self, request):
-        private_key = await self._authorize(request)
+        public_key, private_key = await self._authorize(request)
 
         body = await decode_request(request)
         required_fields = ['latitude', 'longitude']
         validate_fields(required_fields, body)
 
         record_id = request.match_info.get('record_id', '')
+        validator_view = _ValidatorView(self._messenger)
+
+        await self._dry_run(
+            rules.validate_update_record,
+            lambda view: {
+                'owners': view.fetch_owners(record_id),
+                'parent_id': view.fetch_parent_id(record_id),
+            },
+            validator_view=validator_view,
+            public_key=public_key,
+            record_id=record_id,
+            latitude=body['latitude'],
+            longitude=body['longitude'])
+
+        # Lets the transaction declare the record's current location index
+        # entry rather than the whole index. It is the one the processor
+        # moves, so it is read from validator state, not the database
+        previous_location = await validator_view.fetch_location(record_id)
 
         await self._messenger.send_update_record_transaction(
             private_key=private_key,
             latitude=body['latitude'],
             longitude=body['longitude'],
             record_id=record_id,
-            timestamp=get_time())
+            timestamp=get_time(),
+            previous_location=previous_location)
 
         return json_response(
             {'data': 'Update record transaction submitted'})
 
+    async def archive_history(self, request):
+        public_key, private_key = await self._authorize(request)
+
+        body = await decode_request(request)
+        required_fields = ['cutoff']
+        validate_fields(required_fields, body)
+
+        record_id = request.match_info.get('record_id', '')
+
+        await self._dry_run(
+            rules.validate_archive_history,
+            lambda view: {
+                'owners': view.fetch_owners(record_id),
+                'parent_id': view.fetch_parent_id(record_id),
+            },
+            public_key=public_key,
+            record_id=record_id)
+
+        await self._messenger.send_archive_history_transaction(
+            private_key=private_key,
+            record_id=record_id,
+            cutoff=body['cutoff'],
+            timestamp=get_time())
+
+        return json_response(
+            {'data': 'Archive history transaction submitted'})
+
+    async def attach_record(self, request):
+        public_key, private_key = await self._authorize(request)
+
+        body = await decode_request(request)
+        required_fields = ['parent_id']
+        validate_fields(required_fields, body)
+
+        record_id = request.match_info.get('record_id', '')
+        parent_id = body['parent_id']
+        # The transaction declares the records the processor walks from the
+        # parent to the top of its hierarchy, so they are read from
+        # validator state
+        validator_view = _ValidatorView(self._messenger)
+        ancestors = await validator_view.fetch_ancestors(parent_id)
+
+        await self._dry_run(
+            rules.validate_attach_record,
+            lambda view: {
+                'owners': view.fetch_owners(record_id),
+                'attached_to': view.fetch_parent_id(record_id),
+                'parent_owners': view.fetch_owners(
+                    (ancestors or [parent_id])[-1]),
+            },
+            validator_view=validator_view,
+            public_key=public_key,
+            record_id=record_id,
+            parent_id=parent_id,
+            ancestors=ancestors)
+
+        await self._messenger.send_attach_record_transaction(
+            private_key=private_key,
+            record_id=record_id,
+            parent_id=parent_id,
+            timestamp=get_time(),
+            ancestors=ancestors)
+
+        return json_response(
+            {'data': 'Attach record transaction submitted'})
+
+    async def detach_record(self, request):
+        public_key, private_key = await self._authorize(request)
+
+        record_id = request.match_info.get('record_id', '')
+        validator_view = _ValidatorView(self._messenger)
+        ancestors = await validator_view.fetch_ancestors(record_id)
+
+        await self._dry_run(
+            rules.validate_detach_record,
+            lambda view: {
+                'owners': view.fetch_owners(record_id),
+                'root_owners': view.fetch_owners(
+                    ancestors[-1] if ancestors else ''),
+            },
+            validator_view=validator_view,
+            public_key=public_key,
+            record_id=record_id)
+
+        # The record moves from its own owner's holdings to the signer's if
+        # they differ, so the owner is the one the processor reads. Without
+        # it, every agent's holdings are declared
+        owners = await validator_view.fetch_owners(record_id)
+
+        await self._messenger.send_detach_record_transaction(
+            private_key=private_key,
+            record_id=record_id,
+            timestamp=get_time(),
+            ancestors=ancestors,
+            owner=owners[0][0] if owners else None)
+
+        return json_response(
+            {'data': 'Detach record transaction submitted'})
+
+    async def set_geofence(self, request):
+        _, private_key = await self._authorize(request)
+
+        body = await decode_request(request)
+        required_fields = ['vertices']
+        validate_fields(required_fields, body)
+
+        geofence_id = request.match_info.get('geofence_id', '')
+
+        # Only the validator knows the geofence administrators, so
+        # unauthorized changes are rejected when the transaction is applied
+        await self._messenger.send_set_geofence_transaction(
+            private_key=private_key,
+            geofence_id=geofence_id,
+            vertices=[tuple(vertex) for vertex in body['vertices']],
+            timestamp=get_time())
+
+        return json_response(
+            {'data': 'Set geofence transaction submitted'})
+
+    async def set_max_speed(self, request):
+        _, private_key = await self._authorize(request)
+
+        body = await decode_request(request)
+        required_fields = ['max_speed']
+        validate_fields(required_fields, body)
+
+        await self._messenger.send_set_max_speed_transaction(
+            private_key=private_key,
+            max_speed=body['max_speed'],
+            timestamp=get_time())
+
+        return json_response(
+            {'data': 'Set max speed transaction submitted'})
+
     async def _authorize(self, request):
+        from itsdangerous import BadSignature
+
         token = request.headers.get('AUTHORIZATION')
         if token is None:
             raise ApiUnauthorized('No auth token provided')
@@ -179,9 +364,107 @@ class RouteHandler(object):
         auth_resource = await self._database.fetch_auth_resource(public_key)
         if auth_resource is None:
             raise ApiUnauthorized('Token is not associated with an agent')
-        return decrypt_private_key(request.app['aes_key'],
-                                   public_key,
-                                   auth_resource['encrypted_private_key'])
+        private_key = decrypt_private_key(
+            request.app['aes_key'],
+            public_key,
+            auth_resource['encrypted_private_key'])
+        return public_key, private_key
+
+    async def _dry_run(self, rule, read_state, validator_view=None,
+                       **kwargs):
+        """Checks an action against one of the transaction processor's
+        rules, so that transactions it would reject are never signed and
+        submitted. read_state maps a view of state to the reads of the
+        rule's other arguments. The database's view is checked first, but
+        it lags behind the validator until the subscriber catches up, so an
+        action it rejects is checked again against validator state, read
+        through validator_view if the route reads more state from it.
+        """
+        state = await _read(read_state(self._database_view))
+        try:
+            rule(**kwargs, **state)
+        except ValidationError:
+            state = await _read(read_state(
+                validator_view or _ValidatorView(self._messenger)))
+            dry_run(rule, **kwargs, **state)
+
+
+class _DatabaseView(object):
+    """Reads the state the rules check from the database the subscriber
+    keeps
+    """
+    def __init__(self, database):
+        self._database = database
+
+    async def fetch_agent(self, public_key):
+        return await self._database.fetch_agent_resource(public_key)
+
+    async def fetch_owners(self, record_id):
+        owner = await self._database.fetch_record_owner(record_id)
+        if owner is None:
+            return None
+        return [(owner['agent_id'], owner['timestamp'])]
+
+    async def fetch_parent_id(self, record_id):
+        ancestors = await self._database.fetch_record_ancestors(record_id)
+        return ancestors[0] if ancestors else ''
+
+
+class _ValidatorView(object):
+    """Reads the state the rules check straight from validator state. Only
+    the head of each record is read, as the rules only look at its latest
+    owner, which they treat the same as all of its owners
+    """
+    def __init__(self, messenger):
+        self._messenger = messenger
+        self._heads = {}
+
+    async def fetch_agent(self, public_key):
+        return await self._messenger.fetch_agent(public_key)
+
+    async def fetch_owners(self, record_id):
+        head = await self._fetch_head(record_id)
+        if head is None or head.latest_owner is None:
+            return None
+        return [head.latest_owner]
+
+    async def fetch_parent_id(self, record_id):
+        head = await self._fetch_head(record_id)
+        return head.parent_id if head is not None else ''
+
+    async def fetch_location(self, record_id):
+        """Returns the latitude and longitude of the record's latest location
+        entry, which updates move its location index entry from, or None
+        """
+        head = await self._fetch_head(record_id)
+        if head is None or head.location is None:
+            return None
+        return head.location[:2]
+
+    async def fetch_ancestors(self, record_id):
+        """Returns the ids of the records a record is attached to, directly
+        or through other records, its parent first, as the processor walks
+        them
+        """
+        ancestors = []
+        head = await self._fetch_head(record_id)
+        while head is not None and head.parent_id:
+            head = await self._fetch_head(head.parent_id)
+            if head is not None:
+                ancestors.append(head.record_id)
+        return ancestors
+
+    async def _fetch_head(self, record_id):
+        if record_id == '':
+            return None
+        if record_id not in self._heads:
+            self._heads[record_id] = \
+                await self._messenger.fetch_record_head(record_id)
+        return self._heads[record_id]
+
+
+async def _read(reads):
+    return {name: await read for name, read in reads.items()}
 
 
 async def decode_request(request):
@@ -191,6 +474,18 @@ async def decode_request(request):
         raise ApiBadRequest('Improper JSON format')
 
 
+def dry_run(rule, **kwargs):
+    """Checks an action against one of the transaction processor's rules,
+    raising the API error for the response if it breaks one
+    """
+    try:
+        rule(**kwargs)
+    except NotFoundError as err:
+        raise ApiNotFound(str(err))
+    except ValidationError as err:
+        raise ApiBadRequest(str(err))
+
+
 def validate_fields(required_fields, body):
     for field in required_fields:
         if body.get(field) is None:
@@ -198,13 +493,19 @@ def validate_fields(required_fields, body):
                 "'{}' parameter is required".format(field))
 
 
+# bcrypt, PyCrypto, and itsdangerous are only imported by the requests that
+# use them, so they do not slow down starting the API
 def encrypt_private_key(aes_key, public_key, private_key):
+    from Crypto.Cipher import AES
+
     init_vector = bytes.fromhex(public_key[:32])
     cipher = AES.new(bytes.fromhex(aes_key), AES.MODE_CBC, init_vector)
     return cipher.encrypt(private_key)
 
 
 def decrypt_private_key(aes_key, public_key, encrypted_private_key):
+    from Crypto.Cipher import AES
+
     init_vector = bytes.fromhex(public_key[:32])
     cipher = AES.new(bytes.fromhex(aes_key), AES.MODE_CBC, init_vector)
     private_key = cipher.decrypt(bytes.fromhex(encrypted_private_key))
@@ -212,20 +513,32 @@ def decrypt_private_key(aes_key, public_key, encrypted_private_key):
 
 
 def hash_password(password):
+    import bcrypt
+
     return bcrypt.hashpw(bytes(password, 'utf-8'), bcrypt.gensalt())
 
 
+def check_password(password, hashed_password):
+    import bcrypt
+
+    return bcrypt.checkpw(password, hashed_password)
+
+
 def get_time():
     dts = datetime.datetime.utcnow()
     return round(time.mktime(dts.timetuple()) + dts.microsecond/1e6)
 
 
 def generate_auth_token(secret_key, public_key):
+    from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
     serializer = Serializer(secret_key)
     token = serializer.dumps({'public_key': public_key})
     return token.decode('ascii')
 
 
 def deserialize_auth_token(secret_key, token):
+    from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
     serializer = Serializer(secret_key)
     return serializer.loads(token)
@@ -20,13 +20,15 @@ from sawtooth_rest_api.protobuf import transaction_pb2
 
 from simple_supply_addressing import addresser
 
+from simple_supply_protobuf import geofence_pb2
 from simple_supply_protobuf import payload_pb2
 
 
 def make_create_agent_transaction(transaction_signer,
                                   batch_signer,
                                   name,
-                                  timestamp):
+                                  timestamp,
+                                  tenant=''):
     """Make a CreateAgentAction transaction and wrap it in a batch
 
     Args:
@@ -34,6 +36,8 @@ def make_create_agent_transaction(transaction_signer,
         batch_signer (sawtooth_signing.Signer): The batch key pair
         name (str): The agent's name
         timestamp (int): Unix UTC timestamp of when the agent is created
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
 
     Returns:
         batch_pb2.Batch: The transaction wrapped in a batch
@@ -41,7 +45,7 @@ def make_create_agent_transaction(transaction_signer,
     """
 
     agent_address = addresser.get_agent_address(
-        transaction_signer.get_public_key().as_hex())
+        transaction_signer.get_public_key().as_hex(), tenant)
 
     inputs = [agent_address]
 
@@ -52,7 +56,8 @@ def make_create_agent_transaction(transaction_signer,
     payload = payload_pb2.SimpleSupplyPayload(
         action=payload_pb2.SimpleSupplyPayload.CREATE_AGENT,
         create_agent=action,
-        timestamp=timestamp)
+        timestamp=timestamp,
+        tenant=tenant)
     payload_bytes = payload.SerializeToString()
 
     return _make_batch(
@@ -60,7 +65,8 @@ def make_create_agent_transaction(transaction_signer,
         inputs=inputs,
         outputs=outputs,
         transaction_signer=transaction_signer,
-        batch_signer=batch_signer)
+        batch_signer=batch_signer,
+        tenant=tenant)
 
 
 def make_create_record_transaction(transaction_signer,
@@ -68,7 +74,8 @@ def make_create_record_transaction(transaction_signer,
                                    latitude,
                                    longitude,
                                    record_id,
-                                   timestamp):
+                                   timestamp,
+                                   tenant=''):
     """Make a CreateRecordAction transaction and wrap it in a batch
 
     Args:
@@ -78,18 +85,32 @@ def make_create_record_transaction(transaction_signer,
         longitude (int): Initial latitude of the record
         record_id (str): Unique ID of the record
         timestamp (int): Unix UTC timestamp of when the agent is created
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
 
     Returns:
         batch_pb2.Batch: The transaction wrapped in a batch
     """
 
+    public_key = transaction_signer.get_public_key().as_hex()
+    index_address = addresser.get_geohash_index_address(
+        addresser.get_geohash(latitude, longitude), record_id, tenant)
+    holding_address = addresser.get_holding_address(
+        public_key, record_id, tenant)
+
     inputs = [
-        addresser.get_agent_address(
-            transaction_signer.get_public_key().as_hex()),
-        addresser.get_record_address(record_id)
+        addresser.get_agent_address(public_key, tenant),
+        addresser.get_record_address(record_id, tenant),
+        index_address,
+        holding_address,
+        addresser.get_geofence_prefix(tenant)
     ]
 
-    outputs = [addresser.get_record_address(record_id)]
+    outputs = [
+        addresser.get_record_address(record_id, tenant),
+        index_address,
+        holding_address
+    ]
 
     action = payload_pb2.CreateRecordAction(
         record_id=record_id,
@@ -99,7 +120,8 @@ def make_create_record_transaction(transaction_signer,
     payload = payload_pb2.SimpleSupplyPayload(
         action=payload_pb2.SimpleSupplyPayload.CREATE_RECORD,
         create_record=action,
-        timestamp=timestamp)
+        timestamp=timestamp,
+        tenant=tenant)
     payload_bytes = payload.SerializeToString()
 
     return _make_batch(
@@ -107,14 +129,16 @@ def make_create_record_transaction(transaction_signer,
         inputs=inputs,
         outputs=outputs,
         transaction_signer=transaction_signer,
-        batch_signer=batch_signer)
+        batch_signer=batch_signer,
+        tenant=tenant)
 
 
 def make_transfer_record_transaction(transaction_signer,
                                      batch_signer,
                                      receiving_agent,
                                      record_id,
-                                     timestamp):
+                                     timestamp,
+                                     tenant=''):
     """Make a CreateRecordAction transaction and wrap it in a batch
 
     Args:
@@ -123,18 +147,31 @@ def make_transfer_record_transaction(transaction_signer,
         receiving_agent (str): Public key of the agent receiving the record
         record_id (str): Unique ID of the record
         timestamp (int): Unix UTC timestamp of when the record is transferred
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
 
     Returns:
         batch_pb2.Batch: The transaction wrapped in a batch
     """
-    sending_agent_address = addresser.get_agent_address(
-        transaction_signer.get_public_key().as_hex())
-    receiving_agent_address = addresser.get_agent_address(receiving_agent)
-    record_address = addresser.get_record_address(record_id)
+    receiving_agent_address = addresser.get_agent_address(
+        receiving_agent, tenant)
+    record_address = addresser.get_record_address(record_id, tenant)
+    segment_prefix = addresser.get_record_segment_prefix(record_id, tenant)
+    # Only the owner can transfer the record, so it moves from the signer's
+    # holdings to the receiving agent's
+    holding_addresses = [
+        addresser.get_holding_address(
+            transaction_signer.get_public_key().as_hex(), record_id, tenant),
+        addresser.get_holding_address(receiving_agent, record_id, tenant)
+    ]
 
-    inputs = [sending_agent_address, receiving_agent_address, record_address]
+    inputs = [
+        receiving_agent_address,
+        record_address,
+        segment_prefix
+    ] + holding_addresses
 
-    outputs = [record_address]
+    outputs = [record_address, segment_prefix] + holding_addresses
 
     action = payload_pb2.TransferRecordAction(
         record_id=record_id,
@@ -143,7 +180,8 @@ def make_transfer_record_transaction(transaction_signer,
     payload = payload_pb2.SimpleSupplyPayload(
         action=payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD,
         transfer_record=action,
-        timestamp=timestamp)
+        timestamp=timestamp,
+        tenant=tenant)
     payload_bytes = payload.SerializeToString()
 
     return _make_batch(
@@ -151,7 +189,8 @@ def make_transfer_record_transaction(transaction_signer,
         inputs=inputs,
         outputs=outputs,
         transaction_signer=transaction_signer,
-        batch_signer=batch_signer)
+        batch_signer=batch_signer,
+        tenant=tenant)
 
 
 def make_update_record_transaction(transaction_signer,
@@ -159,7 +198,9 @@ def make_update_record_transaction(transaction_signer,
                                    latitude,
                                    longitude,
                                    record_id,
-                                   timestamp):
+                                   timestamp,
+                                   previous_location=None,
+                                   tenant=''):
     """Make a CreateRecordAction transaction and wrap it in a batch
 
     Args:
@@ -169,17 +210,28 @@ def make_update_record_transaction(transaction_signer,
         longitude (int): Updated longitude of the location
         record_id (str): Unique ID of the record
         timestamp (int): Unix UTC timestamp of when the record is updated
+        previous_location (tuple of int): The record's current latitude and
+            longitude, if known. Without it the transaction has to declare
+            the whole location index, and so conflicts with every other
+            update that moves a record between geohash cells.
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
 
     Returns:
         batch_pb2.Batch: The transaction wrapped in a batch
     """
-    agent_address = addresser.get_agent_address(
-        transaction_signer.get_public_key().as_hex())
-    record_address = addresser.get_record_address(record_id)
+    record_address = addresser.get_record_address(record_id, tenant)
+    segment_prefix = addresser.get_record_segment_prefix(record_id, tenant)
+    index_addresses = _get_location_index_addresses(
+        record_id, latitude, longitude, previous_location, tenant)
 
-    inputs = [agent_address, record_address]
+    inputs = [
+        record_address,
+        segment_prefix,
+        addresser.get_geofence_prefix(tenant)
+    ] + index_addresses
 
-    outputs = [record_address]
+    outputs = [record_address, segment_prefix] + index_addresses
 
     action = payload_pb2.UpdateRecordAction(
         record_id=record_id,
@@ -189,7 +241,209 @@ def make_update_record_transaction(transaction_signer,
     payload = payload_pb2.SimpleSupplyPayload(
         action=payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
         update_record=action,
-        timestamp=timestamp)
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=inputs,
+        outputs=outputs,
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_archive_history_transaction(transaction_signer,
+                                     batch_signer,
+                                     record_id,
+                                     cutoff,
+                                     timestamp,
+                                     tenant=''):
+    """Make an ArchiveHistoryAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        record_id (str): Unique ID of the record
+        cutoff (int): Unix UTC timestamp history is archived before
+        timestamp (int): Unix UTC timestamp of when the history is archived
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    record_address = addresser.get_record_address(record_id, tenant)
+    segment_prefix = addresser.get_record_segment_prefix(record_id, tenant)
+
+    inputs = [record_address, segment_prefix]
+
+    outputs = [record_address, segment_prefix]
+
+    action = payload_pb2.ArchiveHistoryAction(
+        record_id=record_id,
+        cutoff=cutoff)
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.ARCHIVE_HISTORY,
+        archive_history=action,
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=inputs,
+        outputs=outputs,
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_set_geofence_transaction(transaction_signer,
+                                  batch_signer,
+                                  geofence_id,
+                                  vertices,
+                                  timestamp,
+                                  tenant=''):
+    """Make a SetGeofenceAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        geofence_id (str): Unique ID of the geofence
+        vertices (list of tuple): The latitude and longitude of each corner
+            of the geofence, in order, or an empty list to remove it
+        timestamp (int): Unix UTC timestamp of when the geofence is set
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    geofence_address = addresser.get_geofence_address(geofence_id, tenant)
+
+    inputs = [
+        addresser.get_setting_address(addresser.GEOFENCE_ADMINS_SETTING),
+        addresser.get_geofence_registry_address(tenant),
+        addresser.get_geofence_catalog_address(tenant),
+        geofence_address
+    ]
+
+    outputs = [
+        addresser.get_geofence_registry_address(tenant),
+        addresser.get_geofence_catalog_address(tenant),
+        geofence_address
+    ]
+
+    action = payload_pb2.SetGeofenceAction(
+        geofence_id=geofence_id,
+        vertices=[
+            geofence_pb2.Geofence.Vertex(
+                latitude=latitude, longitude=longitude)
+            for latitude, longitude in vertices
+        ])
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.SET_GEOFENCE,
+        set_geofence=action,
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=inputs,
+        outputs=outputs,
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_set_max_speed_transaction(transaction_signer,
+                                   batch_signer,
+                                   max_speed,
+                                   timestamp,
+                                   tenant=''):
+    """Make a SetMaxSpeedAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        max_speed (int): The fastest a record may move between consecutive
+            locations, in meters per second, or 0 to disable the check
+        timestamp (int): Unix UTC timestamp of when the speed is set
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    inputs = [
+        addresser.get_setting_address(addresser.GEOFENCE_ADMINS_SETTING),
+        addresser.get_geofence_registry_address(tenant)
+    ]
+
+    outputs = [addresser.get_geofence_registry_address(tenant)]
+
+    action = payload_pb2.SetMaxSpeedAction(max_speed=max_speed)
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.SET_MAX_SPEED,
+        set_max_speed=action,
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=inputs,
+        outputs=outputs,
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_attach_record_transaction(transaction_signer,
+                                   batch_signer,
+                                   record_id,
+                                   parent_id,
+                                   timestamp,
+                                   ancestors=(),
+                                   tenant=''):
+    """Make an AttachRecordAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        record_id (str): Unique ID of the record to attach
+        parent_id (str): Unique ID of the record to attach it to
+        timestamp (int): Unix UTC timestamp of when the record is attached
+        ancestors (list of str): The ids of the records the parent is
+            attached to, directly or through other records
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    record_address = addresser.get_record_address(record_id, tenant)
+
+    inputs = [record_address] + addresser.get_record_addresses(
+        [parent_id] + list(ancestors), tenant)
+
+    outputs = [record_address]
+
+    action = payload_pb2.AttachRecordAction(
+        record_id=record_id,
+        parent_id=parent_id)
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.ATTACH_RECORD,
+        attach_record=action,
+        timestamp=timestamp,
+        tenant=tenant)
     payload_bytes = payload.SerializeToString()
 
     return _make_batch(
@@ -197,14 +451,200 @@ def make_update_record_transaction(transaction_signer,
         inputs=inputs,
         outputs=outputs,
         transaction_signer=transaction_signer,
-        batch_signer=batch_signer)
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_detach_record_transaction(transaction_signer,
+                                   batch_signer,
+                                   record_id,
+                                   timestamp,
+                                   ancestors=(),
+                                   owner=None,
+                                   tenant=''):
+    """Make a DetachRecordAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        record_id (str): Unique ID of the record to detach
+        timestamp (int): Unix UTC timestamp of when the record is detached
+        ancestors (list of str): The ids of the records it is attached to,
+            directly or through other records
+        owner (str): The public key of the record's own owner, if known.
+            Without it the transaction has to declare every agent's
+            holdings, since the record is transferred to the signer when
+            they differ.
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    record_address = addresser.get_record_address(record_id, tenant)
+    segment_prefix = addresser.get_record_segment_prefix(record_id, tenant)
+    # The record may take on a location in any geohash cell from the top of
+    # its hierarchy
+    index_prefix = addresser.get_geohash_index_prefix(tenant=tenant)
+    if owner is None:
+        holding_addresses = [addresser.get_holding_prefix(tenant=tenant)]
+    else:
+        holding_addresses = [
+            addresser.get_holding_address(owner, record_id, tenant),
+            addresser.get_holding_address(
+                transaction_signer.get_public_key().as_hex(),
+                record_id,
+                tenant)
+        ]
+
+    inputs = [record_address, segment_prefix, index_prefix] + \
+        holding_addresses + addresser.get_record_addresses(ancestors, tenant)
+
+    outputs = [record_address, segment_prefix, index_prefix] + \
+        holding_addresses
+
+    action = payload_pb2.DetachRecordAction(record_id=record_id)
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.DETACH_RECORD,
+        detach_record=action,
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=inputs,
+        outputs=outputs,
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def make_bundle_transaction(transaction_signer,
+                            batch_signer,
+                            actions,
+                            timestamp,
+                            previous_locations=None,
+                            tenant=''):
+    """Make a BundleAction transaction and wrap it in a batch
+
+    Args:
+        transaction_signer (sawtooth_signing.Signer): The transaction key pair
+        batch_signer (sawtooth_signing.Signer): The batch key pair
+        actions (list of payload_pb2.SimpleSupplyPayload): The create record,
+            update record, and transfer record payloads to apply, in order
+        timestamp (int): Unix UTC timestamp of when the bundle is submitted
+        previous_locations (dict): The current latitude and longitude of
+            the updated records, keyed by record id, where known
+        tenant (str): The tenant to transact for, or '' for the default
+            tenant
+
+    Returns:
+        batch_pb2.Batch: The transaction wrapped in a batch
+    """
+    public_key = transaction_signer.get_public_key().as_hex()
+    agent_address = addresser.get_agent_address(public_key, tenant)
+
+    locations = dict(previous_locations or {})
+    inputs = set()
+    outputs = set()
+    for action in actions:
+        if action.action == payload_pb2.SimpleSupplyPayload.CREATE_RECORD:
+            record_id = action.create_record.record_id
+            location = (
+                action.create_record.latitude,
+                action.create_record.longitude)
+            index_addresses = [addresser.get_geohash_index_address(
+                addresser.get_geohash(*location), record_id, tenant)]
+            holding_address = addresser.get_holding_address(
+                public_key, record_id, tenant)
+            locations[record_id] = location
+            inputs.add(agent_address)
+            inputs.add(addresser.get_geofence_prefix(tenant))
+            inputs.update(index_addresses + [holding_address])
+            outputs.update(index_addresses + [holding_address])
+        elif action.action == payload_pb2.SimpleSupplyPayload.UPDATE_RECORD:
+            record_id = action.update_record.record_id
+            location = (
+                action.update_record.latitude,
+                action.update_record.longitude)
+            index_addresses = _get_location_index_addresses(
+                record_id, *location, locations.get(record_id), tenant)
+            locations[record_id] = location
+            inputs.add(addresser.get_geofence_prefix(tenant))
+            inputs.update(index_addresses)
+            outputs.update(index_addresses)
+        elif action.action == \
+                payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD:
+            record_id = action.transfer_record.record_id
+            receiving_agent = action.transfer_record.receiving_agent
+            holding_addresses = [
+                addresser.get_holding_address(
+                    public_key, record_id, tenant),
+                addresser.get_holding_address(
+                    receiving_agent, record_id, tenant)
+            ]
+            inputs.add(addresser.get_agent_address(receiving_agent, tenant))
+            inputs.update(holding_addresses)
+            outputs.update(holding_addresses)
+        else:
+            continue
+
+        # Any later update or transfer in the bundle may seal a new history
+        # segment for the record
+        record_addresses = [
+            addresser.get_record_address(record_id, tenant),
+            addresser.get_record_segment_prefix(record_id, tenant)
+        ]
+        inputs.update(record_addresses)
+        outputs.update(record_addresses)
+
+    action = payload_pb2.BundleAction(actions=actions)
+
+    payload = payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.BUNDLE,
+        bundle=action,
+        timestamp=timestamp,
+        tenant=tenant)
+    payload_bytes = payload.SerializeToString()
+
+    return _make_batch(
+        payload_bytes=payload_bytes,
+        inputs=sorted(inputs),
+        outputs=sorted(outputs),
+        transaction_signer=transaction_signer,
+        batch_signer=batch_signer,
+        tenant=tenant)
+
+
+def _get_location_index_addresses(record_id,
+                                  latitude,
+                                  longitude,
+                                  previous_location,
+                                  tenant):
+    addresses = [addresser.get_geohash_index_address(
+        addresser.get_geohash(latitude, longitude), record_id, tenant)]
+    if previous_location is None:
+        addresses.append(addresser.get_geohash_index_prefix(tenant=tenant))
+    else:
+        addresses.append(addresser.get_geohash_index_address(
+            addresser.get_geohash(*previous_location), record_id, tenant))
+    return addresses
 
 
 def _make_batch(payload_bytes,
                 inputs,
                 outputs,
                 transaction_signer,
-                batch_signer):
+                batch_signer,
+                tenant):
+    batcher_public_key = batch_signer.get_public_key().as_hex()
+    if tenant:
+        # The processor reads the registered tenants before any action
+        inputs = list(inputs) + [
+            addresser.get_setting_address(addresser.TENANTS_SETTING)
+        ]
 
     transaction_header = transaction_pb2.TransactionHeader(
         family_name=addresser.FAMILY_NAME,
@@ -212,7 +652,7 @@ def _make_batch(payload_bytes,
         inputs=inputs,
         outputs=outputs,
         signer_public_key=transaction_signer.get_public_key().as_hex(),
-        batcher_public_key=batch_signer.get_public_key().as_hex(),
+        batcher_public_key=batcher_public_key,
         dependencies=[],
         payload_sha512=hashlib.sha512(payload_bytes).hexdigest())
     transaction_header_bytes = transaction_header.SerializeToString()
@@ -223,7 +663,7 @@ def _make_batch(payload_bytes,
         payload=payload_bytes)
 
     batch_header = batch_pb2.BatchHeader(
-        signer_public_key=batch_signer.get_public_key().as_hex(),
+        signer_public_key=batcher_public_key,
         transaction_ids=[transaction.header_signature])
     batch_header_bytes = batch_header.SerializeToString()
 
@@ -13,86 +13,228 @@
 # limitations under the License.
 # -----------------------------------------------------------------------------
 
+import collections
 import logging
 import time
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 
+from simple_supply_subscriber.migrations import CREATE_MIGRATION_STMTS
+from simple_supply_subscriber.migrations import MAX_BLOCK_NUMBER
+from simple_supply_subscriber.migrations import MIGRATIONS
 
-LOGGER = logging.getLogger(__name__)
 
+LOGGER = logging.getLogger(__name__)
 
-CREATE_BLOCK_STMTS = """
-CREATE TABLE IF NOT EXISTS blocks (
-    block_num  bigint PRIMARY KEY,
-    block_id   varchar
-);
-"""
-
-
-CREATE_AUTH_STMTS = """
-CREATE TABLE IF NOT EXISTS auth (
-    public_key            varchar PRIMARY KEY,
-    hashed_password       varchar,
-    encrypted_private_key varchar
-)
-"""
-
-
-CREATE_RECORD_STMTS = """
-CREATE TABLE IF NOT EXISTS records (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
-
-
-CREATE_RECORD_LOCATION_STMTS = """
-CREATE TABLE IF NOT EXISTS record_locations (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    latitude         bigint,
-    longitude        bigint,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
-
-
-CREATE_RECORD_OWNER_STMTS = """
-CREATE TABLE IF NOT EXISTS record_owners (
-    id               bigserial PRIMARY KEY,
-    record_id        varchar,
-    agent_id         varchar,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
-
-
-CREATE_AGENT_STMTS = """
-CREATE TABLE IF NOT EXISTS agents (
-    id               bigserial PRIMARY KEY,
-    public_key       varchar,
-    name             varchar,
-    timestamp        bigint,
-    start_block_num  bigint,
-    end_block_num    bigint
-);
-"""
+# The segment of history rows archived from a record's own address, which
+# are no longer replaced when the record changes
+ARCHIVED_SEGMENT = -1
+
+# The columns identifying each owner and location in a record's history
+OWNER_COLUMNS = ('agent_id', 'timestamp')
+LOCATION_COLUMNS = ('latitude', 'longitude', 'timestamp')
+
+# The columns of the rows staged for each versioned table by bulk writes,
+# ending with the block range of each version, and the columns identifying
+# what each row is a version of
+STAGED_COLUMNS = {
+    'agents': (
+        'public_key', 'name', 'timestamp',
+        'start_block_num', 'end_block_num'),
+    'records': (
+        'record_id', 'parent_id',
+        'start_block_num', 'end_block_num'),
+    'record_locations': (
+        'record_id', 'latitude', 'longitude', 'timestamp', 'segment',
+        'start_block_num', 'end_block_num'),
+    'record_owners': (
+        'record_id', 'agent_id', 'timestamp', 'segment',
+        'start_block_num', 'end_block_num'),
+}
+VERSION_KEYS = {
+    'agents': ('public_key',),
+    'records': ('record_id',),
+    'record_locations': ('record_id', 'segment'),
+    'record_owners': ('record_id', 'segment'),
+}
+
+# The number of rows sent in each statement by bulk writes
+BULK_PAGE_SIZE = 1000
+
+# The statements run by Database, by name, with the types of their
+# parameters. Each is prepared the first time it is executed on a
+# connection, so the server parses and plans it once rather than for every
+# row, and values are always passed as parameters
+STATEMENTS = {
+    'fetch_block': (('bigint',), """
+        SELECT block_num, block_id FROM blocks WHERE block_num = $1
+        """),
+    'fetch_last_known_blocks': (('bigint',), """
+        SELECT block_num, block_id FROM blocks
+        ORDER BY block_num DESC LIMIT $1
+        """),
+    'insert_block': (('bigint', 'varchar'), """
+        INSERT INTO blocks (block_num, block_id) VALUES ($1, $2)
+        """),
+    'delete_blocks': (('bigint',), """
+        DELETE FROM blocks WHERE block_num >= $1
+        """),
+
+    # Versions added by the dropped blocks are deleted, and those they
+    # closed are made current again. The closed versions are found by the
+    # partial index of each table, which only matches the literal bound
+    'delete_fork_agents': (('bigint',), """
+        DELETE FROM agents WHERE start_block_num >= $1
+        """),
+    'reopen_fork_agents': (('bigint',), """
+        UPDATE agents SET end_block_num = {0}
+        WHERE end_block_num >= $1 AND end_block_num < {0}
+        """.format(MAX_BLOCK_NUMBER)),
+    'delete_fork_records': (('bigint',), """
+        DELETE FROM records WHERE start_block_num >= $1
+        """),
+    'reopen_fork_records': (('bigint',), """
+        UPDATE records SET end_block_num = {0}
+        WHERE end_block_num >= $1 AND end_block_num < {0}
+        """.format(MAX_BLOCK_NUMBER)),
+    'delete_fork_record_locations': (('bigint',), """
+        DELETE FROM record_locations WHERE start_block_num >= $1
+        """),
+    'reopen_fork_record_locations': (('bigint',), """
+        UPDATE record_locations SET end_block_num = {0}
+        WHERE end_block_num >= $1 AND end_block_num < {0}
+        """.format(MAX_BLOCK_NUMBER)),
+    'delete_fork_record_owners': (('bigint',), """
+        DELETE FROM record_owners WHERE start_block_num >= $1
+        """),
+    'reopen_fork_record_owners': (('bigint',), """
+        UPDATE record_owners SET end_block_num = {0}
+        WHERE end_block_num >= $1 AND end_block_num < {0}
+        """.format(MAX_BLOCK_NUMBER)),
+
+    'fetch_address_keys': ((), """
+        SELECT address_space, key FROM address_keys
+        """),
+    'insert_address_key': (('smallint', 'varchar'), """
+        INSERT INTO address_keys (address_space, key) VALUES ($1, $2)
+        ON CONFLICT DO NOTHING
+        """),
+
+    'insert_agents': (
+        ('varchar', 'varchar', 'bigint', 'bigint', 'bigint'), """
+        INSERT INTO agents (
+        public_key,
+        name,
+        timestamp,
+        start_block_num,
+        end_block_num)
+        VALUES ($1, $2, $3, $4, $5)
+        """),
+    'close_agents': (('bigint', 'bigint', 'varchar'), """
+        UPDATE agents SET end_block_num = $1
+        WHERE end_block_num = $2 AND public_key = $3
+        """),
+
+    'insert_records': (('varchar', 'varchar', 'bigint', 'bigint'), """
+        INSERT INTO records (
+        record_id,
+        parent_id,
+        start_block_num,
+        end_block_num)
+        VALUES ($1, $2, $3, $4)
+        """),
+    'close_records': (('bigint', 'bigint', 'varchar'), """
+        UPDATE records SET end_block_num = $1
+        WHERE end_block_num = $2 AND record_id = $3
+        """),
+
+    'insert_record_locations': (
+        ('varchar', 'bigint', 'bigint', 'bigint', 'bigint', 'bigint',
+         'bigint'), """
+        INSERT INTO record_locations (
+        record_id,
+        latitude,
+        longitude,
+        timestamp,
+        segment,
+        start_block_num,
+        end_block_num)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        """),
+    'close_record_locations': (('bigint', 'bigint', 'varchar', 'bigint'), """
+        UPDATE record_locations SET end_block_num = $1
+        WHERE end_block_num = $2 AND record_id = $3
+        AND segment IS NOT DISTINCT FROM $4
+        """),
+    'count_record_locations': (('bigint', 'varchar', 'bigint'), """
+        SELECT count(*), min(id), max(id) FROM record_locations
+        WHERE end_block_num = $1 AND record_id = $2
+        AND segment IS NOT DISTINCT FROM $3
+        """),
+    'fetch_ends_record_locations': (('bigint', 'bigint'), """
+        SELECT latitude, longitude, timestamp FROM record_locations
+        WHERE id IN ($1, $2) ORDER BY id
+        """),
+
+    'insert_record_owners': (
+        ('varchar', 'varchar', 'bigint', 'bigint', 'bigint', 'bigint'), """
+        INSERT INTO record_owners (
+        record_id,
+        agent_id,
+        timestamp,
+        segment,
+        start_block_num,
+        end_block_num)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        """),
+    'close_record_owners': (('bigint', 'bigint', 'varchar', 'bigint'), """
+        UPDATE record_owners SET end_block_num = $1
+        WHERE end_block_num = $2 AND record_id = $3
+        AND segment IS NOT DISTINCT FROM $4
+        """),
+    'count_record_owners': (('bigint', 'varchar', 'bigint'), """
+        SELECT count(*), min(id), max(id) FROM record_owners
+        WHERE end_block_num = $1 AND record_id = $2
+        AND segment IS NOT DISTINCT FROM $3
+        """),
+    'fetch_ends_record_owners': (('bigint', 'bigint'), """
+        SELECT agent_id, timestamp FROM record_owners
+        WHERE id IN ($1, $2) ORDER BY id
+        """),
+}
+
+# The statements run by drop_fork, in order
+FORK_STATEMENTS = [
+    statement
+    for table in STAGED_COLUMNS
+    for statement in ('delete_fork_' + table, 'reopen_fork_' + table)
+] + ['delete_blocks']
 
 
 class Database(object):
     """Simple object for managing a connection to a postgres database
+
+    With bulk writes, the rows of agents, records, owners, and locations
+    are staged until the next commit, then written with a few multi-row
+    statements: the versions they replace are closed with one UPDATE per
+    table, and the rows are inserted a page at a time. Otherwise each row
+    is written by its own statement as it is inserted.
+
+    Args:
+        dsn (str): The connection string of the database
+        bulk (bool): Whether to stage rows and write them in bulk
     """
-    def __init__(self, dsn):
+    def __init__(self, dsn, bulk=True):
         self._dsn = dsn
         self._conn = None
+        self._prepared = set()
+        self._bulk = bulk
+        self._staged_rows = collections.defaultdict(list)
+        self._staged_open = collections.defaultdict(dict)
+        self._staged_closes = collections.defaultdict(
+            collections.OrderedDict)
 
     def connect(self, retries=5, initial_delay=1, backoff=2):
         """Initializes a connection to the database
@@ -103,6 +245,7 @@ class Database(object):
             backoff (int): Multiplies the delay after each retry
         """
         LOGGER.info('Connecting to database')
+        self._prepared.clear()
 
         delay = initial_delay
         for attempt in range(retries):
@@ -122,29 +265,37 @@ class Database(object):
         self._conn = psycopg2.connect(self._dsn)
         LOGGER.info('Successfully connected to database')
 
-    def create_tables(self):
-        """Creates the Simple Supply tables
+    def migrate(self):
+        """Brings the schema up to date, applying each of MIGRATIONS not yet
+        applied to the database, all in one transaction
+
+        Returns:
+            list of int: The versions of the migrations applied
         """
         with self._conn.cursor() as cursor:
-            LOGGER.debug('Creating table: blocks')
-            cursor.execute(CREATE_BLOCK_STMTS)
-
-            LOGGER.debug('Creating table: auth')
-            cursor.execute(CREATE_AUTH_STMTS)
-
-            LOGGER.debug('Creating table: records')
-            cursor.execute(CREATE_RECORD_STMTS)
-
-            LOGGER.debug('Creating table: record_locations')
-            cursor.execute(CREATE_RECORD_LOCATION_STMTS)
-
-            LOGGER.debug('Creating table: record_owners')
-            cursor.execute(CREATE_RECORD_OWNER_STMTS)
-
-            LOGGER.debug('Creating table: agents')
-            cursor.execute(CREATE_AGENT_STMTS)
+            cursor.execute(CREATE_MIGRATION_STMTS)
+            # Held until the commit, so concurrent inits apply each
+            # migration once
+            cursor.execute(
+                'LOCK TABLE schema_migrations IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute('SELECT version FROM schema_migrations')
+            applied = {row[0] for row in cursor.fetchall()}
+
+            versions = []
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                LOGGER.info('Applying migration %s: %s', version, description)
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, description) '
+                    'VALUES (%s, %s)',
+                    (version, description))
+                versions.append(version)
 
         self._conn.commit()
+        return versions
 
     def disconnect(self):
         """Closes the connection to the database
@@ -154,204 +305,370 @@ class Database(object):
             self._conn.close()
 
     def commit(self):
+        self.flush()
         self._conn.commit()
 
     def rollback(self):
+        self._clear_staged()
         self._conn.rollback()
 
-    def drop_fork(self, block_num):
-        """Deletes all resources from a particular block_num
+    def flush(self):
+        """Writes the rows staged by bulk writes since the last flush. The
+        versions they replace are closed first, so each table is left with
+        one current version of everything in it.
         """
-        delete_agents = """
-        DELETE FROM agents WHERE start_block_num >= {}
-        """.format(block_num)
-        update_agents = """
-        UPDATE agents SET end_block_num = null
-        WHERE end_block_num >= {}
-        """.format(block_num)
-
-        delete_record_locations = """
-        DELETE FROM record_owners WHERE record_id =
-        (SELECT record_id FROM records WHERE start_block_num >= {})
-        """.format(block_num)
-        delete_record_owners = """
-        DELETE FROM record_owners WHERE record_id =
-        (SELECT record_id FROM records WHERE start_block_num >= {})
-        """.format(block_num)
-        delete_records = """
-        DELETE FROM records WHERE start_block_num >= {}
-        """.format(block_num)
-        update_records = """
-        UPDATE records SET end_block_num = null
-        WHERE end_block_num >= {}
-        """.format(block_num)
-
-        delete_blocks = """
-        DELETE FROM blocks WHERE block_num >= {}
-        """.format(block_num)
+        if not self._staged_rows and not self._staged_closes:
+            return
+
+        with self._conn.cursor() as cursor:
+            for table, closes in self._staged_closes.items():
+                update, template = _close_versions_statement(table)
+                execute_values(
+                    cursor,
+                    update,
+                    [key + block_range for key, block_range in closes.items()],
+                    template=template,
+                    page_size=BULK_PAGE_SIZE)
+
+            for table, rows in self._staged_rows.items():
+                insert = """
+                INSERT INTO {} ({}) VALUES %s
+                """.format(table, ', '.join(STAGED_COLUMNS[table]))
+                execute_values(
+                    cursor, insert, rows, page_size=BULK_PAGE_SIZE)
+
+        self._clear_staged()
 
+    def drop_fork(self, block_num):
+        """Drops the blocks from block_num on, restoring every agent,
+        record, owner, and location to its version before them. Each table
+        is rolled back with one DELETE and one UPDATE, whatever the depth of
+        the fork, as part of the transaction of the block replacing them.
+        """
         with self._conn.cursor() as cursor:
-            cursor.execute(delete_agents)
-            cursor.execute(update_agents)
-            cursor.execute(delete_record_locations)
-            cursor.execute(delete_record_owners)
-            cursor.execute(delete_records)
-            cursor.execute(update_records)
-            cursor.execute(delete_blocks)
+            for name in FORK_STATEMENTS:
+                self._execute(cursor, name, block_num)
 
     def fetch_last_known_blocks(self, count):
         """Fetches the specified number of most recent blocks
         """
-        fetch = """
-        SELECT block_num, block_id FROM blocks
-        ORDER BY block_num DESC LIMIT {}
-        """.format(count)
-
         with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(fetch)
+            self._execute(cursor, 'fetch_last_known_blocks', count)
             blocks = cursor.fetchall()
 
         return blocks
 
     def fetch_block(self, block_num):
-        fetch = """
-        SELECT block_num, block_id FROM blocks WHERE block_num = {}
-        """.format(block_num)
-
         with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(fetch)
+            self._execute(cursor, 'fetch_block', block_num)
             block = cursor.fetchone()
 
         return block
 
-    def insert_block(self, block_dict):
-        insert = """
-        INSERT INTO blocks (
-        block_num,
-        block_id)
-        VALUES ('{}', '{}');
-        """.format(
-            block_dict['block_num'],
-            block_dict['block_id'])
+    def fetch_address_keys(self):
+        """Fetches the (address_space, key) of every key in the address
+        index
+        """
+        with self._conn.cursor() as cursor:
+            self._execute(cursor, 'fetch_address_keys')
+            return cursor.fetchall()
 
+    def insert_address_key(self, address_space, key):
         with self._conn.cursor() as cursor:
-            cursor.execute(insert)
+            self._execute(
+                cursor, 'insert_address_key', int(address_space), key)
+
+    def insert_block(self, block_dict):
+        with self._conn.cursor() as cursor:
+            self._execute(
+                cursor,
+                'insert_block',
+                block_dict['block_num'],
+                block_dict['block_id'])
 
     def insert_agent(self, agent_dict):
-        update_agent = """
-        UPDATE agents SET end_block_num = {}
-        WHERE end_block_num = {} AND public_key = '{}'
-        """.format(
-            agent_dict['start_block_num'],
-            agent_dict['end_block_num'],
-            agent_dict['public_key'])
-
-        insert_agent = """
-        INSERT INTO agents (
-        public_key,
-        name,
-        timestamp,
-        start_block_num,
-        end_block_num)
-        VALUES ('{}', '{}', '{}', '{}', '{}');
-        """.format(
-            agent_dict['public_key'],
-            agent_dict['name'],
-            agent_dict['timestamp'],
-            agent_dict['start_block_num'],
-            agent_dict['end_block_num'])
+        if self._bulk:
+            self._stage_version('agents', agent_dict)
+            return
 
         with self._conn.cursor() as cursor:
-            cursor.execute(update_agent)
-            cursor.execute(insert_agent)
+            self._execute(
+                cursor,
+                'close_agents',
+                agent_dict['start_block_num'],
+                agent_dict['end_block_num'],
+                agent_dict['public_key'])
+            self._execute(
+                cursor,
+                'insert_agents',
+                *[agent_dict[column] for column in STAGED_COLUMNS['agents']])
 
     def insert_record(self, record_dict):
-        update_record = """
-        UPDATE records SET end_block_num = {}
-        WHERE end_block_num = {} AND record_id = '{}'
-        """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
-
-        insert_record = """
-        INSERT INTO records (
-        record_id,
-        start_block_num,
-        end_block_num)
-        VALUES ('{}', '{}', '{}');
-        """.format(
-            record_dict['record_id'],
-            record_dict['start_block_num'],
-            record_dict['end_block_num'])
+        """Inserts a new version of a record from its state. Of its owners
+        and locations, only those appended since its last version are
+        inserted, unless its history was sealed or archived since then.
+        """
+        self.insert_record_parent({
+            'record_id': record_dict['record_id'],
+            'parent_id': record_dict.get('parent_id', ''),
+            'start_block_num': record_dict['start_block_num'],
+            'end_block_num': record_dict['end_block_num']
+        })
+        self._insert_record_locations(record_dict)
+        self._insert_record_owners(record_dict)
+
+    def insert_record_parent(self, record_dict):
+        """Records that a record was attached to or detached from a parent.
+        Receipt events only carry the record_id and parent_id, so the
+        record's owners and locations are left as they are.
+        """
+        if self._bulk:
+            self._stage_version('records', record_dict)
+            return
 
         with self._conn.cursor() as cursor:
-            cursor.execute(update_record)
-            cursor.execute(insert_record)
+            self._execute(
+                cursor,
+                'close_records',
+                record_dict['start_block_num'],
+                record_dict['end_block_num'],
+                record_dict['record_id'])
+            self._execute(
+                cursor,
+                'insert_records',
+                *[record_dict[column]
+                  for column in STAGED_COLUMNS['records']])
+
+    def insert_record_segment(self, segment_dict):
+        """Inserts the locations and owners of a sealed history segment.
+        Rows from a record's own address have a null segment, so they are
+        versioned separately from the rows of each of its segments.
+        """
+        record_dict = {
+            'record_id': segment_dict['record_id'],
+            'locations': segment_dict['locations'],
+            'owners': segment_dict['owners'],
+            'start_block_num': segment_dict['start_block_num'],
+            'end_block_num': segment_dict['end_block_num']
+        }
+        self._insert_record_locations(record_dict, segment_dict['index'])
+        self._insert_record_owners(record_dict, segment_dict['index'])
+
+    def insert_archived_history(self, archived_dict):
+        """Inserts the owners and locations archived from a record's own
+        address. Their rows there are replaced along with the record, so
+        they are kept as rows of ARCHIVED_SEGMENT instead.
+        """
+        for location in archived_dict['locations']:
+            location.update(
+                record_id=archived_dict['record_id'],
+                start_block_num=archived_dict['start_block_num'],
+                end_block_num=archived_dict['end_block_num'])
+            self.insert_record_location(location, ARCHIVED_SEGMENT)
+        for owner in archived_dict['owners']:
+            owner.update(
+                record_id=archived_dict['record_id'],
+                start_block_num=archived_dict['start_block_num'],
+                end_block_num=archived_dict['end_block_num'])
+            self.insert_record_owner(owner, ARCHIVED_SEGMENT)
+
+    def insert_record_location(self, location_dict, segment=None):
+        """Appends a location to a record's history. Receipt events only
+        carry the new location, so the rows before it are left current.
+        """
+        self._insert_rows(
+            'record_locations', [dict(location_dict, segment=segment)])
 
-        self._insert_record_locations(record_dict)
-        self._insert_record_owners(record_dict)
+    def insert_record_owner(self, owner_dict, segment=None):
+        """Appends an owner to a record's history. Receipt events only carry
+        the new owner, so the rows before it are left current.
+        """
+        self._insert_rows(
+            'record_owners', [dict(owner_dict, segment=segment)])
+
+    def _find_appended(self, table, columns, record_dict, entries, segment):
+        """Returns the entries of a record's history that are not yet
+        current rows of the table, or None if its history changed other than
+        by appending, as when it is sealed into a segment or archived.
 
-    def _insert_record_locations(self, record_dict):
-        update_record_locations = """
-        UPDATE record_locations SET end_block_num = {}
-        WHERE end_block_num = {} AND record_id = '{}'
-        """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
-
-        insert_record_locations = [
-            """
-            INSERT INTO record_locations (
-            record_id,
-            latitude,
-            longitude,
-            timestamp,
-            start_block_num,
-            end_block_num)
-            VALUES ('{}', '{}', '{}', '{}', '{}', '{}');
-            """.format(
+        The current rows are compared with the incoming entries by their
+        number, and by the first and last of them, so the rest of the
+        history is neither read nor written again.
+        """
+        # Rows staged for the same history are written first, so they are
+        # compared too
+        key = (record_dict['record_id'], segment)
+        if key in self._staged_open[table] or \
+                key in self._staged_closes[table]:
+            self.flush()
+
+        with self._conn.cursor() as cursor:
+            self._execute(
+                cursor,
+                'count_' + table,
+                record_dict['end_block_num'],
                 record_dict['record_id'],
-                location['latitude'],
-                location['longitude'],
-                location['timestamp'],
+                segment)
+            count, first_id, last_id = cursor.fetchone()
+        if not count:
+            return entries
+        if len(entries) < count:
+            return None
+
+        with self._conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            self._execute(cursor, 'fetch_ends_' + table, first_id, last_id)
+            rows = cursor.fetchall()
+        ends = (entries[0], entries[count - 1])
+        if all(row[column] == entry[column]
+               for row, entry in zip((rows[0], rows[-1]), ends)
+               for column in columns):
+            return entries[count:]
+        return None
+
+    def _insert_record_locations(self, record_dict, segment=None):
+        locations = self._find_appended(
+            'record_locations',
+            LOCATION_COLUMNS,
+            record_dict,
+            record_dict['locations'],
+            segment)
+        if locations is None:
+            self._close_record_rows('record_locations', record_dict, segment)
+            locations = record_dict['locations']
+
+        self._insert_rows('record_locations', [
+            dict(
+                location,
+                record_id=record_dict['record_id'],
+                segment=segment,
+                start_block_num=record_dict['start_block_num'],
+                end_block_num=record_dict['end_block_num'])
+            for location in locations
+        ])
+
+    def _insert_record_owners(self, record_dict, segment=None):
+        owners = self._find_appended(
+            'record_owners',
+            OWNER_COLUMNS,
+            record_dict,
+            record_dict['owners'],
+            segment)
+        if owners is None:
+            self._close_record_rows('record_owners', record_dict, segment)
+            owners = record_dict['owners']
+
+        self._insert_rows('record_owners', [
+            dict(
+                owner,
+                record_id=record_dict['record_id'],
+                segment=segment,
+                start_block_num=record_dict['start_block_num'],
+                end_block_num=record_dict['end_block_num'])
+            for owner in owners
+        ])
+
+    def _close_record_rows(self, table, record_dict, segment=None):
+        if self._bulk:
+            self._stage_close(
+                table,
+                (record_dict['record_id'], segment),
                 record_dict['start_block_num'],
                 record_dict['end_block_num'])
-            for location in record_dict['locations']
-        ]
+            return
+
         with self._conn.cursor() as cursor:
-            cursor.execute(update_record_locations)
-            for insert in insert_record_locations:
-                cursor.execute(insert)
-
-    def _insert_record_owners(self, record_dict):
-        update_record_owners = """
-        UPDATE record_owners SET end_block_num = {}
-        WHERE end_block_num = {} AND record_id = '{}'
-        """.format(
-            record_dict['start_block_num'],
-            record_dict['end_block_num'],
-            record_dict['record_id'])
-
-        insert_record_owners = [
-            """
-            INSERT INTO record_owners (
-            record_id,
-            agent_id,
-            timestamp,
-            start_block_num,
-            end_block_num)
-            VALUES ('{}', '{}', '{}', '{}', '{}');
-            """.format(
-                record_dict['record_id'],
-                owner['agent_id'],
-                owner['timestamp'],
+            self._execute(
+                cursor,
+                'close_' + table,
                 record_dict['start_block_num'],
-                record_dict['end_block_num'])
-            for owner in record_dict['owners']
-        ]
+                record_dict['end_block_num'],
+                record_dict['record_id'],
+                segment)
+
+    def _insert_rows(self, table, rows):
+        """Inserts rows of a table, or stages them with bulk writes
+        """
+        if self._bulk:
+            self._stage_rows(table, rows)
+            return
+
         with self._conn.cursor() as cursor:
-            cursor.execute(update_record_owners)
-            for insert in insert_record_owners:
-                cursor.execute(insert)
+            for values in rows:
+                self._execute(
+                    cursor,
+                    'insert_' + table,
+                    *[values[column] for column in STAGED_COLUMNS[table]])
+
+    def _execute(self, cursor, name, *params):
+        """Executes one of STATEMENTS, preparing it first if it has not been
+        prepared on this connection yet
+        """
+        if name not in self._prepared:
+            types, statement = STATEMENTS[name]
+            cursor.execute('PREPARE {}{} AS {}'.format(
+                name,
+                '({})'.format(', '.join(types)) if types else '',
+                statement))
+            self._prepared.add(name)
+        cursor.execute(
+            'EXECUTE {}{}'.format(
+                name,
+                '({})'.format(', '.join(['%s'] * len(params)))
+                if params else ''),
+            params)
+
+    def _stage_version(self, table, values):
+        """Stages a new version of something, closing its current one
+        """
+        self._stage_close(
+            table,
+            tuple(values[column] for column in VERSION_KEYS[table]),
+            values['start_block_num'],
+            values['end_block_num'])
+        self._stage_rows(table, [values])
+
+    def _stage_rows(self, table, rows):
+        columns = STAGED_COLUMNS[table]
+        keys = VERSION_KEYS[table]
+        for values in rows:
+            row = [values[column] for column in columns]
+            self._staged_rows[table].append(row)
+            self._staged_open[table].setdefault(
+                tuple(values[column] for column in keys), []).append(row)
+
+    def _stage_close(self, table, key, start_block_num, end_block_num):
+        # Rows staged earlier in the block are closed before they are
+        # written, and those already written once the block is flushed
+        for row in self._staged_open[table].pop(key, []):
+            if row[-1] == end_block_num:
+                row[-1] = start_block_num
+        self._staged_closes[table][key] = (start_block_num, end_block_num)
+
+    def _clear_staged(self):
+        self._staged_rows.clear()
+        self._staged_open.clear()
+        self._staged_closes.clear()
+
+
+def _close_versions_statement(table):
+    """Returns an UPDATE closing the current versions of a table for a list
+    of (key..., start_block_num, end_block_num) values, and the template of
+    those values. Segments are compared so that null matches null.
+    """
+    keys = VERSION_KEYS[table]
+    update = """
+    UPDATE {} AS version SET end_block_num = closed.start_block_num
+    FROM (VALUES %s) AS closed ({}, start_block_num, end_block_num)
+    WHERE version.end_block_num = closed.end_block_num AND {}
+    """.format(
+        table,
+        ', '.join(keys),
+        ' AND '.join(
+            'version.{0} IS NOT DISTINCT FROM closed.{0}'.format(key)
+            if key == 'segment' else
+            'version.{0} = closed.{0}'.format(key)
+            for key in keys))
+    template = '({})'.format(', '.join(
+        ['%s::bigint' if key == 'segment' else '%s' for key in keys] +
+        ['%s::bigint', '%s::bigint']))
+    return update, template
@@ -15,15 +15,24 @@
 
 from simple_supply_addressing.addresser import AddressSpace
 from simple_supply_addressing.addresser import get_address_type
+from simple_supply_encoding.events import EVENT_DATA
+from simple_supply_encoding.history import unpack_history
 from simple_supply_protobuf.agent_pb2 import AgentContainer
+from simple_supply_protobuf.location_index_pb2 import LocationIndexContainer
 from simple_supply_protobuf.record_pb2 import RecordContainer
+from simple_supply_protobuf.record_pb2 import RecordSegmentContainer
 
 
 CONTAINERS = {
     AddressSpace.AGENT: AgentContainer,
-    AddressSpace.RECORD: RecordContainer
+    AddressSpace.RECORD: RecordContainer,
+    AddressSpace.RECORD_SEGMENT: RecordSegmentContainer,
+    AddressSpace.GEOHASH_INDEX: LocationIndexContainer
 }
 
+# Address spaces whose entries may store their history packed
+HISTORY_TYPES = (AddressSpace.RECORD, AddressSpace.RECORD_SEGMENT)
+
 
 def deserialize_data(address, data):
     """Deserializes state data by type based on the address structure and
@@ -44,9 +53,29 @@ def deserialize_data(address, data):
         raise TypeError('Unknown data type: {}'.format(data_type))
 
     entries = _parse_proto(container, data).entries
+    if data_type in HISTORY_TYPES:
+        for entry in entries:
+            unpack_history(entry)
     return data_type, [_convert_proto_to_dict(pb) for pb in entries]
 
 
+def deserialize_event(event):
+    """Deserializes a Simple Supply receipt event and returns it as a
+    dictionary of its data and attributes, with its event type
+
+    Args:
+        event (events_pb2.Event): The event emitted by the processor
+    """
+    try:
+        message_class = EVENT_DATA[event.event_type]
+    except KeyError:
+        raise TypeError('Unknown event type: {}'.format(event.event_type))
+
+    resource = _convert_proto_to_dict(_parse_proto(message_class, event.data))
+    resource.update((attr.key, attr.value) for attr in event.attributes)
+    return event.event_type, resource
+
+
 def _parse_proto(proto_class, data):
     deserialized = proto_class()
     deserialized.ParseFromString(data)
@@ -63,7 +92,7 @@ def _convert_proto_to_dict(proto):
         if field.type == field.TYPE_MESSAGE:
             if field.label == field.LABEL_REPEATED:
                 result[key] = [_convert_proto_to_dict(p) for p in value]
-            else:
+            elif proto.HasField(key):
                 result[key] = _convert_proto_to_dict(value)
 
         elif field.type == field.TYPE_ENUM:
@@ -15,34 +15,53 @@
 
 import re
 import logging
-import math
 
 import psycopg2
+from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChange
 from sawtooth_sdk.protobuf.transaction_receipt_pb2 import StateChangeList
 
+from simple_supply_addressing.address_index import AddressIndex
 from simple_supply_addressing.addresser import AddressSpace
-from simple_supply_addressing.addresser import NAMESPACE
+from simple_supply_addressing.addresser import get_address_type
+from simple_supply_addressing.addresser import get_namespace_regex
+from simple_supply_encoding import events as receipt_events
 from simple_supply_subscriber.decoding import deserialize_data
+from simple_supply_subscriber.decoding import deserialize_event
+from simple_supply_subscriber.migrations import MAX_BLOCK_NUMBER
 
 
-MAX_BLOCK_NUMBER = int(math.pow(2, 63)) - 1
-NAMESPACE_REGEX = re.compile('^{}'.format(NAMESPACE))
 LOGGER = logging.getLogger(__name__)
 
 
-def get_events_handler(database):
+def get_events_handler(database, use_receipt_events=False, tenant=''):
     """Returns a events handler with a reference to a specific Database object.
     The handler takes a list of events and updates the Database appropriately.
-    """
-    return lambda events: _handle_events(database, events)
-
 
-def _handle_events(database, events):
+    Args:
+        database (Database): The database to update
+        use_receipt_events (bool): Whether to apply the processor's compact
+            receipt events, rather than state deltas
+        tenant (str): The tenant whose changes to apply, or '' for the
+            default tenant. Changes of every other tenant are ignored
+    """
+    if use_receipt_events:
+        apply_changes = _apply_receipt_events
+    else:
+        apply_changes = _apply_state_changes
+    address_index = AddressIndex(
+        (AddressSpace(space), key)
+        for space, key in database.fetch_address_keys())
+    return lambda events: _handle_events(
+        database, events, apply_changes, address_index, tenant)
+
+
+def _handle_events(database, events, apply_changes, address_index, tenant):
     block_num, block_id = _parse_new_block(events)
     try:
         is_duplicate = _resolve_if_forked(database, block_num, block_id)
         if not is_duplicate:
-            _apply_state_changes(database, events, block_num, block_id)
+            apply_changes(
+                database, events, block_num, block_id, address_index, tenant)
         database.commit()
     except psycopg2.DatabaseError as err:
         LOGGER.exception('Unable to handle event: %s', err)
@@ -77,20 +96,77 @@ def _resolve_if_forked(database, block_num, block_id):
     return False
 
 
-def _apply_state_changes(database, events, block_num, block_id):
-    changes = _parse_state_changes(events)
+def _apply_state_changes(database,
+                         events,
+                         block_num,
+                         block_id,
+                         address_index,
+                         tenant):
+    database.insert_block({'block_num': block_num, 'block_id': block_id})
+    changes = _parse_state_changes(events, tenant)
     for change in changes:
+        if change.type == StateChange.DELETE:
+            # Deleted addresses carry no data to tell what they held
+            LOGGER.debug(
+                'Deleted %s',
+                address_index.lookup(change.address) or change.address)
+            continue
         data_type, resources = deserialize_data(change.address, change.value)
-        database.insert_block({'block_num': block_num, 'block_id': block_id})
         if data_type == AddressSpace.AGENT:
             _apply_agent_change(database, block_num, resources)
+            _index_keys(database, address_index, data_type, [
+                agent['public_key'] for agent in resources])
         elif data_type == AddressSpace.RECORD:
             _apply_record_change(database, block_num, resources)
+            _index_keys(database, address_index, data_type, [
+                record['record_id'] for record in resources])
+        elif data_type == AddressSpace.RECORD_SEGMENT:
+            _apply_record_segment_change(database, block_num, resources)
         else:
             LOGGER.warning('Unsupported data type: %s', data_type)
 
-
-def _parse_state_changes(events):
+    for event in events:
+        if event.event_type == receipt_events.HISTORY_ARCHIVED and \
+                _get_tenant(event) == tenant:
+            _, archived = deserialize_event(event)
+            archived['start_block_num'] = block_num
+            archived['end_block_num'] = MAX_BLOCK_NUMBER
+            database.insert_archived_history(archived)
+
+
+def _apply_receipt_events(database,
+                          events,
+                          block_num,
+                          block_id,
+                          address_index,
+                          tenant):
+    database.insert_block({'block_num': block_num, 'block_id': block_id})
+    for event in events:
+        if event.event_type not in receipt_events.EVENT_DATA or \
+                _get_tenant(event) != tenant:
+            continue
+        event_type, resource = deserialize_event(event)
+        resource['start_block_num'] = block_num
+        resource['end_block_num'] = MAX_BLOCK_NUMBER
+        if event_type == receipt_events.AGENT_CREATED:
+            database.insert_agent(resource)
+            _index_keys(database, address_index, AddressSpace.AGENT, [
+                resource['public_key']])
+        elif event_type == receipt_events.RECORD_CREATED:
+            database.insert_record(resource)
+            _index_keys(database, address_index, AddressSpace.RECORD, [
+                resource['record_id']])
+        elif event_type == receipt_events.RECORD_UPDATED:
+            database.insert_record_location(resource)
+        elif event_type == receipt_events.RECORD_TRANSFERRED:
+            database.insert_record_owner(resource)
+        elif event_type in (receipt_events.RECORD_ATTACHED,
+                            receipt_events.RECORD_DETACHED):
+            database.insert_record_parent(resource)
+        # Archived history was appended when it was recorded, and is kept
+
+
+def _parse_state_changes(events, tenant):
     try:
         change_data = next(e.data for e in events
                            if e.event_type == 'sawtooth/state-delta')
@@ -99,8 +175,29 @@ def _parse_state_changes(events):
 
     state_change_list = StateChangeList()
     state_change_list.ParseFromString(change_data)
+    # The location index and holdings are derived from record locations and
+    # owners, which the database already stores, and geofences are only
+    # used by the transaction processor
+    namespace_regex = re.compile(get_namespace_regex(tenant))
     return [c for c in state_change_list.state_changes
-            if NAMESPACE_REGEX.match(c.address)]
+            if namespace_regex.match(c.address)
+            and get_address_type(c.address) not in (
+                AddressSpace.GEOHASH_INDEX,
+                AddressSpace.GEOFENCE,
+                AddressSpace.HOLDING)]
+
+
+def _get_tenant(event):
+    for attribute in event.attributes:
+        if attribute.key == 'tenant':
+            return attribute.value
+    return ''
+
+
+def _index_keys(database, address_index, address_space, keys):
+    for key in keys:
+        if address_index.add(address_space, key):
+            database.insert_address_key(address_space, key)
 
 
 def _apply_agent_change(database, block_num, agents):
@@ -115,3 +212,10 @@ def _apply_record_change(database, block_num, records):
         record['start_block_num'] = block_num
         record['end_block_num'] = MAX_BLOCK_NUMBER
         database.insert_record(record)
+
+
+def _apply_record_segment_change(database, block_num, segments):
+    for segment in segments:
+        segment['start_block_num'] = block_num
+        segment['end_block_num'] = MAX_BLOCK_NUMBER
+        database.insert_record_segment(segment)
@@ -17,10 +17,6 @@ import argparse
 import sys
 import logging
 
-from simple_supply_subscriber.database import Database
-from simple_supply_subscriber.subscriber import Subscriber
-from simple_supply_subscriber.event_handling import get_events_handler
-
 
 KNOWN_COUNT = 15
 LOGGER = logging.getLogger(__name__)
@@ -70,6 +66,22 @@ def parse_args(args):
         '-C', '--connect',
         help='The url of the validator to subscribe to',
         default='tcp://localhost:4004')
+    subscribe_parser.add_argument(
+        '--mode',
+        help='Whether to ingest state deltas, or the compact receipt events '
+        'emitted by the transaction processor',
+        choices=['state-delta', 'events'],
+        default='state-delta')
+    subscribe_parser.add_argument(
+        '--tenant',
+        help='The tenant whose state to ingest into the database. Omit for '
+        'the default tenant',
+        default='')
+    subscribe_parser.add_argument(
+        '--per-row-writes',
+        action='store_true',
+        help='Write each row of a block with its own statement, instead of '
+        'staging the rows of the block and writing them in bulk')
 
     return parser.parse_args(args)
 
@@ -86,6 +98,12 @@ def init_logger(level):
 
 
 def do_subscribe(opts):
+    # psycopg2, the SDK, and the protobuf modules are imported by the
+    # subcommands that use them; init only needs the database
+    from simple_supply_subscriber.database import Database
+    from simple_supply_subscriber.event_handling import get_events_handler
+    from simple_supply_subscriber.subscriber import Subscriber
+
     LOGGER.info('Starting subscriber...')
     try:
         dsn = 'dbname={} user={} password={} host={} port={}'.format(
@@ -95,10 +113,15 @@ def do_subscribe(opts):
             opts.db_host,
             opts.db_port)
 
-        database = Database(dsn)
+        database = Database(dsn, bulk=not opts.per_row_writes)
         database.connect()
-        subscriber = Subscriber(opts.connect)
-        subscriber.add_handler(get_events_handler(database))
+        use_receipt_events = opts.mode == 'events'
+        subscriber = Subscriber(
+            opts.connect,
+            use_receipt_events=use_receipt_events,
+            tenant=opts.tenant)
+        subscriber.add_handler(
+            get_events_handler(database, use_receipt_events, opts.tenant))
         known_blocks = database.fetch_last_known_blocks(KNOWN_COUNT)
         known_ids = [block['block_id'] for block in known_blocks]
         subscriber.start(known_ids=known_ids)
@@ -121,6 +144,8 @@ def do_subscribe(opts):
 
 
 def do_init(opts):
+    from simple_supply_subscriber.database import Database
+
     LOGGER.info('Initializing subscriber...')
     try:
         dsn = 'dbname={} user={} password={} host={} port={}'.format(
@@ -131,7 +156,11 @@ def do_init(opts):
             opts.db_port)
         database = Database(dsn)
         database.connect()
-        database.create_tables()
+        versions = database.migrate()
+        if versions:
+            LOGGER.info('Applied migrations: %s', versions)
+        else:
+            LOGGER.info('Database schema is up to date')
 
     except Exception as err:  # pylint: disable=broad-except
         LOGGER.exception('Unable to initialize subscriber database: %s', err)
@@ -0,0 +1,155 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+# The end_block_num of the current version of each agent, record, owner,
+# and location
+MAX_BLOCK_NUMBER = 2 ** 63 - 1
+
+
+CREATE_BLOCK_STMTS = """
+CREATE TABLE IF NOT EXISTS blocks (
+    block_num  bigint PRIMARY KEY,
+    block_id   varchar
+);
+"""
+
+
+CREATE_AUTH_STMTS = """
+CREATE TABLE IF NOT EXISTS auth (
+    public_key            varchar PRIMARY KEY,
+    hashed_password       varchar,
+    encrypted_private_key varchar
+)
+"""
+
+
+CREATE_RECORD_STMTS = """
+CREATE TABLE IF NOT EXISTS records (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    parent_id        varchar,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+ALTER TABLE records ADD COLUMN IF NOT EXISTS parent_id varchar;
+"""
+
+
+CREATE_RECORD_LOCATION_STMTS = """
+CREATE TABLE IF NOT EXISTS record_locations (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    latitude         bigint,
+    longitude        bigint,
+    timestamp        bigint,
+    segment          bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+ALTER TABLE record_locations ADD COLUMN IF NOT EXISTS segment bigint;
+"""
+
+
+CREATE_RECORD_OWNER_STMTS = """
+CREATE TABLE IF NOT EXISTS record_owners (
+    id               bigserial PRIMARY KEY,
+    record_id        varchar,
+    agent_id         varchar,
+    timestamp        bigint,
+    segment          bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+ALTER TABLE record_owners ADD COLUMN IF NOT EXISTS segment bigint;
+"""
+
+
+CREATE_AGENT_STMTS = """
+CREATE TABLE IF NOT EXISTS agents (
+    id               bigserial PRIMARY KEY,
+    public_key       varchar,
+    name             varchar,
+    timestamp        bigint,
+    start_block_num  bigint,
+    end_block_num    bigint
+);
+"""
+
+
+# The public keys, record ids, and geofence ids seen so far, from which the
+# address index is rebuilt. Addresses are derived from keys the same way on
+# every fork, so rows are never removed
+CREATE_ADDRESS_KEY_STMTS = """
+CREATE TABLE IF NOT EXISTS address_keys (
+    address_space  smallint,
+    key            varchar,
+    PRIMARY KEY (address_space, key)
+);
+"""
+
+
+CREATE_MIGRATION_STMTS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version      integer PRIMARY KEY,
+    description  varchar,
+    applied_at   timestamp DEFAULT current_timestamp
+);
+"""
+
+
+# The indexes of each versioned table, as (name, table, columns). Versions
+# are looked up by their key and block range, and dropped with forks by
+# block number. Only closed versions are indexed by end_block_num alone:
+# the current ones all share MAX_BLOCK_NUMBER, and are most of the rows of
+# the history tables
+CLOSED_VERSIONS = '(end_block_num) WHERE end_block_num < {}'.format(
+    MAX_BLOCK_NUMBER)
+INDEXES = [
+    ('agents_key', 'agents', '(public_key, end_block_num)'),
+    ('agents_start_block_num', 'agents', '(start_block_num)'),
+    ('agents_closed', 'agents', CLOSED_VERSIONS),
+    ('records_key', 'records', '(record_id, end_block_num)'),
+    ('records_start_block_num', 'records', '(start_block_num)'),
+    ('records_closed', 'records', CLOSED_VERSIONS),
+    ('record_locations_key', 'record_locations', '(record_id, end_block_num)'),
+    ('record_locations_start_block_num', 'record_locations',
+     '(start_block_num)'),
+    ('record_locations_closed', 'record_locations', CLOSED_VERSIONS),
+    ('record_owners_key', 'record_owners', '(record_id, end_block_num)'),
+    ('record_owners_start_block_num', 'record_owners', '(start_block_num)'),
+    ('record_owners_closed', 'record_owners', CLOSED_VERSIONS),
+]
+
+
+# The schema, as (version, description, statements). Each migration not yet
+# recorded in schema_migrations is applied in order. A released migration
+# is never changed; the schema is changed by adding one. The first creates
+# the tables if needed, so databases created before migrations were
+# recorded are upgraded in place
+MIGRATIONS = [
+    (1, 'Create tables', [
+        CREATE_BLOCK_STMTS,
+        CREATE_AUTH_STMTS,
+        CREATE_RECORD_STMTS,
+        CREATE_RECORD_LOCATION_STMTS,
+        CREATE_RECORD_OWNER_STMTS,
+        CREATE_AGENT_STMTS,
+        CREATE_ADDRESS_KEY_STMTS,
+    ]),
+    (2, 'Index versions by key and block number', [
+        'CREATE INDEX IF NOT EXISTS {} ON {} {}'.format(name, table, columns)
+        for name, table, columns in INDEXES
+    ]),
+]
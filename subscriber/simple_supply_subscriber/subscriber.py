@@ -28,7 +28,9 @@ from sawtooth_sdk.protobuf.events_pb2 import EventFilter
 from sawtooth_sdk.protobuf.validator_pb2 import Message
 from sawtooth_sdk.messaging.stream import Stream
 
-from simple_supply_addressing.addresser import NAMESPACE
+from simple_supply_addressing.addresser import get_namespace_regex
+from simple_supply_encoding.events import EVENT_DATA
+from simple_supply_encoding.events import HISTORY_ARCHIVED
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,10 +41,15 @@ class Subscriber(object):
     """Creates an object that can subscribe to state delta events using the
     Sawtooth SDK's Stream class. Handler functions can be added prior to
     subscribing, and each will be called on each delta event received.
+    With use_receipt_events, the processor's own receipt events are
+    subscribed to instead of state deltas. Only one tenant's changes are
+    subscribed to, where the validator can filter them.
     """
-    def __init__(self, validator_url):
+    def __init__(self, validator_url, use_receipt_events=False, tenant=''):
         LOGGER.info('Connecting to validator: %s', validator_url)
         self._stream = Stream(validator_url)
+        self._use_receipt_events = use_receipt_events
+        self._tenant = tenant
         self._event_handlers = []
         self._is_active = False
 
@@ -68,16 +75,38 @@ class Subscriber(object):
         LOGGER.debug('Subscribing to state delta events')
 
         block_sub = EventSubscription(event_type='sawtooth/block-commit')
-        delta_sub = EventSubscription(
-            event_type='sawtooth/state-delta',
-            filters=[EventFilter(
-                key='address',
-                match_string='^{}.*'.format(NAMESPACE),
-                filter_type=EventFilter.REGEX_ANY)])
+        # Events of the default tenant carry no tenant attribute to filter
+        # on, so other tenants' events are dropped by the events handler
+        tenant_filters = [
+            EventFilter(
+                key='tenant',
+                match_string=self._tenant,
+                filter_type=EventFilter.SIMPLE_ALL)
+        ] if self._tenant else []
+        if self._use_receipt_events:
+            change_subs = [
+                EventSubscription(
+                    event_type=event_type, filters=tenant_filters)
+                for event_type in EVENT_DATA
+            ]
+        else:
+            # Archived history is removed from state without appearing in
+            # any delta, so its event is needed to keep it in the database
+            change_subs = [
+                EventSubscription(
+                    event_type='sawtooth/state-delta',
+                    filters=[EventFilter(
+                        key='address',
+                        match_string='{}.*'.format(
+                            get_namespace_regex(self._tenant)),
+                        filter_type=EventFilter.REGEX_ANY)]),
+                EventSubscription(
+                    event_type=HISTORY_ARCHIVED, filters=tenant_filters)
+            ]
 
         request = ClientEventsSubscribeRequest(
             last_known_block_ids=known_ids,
-            subscriptions=[block_sub, delta_sub])
+            subscriptions=[block_sub] + change_subs)
         response_future = self._stream.send(
             Message.CLIENT_EVENTS_SUBSCRIBE_REQUEST,
             request.SerializeToString())
@@ -13,6 +13,7 @@
 # limitations under the License.
 # -----------------------------------------------------------------------------
 
+import base64
 import logging
 import sys
 import time
@@ -28,6 +29,9 @@ from sawtooth_rest_api.protobuf import batch_pb2
 from sawtooth_signing import create_context
 from sawtooth_signing import CryptoFactory
 
+from simple_supply_addressing import addresser
+from simple_supply_protobuf import holding_pb2
+from simple_supply_protobuf import payload_pb2
 from simple_supply_rest_api import transaction_creation
 
 
@@ -299,17 +303,431 @@ class SimpleSupplyTest(unittest.TestCase):
             "INVALID",
             "Longitude must be between -180 and 180. Got -181")
 
+    def test_05_bundle(self):
+        """ Tests the BundleAction validation rules.
+
+        Notes:
+            BundleAction validation rules:
+                - The bundle contains at least one action
+                - Every action is a create, update, or transfer record action
+                - Every action passes its own validation rules, given the
+                  actions before it in the bundle
+        """
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer1,
+                actions=[
+                    make_create_record_payload('bundle1', 0, 0, 1),
+                    make_update_record_payload('bundle1', 1000000, 0, 2),
+                    make_update_record_payload('bundle1', 2000000, 0, 3),
+                    make_transfer_record_payload(
+                        'bundle1', self.signer2.get_public_key().as_hex(), 4)
+                ],
+                timestamp=5)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer1,
+                actions=[],
+                timestamp=6)[0]['status'],
+            "INVALID",
+            "Bundle contains no actions")
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer2,
+                actions=[
+                    make_update_record_payload('bundle1', 3000000, 0, 7),
+                    make_transfer_record_payload(
+                        'bundle1', self.signer1.get_public_key().as_hex(), 8),
+                    make_update_record_payload('bundle1', 4000000, 0, 9)
+                ],
+                timestamp=10)[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer2,
+                actions=[
+                    make_update_record_payload('bundle1', 3000000, 0, 11),
+                    make_update_record_payload('bundle1', 91000000, 0, 12)
+                ],
+                timestamp=13)[0]['status'],
+            "INVALID",
+            "Latitude must be between -90 and 90. Got 91")
+
+    def test_06_record_history_segments(self):
+        """ Tests that records keep accepting updates and transfers once
+        their history has been sealed into segments.
+        """
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer1,
+                actions=[make_create_record_payload('history1', 0, 0, 1)] + [
+                    make_update_record_payload('history1', i, i, i + 1)
+                    for i in range(1, 150)
+                ],
+                timestamp=151)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.update_record(
+                key=self.signer1,
+                latitude=150,
+                longitude=150,
+                record_id='history1',
+                timestamp=152)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer1,
+                receiving_agent=self.signer2.get_public_key().as_hex(),
+                record_id='history1',
+                timestamp=153)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.update_record(
+                key=self.signer1,
+                latitude=151,
+                longitude=151,
+                record_id='history1',
+                timestamp=154)[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
+    def test_07_archive_history(self):
+        """ Tests the ArchiveHistoryAction validation rules.
+        """
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer1,
+                actions=[make_create_record_payload('archive1', 0, 0, 1)] + [
+                    make_update_record_payload('archive1', i, i, i + 1)
+                    for i in range(1, 150)
+                ],
+                timestamp=151)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.archive_history(
+                key=self.signer1,
+                record_id='archive1',
+                cutoff=100,
+                timestamp=152)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.archive_history(
+                key=self.signer1,
+                record_id='archive1',
+                cutoff=100,
+                timestamp=153)[0]['status'],
+            "INVALID",
+            "Record with the record id archive1 has no history from before "
+            "100 to archive")
+
+        self.assertEqual(
+            self.client.archive_history(
+                key=self.signer2,
+                record_id='archive1',
+                cutoff=200,
+                timestamp=154)[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
+        self.assertEqual(
+            self.client.archive_history(
+                key=self.signer1,
+                record_id='notarecord',
+                cutoff=200,
+                timestamp=155)[0]['status'],
+            "INVALID",
+            "Record with the record id notarecord does not exist")
+
+        self.assertEqual(
+            self.client.archive_history(
+                key=self.signer1,
+                record_id='archive1',
+                cutoff=200,
+                timestamp=156)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.update_record(
+                key=self.signer1,
+                latitude=150,
+                longitude=150,
+                record_id='archive1',
+                timestamp=157)[0]['status'],
+            "COMMITTED")
+
+    def test_08_geofences(self):
+        """ Tests the SetGeofenceAction and SetMaxSpeedAction validation
+        rules.
+
+        Notes:
+            No geofence administrators are configured on the test network,
+            so locations are not restricted.
+        """
+
+        self.assertEqual(
+            self.client.set_geofence(
+                key=self.signer1,
+                geofence_id='fence1',
+                vertices=[(0, 0), (0, 1000000), (1000000, 1000000)],
+                timestamp=158)[0]['status'],
+            "INVALID",
+            "Transaction signer is not a geofence administrator")
+
+        self.assertEqual(
+            self.client.set_max_speed(
+                key=self.signer1,
+                max_speed=1,
+                timestamp=159)[0]['status'],
+            "INVALID",
+            "Transaction signer is not a geofence administrator")
+
+        self.assertEqual(
+            self.client.update_record(
+                key=self.signer1,
+                latitude=-80000000,
+                longitude=-170000000,
+                record_id='archive1',
+                timestamp=160)[0]['status'],
+            "COMMITTED")
+
+    def test_09_attach_record(self):
+        """ Tests the AttachRecordAction and DetachRecordAction validation
+        rules.
+        """
+
+        self.assertEqual(
+            self.client.bundle(
+                key=self.signer1,
+                actions=[
+                    make_create_record_payload('pallet1', 0, 0, 161),
+                    make_create_record_payload('carton1', 0, 0, 161)
+                ],
+                timestamp=161)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.attach_record(
+                key=self.signer1,
+                record_id='carton1',
+                parent_id='carton1',
+                timestamp=162)[0]['status'],
+            "INVALID",
+            "Record carton1 cannot be attached to itself or to a record "
+            "attached to it")
+
+        self.assertEqual(
+            self.client.attach_record(
+                key=self.signer1,
+                record_id='carton1',
+                parent_id='pallet1',
+                timestamp=163)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.attach_record(
+                key=self.signer1,
+                record_id='pallet1',
+                parent_id='carton1',
+                timestamp=164,
+                ancestors=['pallet1'])[0]['status'],
+            "INVALID",
+            "Record pallet1 cannot be attached to itself or to a record "
+            "attached to it")
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer1,
+                receiving_agent=self.signer2.get_public_key().as_hex(),
+                record_id='carton1',
+                timestamp=165)[0]['status'],
+            "INVALID",
+            "Record carton1 is attached to pallet1, and moves with it until "
+            "it is detached")
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer1,
+                receiving_agent=self.signer2.get_public_key().as_hex(),
+                record_id='pallet1',
+                timestamp=166)[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.detach_record(
+                key=self.signer1,
+                record_id='carton1',
+                timestamp=167,
+                ancestors=['pallet1'])[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
+        self.assertEqual(
+            self.client.detach_record(
+                key=self.signer2,
+                record_id='carton1',
+                timestamp=168,
+                ancestors=['pallet1'])[0]['status'],
+            "COMMITTED")
+
+        self.assertEqual(
+            self.client.detach_record(
+                key=self.signer2,
+                record_id='carton1',
+                timestamp=169)[0]['status'],
+            "INVALID",
+            "Record carton1 is not attached to another record")
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer2,
+                receiving_agent=self.signer1.get_public_key().as_hex(),
+                record_id='carton1',
+                timestamp=170)[0]['status'],
+            "COMMITTED")
+
+    def test_10_holdings(self):
+        """ Tests that the records an agent holds can be listed from the
+        agent's holding prefix, as they are created and transferred.
+        """
+
+        public_key1 = self.signer1.get_public_key().as_hex()
+        public_key2 = self.signer2.get_public_key().as_hex()
+
+        self.assertIn('carton1', self.client.list_holdings(public_key1))
+        self.assertNotIn('pallet1', self.client.list_holdings(public_key1))
+        self.assertIn('pallet1', self.client.list_holdings(public_key2))
+        self.assertNotIn('carton1', self.client.list_holdings(public_key2))
+
+        self.assertEqual(
+            self.client.create_record(
+                key=self.signer2,
+                latitude=0,
+                longitude=0,
+                record_id='crate1',
+                timestamp=171)[0]['status'],
+            "COMMITTED")
+
+        self.assertIn('crate1', self.client.list_holdings(public_key2))
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer2,
+                receiving_agent=public_key1,
+                record_id='crate1',
+                timestamp=172)[0]['status'],
+            "COMMITTED")
+
+        self.assertIn('crate1', self.client.list_holdings(public_key1))
+        self.assertNotIn('crate1', self.client.list_holdings(public_key2))
+
+    def test_11_tenants(self):
+        """ Tests that transactions are only accepted for tenants listed
+        in the simple_supply.tenants setting.
+        """
+
+        self.assertEqual(
+            self.client.create_agent(
+                key=self.signer1,
+                name='alice',
+                timestamp=173,
+                tenant='unregistered')[0]['status'],
+            "INVALID",
+            "Tenant unregistered is not registered")
+
+    def test_12_backdated_transfer(self):
+        """ Tests that a transfer timestamped before the current owner's
+        leaves the record, and its holding, with the current owner.
+        """
+
+        public_key1 = self.signer1.get_public_key().as_hex()
+        public_key2 = self.signer2.get_public_key().as_hex()
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer1,
+                receiving_agent=public_key2,
+                record_id='crate1',
+                timestamp=150)[0]['status'],
+            "COMMITTED")
+
+        self.assertIn('crate1', self.client.list_holdings(public_key1))
+        self.assertNotIn('crate1', self.client.list_holdings(public_key2))
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer2,
+                receiving_agent=public_key1,
+                record_id='crate1',
+                timestamp=174)[0]['status'],
+            "INVALID",
+            "Transaction signer is not the owner of the record")
+
+        self.assertEqual(
+            self.client.transfer_record(
+                key=self.signer1,
+                receiving_agent=public_key2,
+                record_id='crate1',
+                timestamp=175)[0]['status'],
+            "COMMITTED")
+
+        self.assertIn('crate1', self.client.list_holdings(public_key2))
+        self.assertNotIn('crate1', self.client.list_holdings(public_key1))
+
+
+def make_create_record_payload(record_id, latitude, longitude, timestamp):
+    return payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.CREATE_RECORD,
+        create_record=payload_pb2.CreateRecordAction(
+            record_id=record_id,
+            latitude=latitude,
+            longitude=longitude),
+        timestamp=timestamp)
+
+
+def make_update_record_payload(record_id, latitude, longitude, timestamp):
+    return payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
+        update_record=payload_pb2.UpdateRecordAction(
+            record_id=record_id,
+            latitude=latitude,
+            longitude=longitude),
+        timestamp=timestamp)
+
+
+def make_transfer_record_payload(record_id, receiving_agent, timestamp):
+    return payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD,
+        transfer_record=payload_pb2.TransferRecordAction(
+            record_id=record_id,
+            receiving_agent=receiving_agent),
+        timestamp=timestamp)
+
+
 class SimpleSupplyClient(object):
 
     def __init__(self, url):
         self._client = RestClient(base_url="http://{}".format(url))
 
-    def create_agent(self, key, name, timestamp):
+    def create_agent(self, key, name, timestamp, tenant=''):
         batch = transaction_creation.make_create_agent_transaction(
             transaction_signer=key,
             batch_signer=BATCH_KEY,
             name=name,
-            timestamp=timestamp)
+            timestamp=timestamp,
+            tenant=tenant)
         batch_id = batch.header_signature
         batch_list = batch_pb2.BatchList(batches=[batch])
         self._client.send_batches(batch_list)
@@ -353,6 +771,89 @@ class SimpleSupplyClient(object):
         self._client.send_batches(batch_list)
         return self._client.get_statuses([batch_id], wait=10)
 
+    def archive_history(self, key, record_id, cutoff, timestamp):
+        batch = transaction_creation.make_archive_history_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            record_id=record_id,
+            cutoff=cutoff,
+            timestamp=timestamp)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
+    def attach_record(self, key, record_id, parent_id, timestamp,
+                      ancestors=()):
+        batch = transaction_creation.make_attach_record_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            record_id=record_id,
+            parent_id=parent_id,
+            timestamp=timestamp,
+            ancestors=ancestors)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
+    def detach_record(self, key, record_id, timestamp, ancestors=()):
+        batch = transaction_creation.make_detach_record_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            record_id=record_id,
+            timestamp=timestamp,
+            ancestors=ancestors)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
+    def set_geofence(self, key, geofence_id, vertices, timestamp):
+        batch = transaction_creation.make_set_geofence_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            geofence_id=geofence_id,
+            vertices=vertices,
+            timestamp=timestamp)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
+    def set_max_speed(self, key, max_speed, timestamp):
+        batch = transaction_creation.make_set_max_speed_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            max_speed=max_speed,
+            timestamp=timestamp)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
+    def list_holdings(self, public_key):
+        response = self._client.list_state(
+            subtree=addresser.get_holding_prefix(public_key))
+        record_ids = []
+        for entry in response['data']:
+            container = holding_pb2.HoldingContainer()
+            container.ParseFromString(base64.b64decode(entry['data']))
+            record_ids.extend(
+                holding.record_id for holding in container.entries)
+        return record_ids
+
+    def bundle(self, key, actions, timestamp):
+        batch = transaction_creation.make_bundle_transaction(
+            transaction_signer=key,
+            batch_signer=BATCH_KEY,
+            actions=actions,
+            timestamp=timestamp)
+        batch_id = batch.header_signature
+        batch_list = batch_pb2.BatchList(batches=[batch])
+        self._client.send_batches(batch_list)
+        return self._client.get_statuses([batch_id], wait=10)
+
 def wait_until_status(url, status_code=200, tries=5):
     """Pause the program until the given url returns the required status.
 
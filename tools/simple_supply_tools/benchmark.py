@@ -0,0 +1,510 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+from sawtooth_sdk.protobuf import setting_pb2
+
+from simple_supply_addressing import addresser
+
+from simple_supply_encoding import wire
+from simple_supply_encoding.history import pack_history
+from simple_supply_encoding.history import unpack_history
+
+from simple_supply_protobuf import geofence_pb2
+from simple_supply_protobuf import payload_pb2
+from simple_supply_protobuf import record_pb2
+
+from simple_supply_tp.handler import SimpleSupplyHandler
+from simple_supply_tp.state import SimpleSupplyState
+
+from simple_supply_tools.memory_context import MemoryContext
+from simple_supply_tools.memory_context import make_process_request
+
+
+BENCHMARKS = collections.OrderedDict()
+SIGNER = 'benchmark-agent'
+RECEIVER = 'benchmark-receiver'
+
+
+def benchmark(*sizes, scaled=True):
+    """Registers a benchmark, run once for each of the given sizes. The
+    benchmark receives a Fixture and a size, and returns the number of
+    operations it performed. Sizes are multiplied by --scale unless scaled
+    is False.
+    """
+    def register(func):
+        BENCHMARKS[func.__name__] = (func, sizes, scaled)
+        return func
+    return register
+
+
+class Fixture(object):
+    """Applies Simple Supply transactions to an in-memory context. Only the
+    calls made between start() and stop() are measured.
+    """
+    def __init__(self, get_latency=0, set_latency=0):
+        self.handler = SimpleSupplyHandler()
+        self.context = MemoryContext()
+        self.latencies = []
+        self._timestamp = 0
+        self._get_latency = get_latency
+        self._set_latency = set_latency
+        self._measuring = False
+
+    def start(self):
+        # Latency only applies to measured calls, so large setups stay fast
+        self.context = MemoryContext(
+            state=self.context.state,
+            get_latency=self._get_latency,
+            set_latency=self._set_latency)
+        self._measuring = True
+
+    def stop(self):
+        self._measuring = False
+
+    def apply(self, public_key, payload):
+        payload.timestamp = self.next_timestamp()
+        request = make_process_request(
+            public_key, payload.SerializeToString())
+        if not self._measuring:
+            self.handler.apply(request, self.context)
+            return
+        start = time.perf_counter()
+        self.handler.apply(request, self.context)
+        self.latencies.append(time.perf_counter() - start)
+
+    def measure(self, func, *args):
+        """Measures a call other than a transaction, such as a decoder
+        """
+        start = time.perf_counter()
+        func(*args)
+        self.latencies.append(time.perf_counter() - start)
+
+    def next_timestamp(self):
+        self._timestamp += 1
+        return self._timestamp
+
+    def create_agent(self, public_key):
+        self.apply(public_key, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.CREATE_AGENT,
+            create_agent=payload_pb2.CreateAgentAction(name=public_key)))
+
+    def create_record(self, record_id, public_key=SIGNER, location=(0, 0)):
+        self.apply(public_key, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.CREATE_RECORD,
+            create_record=payload_pb2.CreateRecordAction(
+                record_id=record_id,
+                latitude=location[0],
+                longitude=location[1])))
+
+    def update_record(self, record_id, value, public_key=SIGNER):
+        self.apply(public_key, make_update_payload(record_id, value))
+
+    def transfer_record(self, record_id, public_key, receiving_agent):
+        self.apply(public_key, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.TRANSFER_RECORD,
+            transfer_record=payload_pb2.TransferRecordAction(
+                record_id=record_id,
+                receiving_agent=receiving_agent)))
+
+    def attach_record(self, record_id, parent_id, public_key=SIGNER):
+        self.apply(public_key, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.ATTACH_RECORD,
+            attach_record=payload_pb2.AttachRecordAction(
+                record_id=record_id,
+                parent_id=parent_id)))
+
+    def set_geofences(self, geofences, max_speed=0):
+        """Writes geofences straight to state, rather than applying a
+        transaction for each of them
+        """
+        setting = setting_pb2.Setting(entries=[setting_pb2.Setting.Entry(
+            key=addresser.GEOFENCE_ADMINS_SETTING, value=SIGNER)])
+        self.context.state[addresser.get_setting_address(
+            addresser.GEOFENCE_ADMINS_SETTING)] = setting.SerializeToString()
+
+        state = SimpleSupplyState(self.context)
+        for geofence_id, vertices in geofences:
+            state.set_geofence(geofence_id, [
+                geofence_pb2.Geofence.Vertex(
+                    latitude=latitude, longitude=longitude)
+                for latitude, longitude in vertices
+            ])
+        state.set_max_speed(max_speed)
+        state.flush()
+
+
+def make_update_payload(record_id, value, timestamp=0):
+    return payload_pb2.SimpleSupplyPayload(
+        action=payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
+        update_record=payload_pb2.UpdateRecordAction(
+            record_id=record_id,
+            latitude=value % 90000000,
+            longitude=value % 180000000),
+        timestamp=timestamp)
+
+
+def make_history(record_id, size, packed=True):
+    """Returns a serialized RecordContainer holding a record with size
+    owners and size locations at its own address, as records written
+    before history segments existed may have
+    """
+    record = record_pb2.Record(
+        record_id=record_id,
+        owners=[
+            record_pb2.Record.Owner(
+                agent_id=(RECEIVER, SIGNER)[value % 2], timestamp=value)
+            for value in range(size)
+        ],
+        locations=[
+            record_pb2.Record.Location(
+                latitude=value, longitude=-value, timestamp=value)
+            for value in range(size)
+        ])
+    if packed:
+        pack_history(record)
+    return record_pb2.RecordContainer(entries=[record]).SerializeToString()
+
+
+def parse_head(data):
+    container = record_pb2.RecordContainer()
+    container.ParseFromString(data)
+    record = container.entries[0]
+    unpack_history(record)
+    return wire.get_record_head(record)
+
+
+@benchmark(1000, 10000, 100000)
+def create_agent(fixture, size):
+    fixture.start()
+    for index in range(size):
+        fixture.create_agent('agent-{}'.format(index))
+    return size
+
+
+@benchmark(1000, 10000, 100000)
+def create_record(fixture, size):
+    fixture.create_agent(SIGNER)
+    fixture.start()
+    for index in range(size):
+        fixture.create_record('record-{}'.format(index))
+    return size
+
+
+@benchmark(10, 100, 1000, 10000)
+def update_record(fixture, size):
+    """Updates a record whose history already has size locations"""
+    fixture.create_agent(SIGNER)
+    fixture.create_record('record')
+    for value in range(size):
+        fixture.update_record('record', value)
+    fixture.start()
+    for value in range(1000):
+        fixture.update_record('record', value)
+    return 1000
+
+
+@benchmark(10, 100, 1000, 10000)
+def transfer_record(fixture, size):
+    """Transfers a record whose history already has size owners"""
+    agents = [SIGNER, RECEIVER]
+    for agent in agents:
+        fixture.create_agent(agent)
+    fixture.create_record('record')
+    for index in range(size):
+        fixture.transfer_record('record', agents[index % 2],
+                                agents[(index + 1) % 2])
+    fixture.start()
+    for index in range(size, size + 1000):
+        fixture.transfer_record('record', agents[index % 2],
+                                agents[(index + 1) % 2])
+    return 1000
+
+
+@benchmark(1, 10, 100, 1000)
+def colliding_update(fixture, size):
+    """Updates a record that shares its address with size other records,
+    as if their ids collided
+    """
+    fixture.create_agent(SIGNER)
+    fixture.create_record('record')
+    address = addresser.get_record_address('record')
+    container = record_pb2.RecordContainer()
+    container.ParseFromString(fixture.context.state[address])
+    for index in range(size):
+        container.entries.add(
+            record_id='collision-{}'.format(index),
+            owners=[record_pb2.Record.Owner(agent_id=SIGNER)],
+            locations=[
+                record_pb2.Record.Location(latitude=value, timestamp=value)
+                for value in range(10)
+            ])
+    fixture.context.state[address] = container.SerializeToString()
+    fixture.start()
+    for value in range(1000):
+        fixture.update_record('record', value)
+    return 1000
+
+
+@benchmark(10, 100, 1000)
+def consignment_transfer(fixture, size):
+    """Transfers a pallet with size cartons attached, which move with it.
+    Each record moved counts as an operation.
+    """
+    agents = [SIGNER, RECEIVER]
+    for agent in agents:
+        fixture.create_agent(agent)
+    fixture.create_record('pallet')
+    for index in range(size):
+        fixture.create_record('carton-{}'.format(index))
+        fixture.attach_record('carton-{}'.format(index), 'pallet')
+    fixture.start()
+    for index in range(1000):
+        fixture.transfer_record('pallet', agents[index % 2],
+                                agents[(index + 1) % 2])
+    return 1000 * (size + 1)
+
+
+@benchmark(10, 100, 1000, 10000)
+def geofenced_update(fixture, size):
+    """Updates a record that must stay inside one of size geofences, tiled
+    in a square grid, and under the maximum speed
+    """
+    side = int(size ** 0.5) + 1
+    fence_size = 100000
+    fixture.set_geofences(
+        [('fence-{}'.format(index), [
+            (row * fence_size, column * fence_size),
+            (row * fence_size, (column + 1) * fence_size),
+            ((row + 1) * fence_size, (column + 1) * fence_size),
+            ((row + 1) * fence_size, column * fence_size)
+        ]) for index, (row, column) in enumerate(
+            divmod(index, side) for index in range(size))],
+        max_speed=10000000)
+    centers = [
+        (row * fence_size + fence_size // 2,
+         column * fence_size + fence_size // 2)
+        for row, column in (divmod(index, side) for index in range(size))
+    ]
+    fixture.create_agent(SIGNER)
+    fixture.create_record('record', location=centers[0])
+    fixture.start()
+    for value in range(1000):
+        latitude, longitude = centers[value * 7919 % size]
+        fixture.apply(SIGNER, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.UPDATE_RECORD,
+            update_record=payload_pb2.UpdateRecordAction(
+                record_id='record',
+                latitude=latitude,
+                longitude=longitude)))
+    return 1000
+
+
+@benchmark(1, 10, 100, scaled=False)
+def bundle_update(fixture, size):
+    """Sends 1000 location updates in bundles of size updates each"""
+    fixture.create_agent(SIGNER)
+    fixture.create_record('record')
+    fixture.start()
+    for start in range(0, 1000, size):
+        actions = [
+            make_update_payload('record', value, fixture.next_timestamp())
+            for value in range(start, start + size)
+        ]
+        fixture.apply(SIGNER, payload_pb2.SimpleSupplyPayload(
+            action=payload_pb2.SimpleSupplyPayload.BUNDLE,
+            bundle=payload_pb2.BundleAction(actions=actions)))
+    return 1000
+
+
+@benchmark(64, 1024, 16384, scaled=False)
+def parse_history(fixture, size):
+    """Reads the latest owner and location of a record with size owners
+    and locations by parsing and unpacking its container
+    """
+    data = make_history('record', size)
+    for _ in range(100):
+        fixture.measure(parse_head, data)
+    return 100
+
+
+@benchmark(64, 1024, 16384, scaled=False)
+def scan_history(fixture, size):
+    """Reads the same as parse_history by scanning the wire format"""
+    data = make_history('record', size)
+    for _ in range(100):
+        fixture.measure(wire.scan_record, data, 'record')
+    return 100
+
+
+@benchmark(64, 1024, 16384, scaled=False)
+def attach_to_history(fixture, size):
+    """Attaches records to a parent with size owners and locations, which
+    is only read
+    """
+    fixture.create_agent(SIGNER)
+    for index in range(100):
+        fixture.create_record('carton-{}'.format(index))
+    fixture.context.state[addresser.get_record_address('pallet')] = \
+        make_history('pallet', size, packed=False)
+    fixture.start()
+    for index in range(100):
+        fixture.attach_record('carton-{}'.format(index), 'pallet')
+    return 100
+
+
+def run_benchmarks(names, scale=1.0, get_latency=0, set_latency=0):
+    """Runs the named benchmarks
+
+    Args:
+        names (list of str): The benchmarks to run
+        scale (float): Multiplies every benchmark size
+        get_latency (float): Seconds added to each measured get_state
+        set_latency (float): Seconds added to each measured set_state
+
+    Returns:
+        dict: For each benchmark, a list of results, one per size
+    """
+    results = collections.OrderedDict()
+    for name in names:
+        func, sizes, scaled = BENCHMARKS[name]
+        results[name] = []
+        for size in sizes:
+            if scaled:
+                size = max(int(size * scale), 1)
+            fixture = Fixture(get_latency, set_latency)
+            operations = func(fixture, size)
+            seconds = sum(fixture.latencies)
+            latencies = sorted(fixture.latencies)
+            results[name].append({
+                'size': size,
+                'operations': operations,
+                'transactions': len(latencies),
+                'seconds': seconds,
+                'ops_per_sec': operations / seconds if seconds else 0.0,
+                'p50_us': latencies[len(latencies) // 2] * 1e6,
+                'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6
+            })
+    return results
+
+
+def default_label():
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = time.strftime('%Y%m%d%H%M%S')
+    return '{}-{}'.format(addresser.FAMILY_VERSION, revision)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Measures SimpleSupplyHandler.apply throughput against '
+        'in-memory state')
+
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        help='Benchmarks to run. Runs all of them by default: {}'.format(
+            ', '.join(BENCHMARKS)))
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help='Multiplies the size of the benchmarks that scale')
+    parser.add_argument(
+        '--get-latency',
+        type=float,
+        default=0,
+        help='Milliseconds added to every measured get_state call')
+    parser.add_argument(
+        '--set-latency',
+        type=float,
+        default=0,
+        help='Milliseconds added to every measured set_state call')
+    parser.add_argument(
+        '--label',
+        help='Name of this run. Defaults to the family version and the '
+        'git revision')
+    parser.add_argument(
+        '--results-dir',
+        default='benchmark_results',
+        help='Directory the results are saved to as <label>.json')
+    parser.add_argument(
+        '--compare',
+        help='A previous results file to compare this run against')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    names = opts.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark: {}'.format(name))
+            sys.exit(1)
+
+    label = opts.label or default_label()
+    results = run_benchmarks(
+        names,
+        scale=opts.scale,
+        get_latency=opts.get_latency / 1000,
+        set_latency=opts.set_latency / 1000)
+
+    baseline = {}
+    if opts.compare:
+        with open(opts.compare) as infile:
+            baseline = json.load(infile)['results']
+
+    for name, runs in results.items():
+        print(name)
+        for index, run in enumerate(runs):
+            line = '  size {:>7}  {:>10.1f} ops/s  p50 {:>9.1f} us  ' \
+                'p99 {:>9.1f} us'.format(
+                    run['size'], run['ops_per_sec'],
+                    run['p50_us'], run['p99_us'])
+            try:
+                previous = baseline[name][index]['ops_per_sec']
+                line += '  ({:+.1%})'.format(
+                    run['ops_per_sec'] / previous - 1)
+            except (KeyError, IndexError, ZeroDivisionError):
+                pass
+            print(line)
+
+    os.makedirs(opts.results_dir, exist_ok=True)
+    filename = os.path.join(opts.results_dir, '{}.json'.format(label))
+    with open(filename, 'w') as outfile:
+        json.dump({
+            'label': label,
+            'created': int(time.time()),
+            'scale': opts.scale,
+            'get_latency': opts.get_latency,
+            'set_latency': opts.set_latency,
+            'results': results
+        }, outfile, indent=2)
+    print('Results saved to {}'.format(filename))
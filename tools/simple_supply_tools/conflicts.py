@@ -0,0 +1,224 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import collections
+import sys
+
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from simple_supply_addressing.address_index import AddressIndex
+
+
+class ConflictAnalyzer(object):
+    """Builds the conflict graph of a stream of transactions from their
+    declared inputs and outputs, the same way the validator's parallel
+    scheduler orders them.
+
+    A transaction depends on the most recent earlier transaction that wrote
+    an address it reads or writes, and on every transaction that read an
+    address it writes since that address was last written. Declared
+    addresses may be prefixes; two declarations overlap when one is a prefix
+    of the other.
+    """
+    def __init__(self):
+        self._transaction_ids = []
+        self._levels = []
+        self._edges = []
+        self._last_writer = {}
+        self._readers = collections.defaultdict(list)
+        self._by_prefix = collections.defaultdict(set)
+        self._hot_addresses = collections.Counter()
+
+    def add_batch_list(self, batch_list):
+        for batch in batch_list.batches:
+            for transaction in batch.transactions:
+                header = TransactionHeader()
+                header.ParseFromString(transaction.header)
+                self.add_transaction(
+                    transaction.header_signature,
+                    header.inputs,
+                    header.outputs)
+
+    def add_transaction(self, transaction_id, inputs, outputs):
+        """Adds the next transaction in the stream
+
+        Args:
+            transaction_id (str): The header signature of the transaction
+            inputs (list of str): Addresses or prefixes the transaction reads
+            outputs (list of str): Addresses or prefixes the transaction
+                writes
+        """
+        index = len(self._transaction_ids)
+        inputs = set(inputs)
+        outputs = set(outputs)
+        dependencies = {}
+
+        for address in inputs | outputs:
+            for key in self._overlapping(address):
+                writer = self._last_writer.get(key)
+                if writer is not None:
+                    dependencies.setdefault(writer, key)
+                if address in outputs:
+                    for reader in self._readers[key]:
+                        dependencies.setdefault(reader, key)
+
+        for dependency, key in dependencies.items():
+            self._edges.append((dependency, index))
+            self._hot_addresses[key] += 1
+
+        level = 1 + max(
+            (self._levels[d] for d in dependencies), default=0)
+        self._transaction_ids.append(transaction_id)
+        self._levels.append(level)
+
+        for address in inputs - outputs:
+            self._remember(address)
+            self._readers[address].append(index)
+        for address in outputs:
+            self._remember(address)
+            self._last_writer[address] = index
+            self._readers[address] = []
+
+    def report(self, top=10):
+        """Summarizes the conflict graph
+
+        Args:
+            top (int): The number of hot addresses to include
+
+        Returns:
+            dict: Transaction and edge counts, the length of the longest
+                dependency chain, the resulting parallelism and the
+                addresses responsible for the most dependencies
+        """
+        count = len(self._transaction_ids)
+        depth = max(self._levels, default=0)
+        widths = collections.Counter(self._levels)
+        return {
+            'transactions': count,
+            'edges': len(self._edges),
+            'critical_path': depth,
+            'max_width': max(widths.values(), default=0),
+            'parallelism': count / depth if depth else 0.0,
+            'hot_addresses': self._hot_addresses.most_common(top)
+        }
+
+    def partitions(self):
+        """Splits the transactions into groups with no dependencies between
+        them. Applying each group in order gives the same state whatever
+        order, or however concurrently, the groups are applied in.
+
+        Returns:
+            list of list of int: The position of each transaction in the
+            stream, grouped, with each group in stream order
+        """
+        groups = list(range(len(self._transaction_ids)))
+
+        def find(index):
+            while groups[index] != index:
+                groups[index] = groups[groups[index]]
+                index = groups[index]
+            return index
+
+        for dependency, dependent in self._edges:
+            groups[find(dependent)] = find(dependency)
+
+        partitions = collections.OrderedDict()
+        for index in range(len(groups)):
+            partitions.setdefault(find(index), []).append(index)
+        return list(partitions.values())
+
+    def write_dot(self, out):
+        out.write('digraph conflicts {\n')
+        for index, transaction_id in enumerate(self._transaction_ids):
+            out.write('  t{} [label="{}"];\n'.format(
+                index, transaction_id[:8]))
+        for dependency, dependent in self._edges:
+            out.write('  t{} -> t{};\n'.format(dependency, dependent))
+        out.write('}\n')
+
+    def _remember(self, address):
+        for length in range(2, len(address), 2):
+            self._by_prefix[address[:length]].add(address)
+
+    def _overlapping(self, address):
+        keys = set(self._by_prefix.get(address, ()))
+        for length in range(2, len(address) + 1, 2):
+            prefix = address[:length]
+            if prefix in self._last_writer or prefix in self._readers:
+                keys.add(prefix)
+        return keys
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Reports the conflict graph and achievable parallelism '
+        'of a stream of batches, based on their declared inputs and outputs')
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        help='Files containing serialized BatchLists, in submission order')
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='The number of hot addresses to report')
+    parser.add_argument(
+        '--dot',
+        help='Write the conflict graph in Graphviz format to this file')
+    parser.add_argument(
+        '--address-index',
+        help='A saved address index, used to name the agent, record, or '
+        'geofence each hot address belongs to')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    analyzer = ConflictAnalyzer()
+    for filename in opts.files:
+        with open(filename, 'rb') as infile:
+            batch_list = BatchList()
+            batch_list.ParseFromString(infile.read())
+        analyzer.add_batch_list(batch_list)
+
+    address_index = AddressIndex()
+    if opts.address_index:
+        address_index = AddressIndex.load(opts.address_index)
+
+    report = analyzer.report(top=opts.top)
+    print('Transactions:   {}'.format(report['transactions']))
+    print('Dependencies:   {}'.format(report['edges']))
+    print('Critical path:  {}'.format(report['critical_path']))
+    print('Max width:      {}'.format(report['max_width']))
+    print('Parallelism:    {:.2f}'.format(report['parallelism']))
+    print('Hot addresses:')
+    for address, count in report['hot_addresses']:
+        entity = address_index.lookup(address)
+        if entity is None:
+            print('  {}  {}'.format(address, count))
+        else:
+            print('  {}  {}  ({} {})'.format(
+                address, count, entity[0].name.lower(), entity[1]))
+
+    if opts.dot:
+        with open(opts.dot, 'w') as out:
+            analyzer.write_dot(out)
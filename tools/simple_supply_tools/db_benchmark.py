@@ -0,0 +1,505 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import collections
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from simple_supply_rest_api import database as rest_database
+from simple_supply_subscriber import database as subscriber_database
+from simple_supply_subscriber.migrations import INDEXES
+from simple_supply_subscriber.migrations import MAX_BLOCK_NUMBER
+
+from simple_supply_tools.benchmark import default_label
+
+
+# How each statement is run: formatted has its parameters written into the
+# query, so the server parses and plans it every time, as the databases
+# used to. prepared runs the statement prepared once for the connection
+MODES = ('formatted', 'prepared')
+
+RECORD_ID = 'db-benchmark-record-{}'
+AGENT_ID = 'db-benchmark-agent-{}'
+
+
+class Workload(object):
+    """Runs the statements of the subscriber and REST API databases on a
+    connection, either formatted or prepared, timing each statement and
+    sampling the server's planning time for each of them.
+
+    Args:
+        conn: A psycopg2 connection
+        mode (str): One of MODES
+    """
+    def __init__(self, conn, mode):
+        self._conn = conn
+        self._mode = mode
+        self._statements = dict(subscriber_database.STATEMENTS)
+        self._statements.update(rest_database.STATEMENTS)
+        self._prepared = set()
+        self.latencies = collections.defaultdict(list)
+        self.planning = collections.defaultdict(list)
+
+    def execute(self, name, *params):
+        """Runs a statement and returns its rows, or the number of rows it
+        changed if it returns none
+        """
+        types, statement = self._statements[name]
+        with self._conn.cursor() as cursor:
+            if self._mode == 'prepared' and name not in self._prepared:
+                cursor.execute('PREPARE {}{} AS {}'.format(
+                    name,
+                    '({})'.format(', '.join(types)) if types else '',
+                    statement))
+                self._prepared.add(name)
+
+            query = self._query(cursor, name, statement, params)
+            start = time.perf_counter()
+            cursor.execute(query)
+            self.latencies[name].append(time.perf_counter() - start)
+            return cursor.fetchall() if cursor.description else cursor.rowcount
+
+    def explain(self, name, *params):
+        """Runs a statement under EXPLAIN ANALYZE, recording the time the
+        server spent planning it. A prepared statement is planned again
+        only until the server settles on a generic plan for it.
+        """
+        _, statement = self._statements[name]
+        with self._conn.cursor() as cursor:
+            query = self._query(cursor, name, statement, params)
+            cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + query)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        self.planning[name].append(plan[0].get('Planning Time', 0.0))
+
+    def deallocate(self):
+        with self._conn.cursor() as cursor:
+            cursor.execute('DEALLOCATE ALL')
+        self._prepared.clear()
+
+    def _query(self, cursor, name, statement, params):
+        if self._mode == 'prepared':
+            if not params:
+                return 'EXECUTE {}'.format(name)
+            return cursor.mogrify('EXECUTE {}({})'.format(
+                name, ', '.join(['%s'] * len(params))), params).decode()
+        return re.sub(
+            r'\$(\d+)',
+            lambda match: cursor.mogrify(
+                '%s', (params[int(match.group(1)) - 1],)).decode(),
+            statement)
+
+
+def seed(cursor, block_num, opts, blocks=0):
+    """Adds a block of agents and records, each record with a history of
+    locations, then blocks of updates to the records, as the subscriber
+    would have written them: each update replaces its record's version and
+    appends a location, and every tenth also transfers the record. The
+    tables are analyzed once they are filled.
+    """
+    updates = [
+        (update_block_num,
+         (update_block_num * opts.updates + update) % opts.records,
+         update)
+        for update_block_num in range(block_num + 1, block_num + blocks + 1)
+        for update in range(opts.updates)
+    ]
+    starts = collections.defaultdict(lambda: [block_num])
+    for update_block_num, index, _ in updates:
+        starts[index].append(update_block_num)
+
+    execute_values(
+        cursor,
+        'INSERT INTO blocks (block_num, block_id) VALUES %s',
+        ((number, 'db-benchmark-block-{}'.format(number))
+         for number in range(block_num, block_num + blocks + 1)),
+        page_size=subscriber_database.BULK_PAGE_SIZE)
+    _insert('agents', cursor, (
+        (AGENT_ID.format(index), 'Agent {}'.format(index), block_num,
+         block_num, MAX_BLOCK_NUMBER)
+        for index in range(opts.agents)))
+    _insert('records', cursor, (
+        (RECORD_ID.format(index), '', start, end)
+        for index in range(opts.records)
+        for start, end in zip(
+            starts[index], starts[index][1:] + [MAX_BLOCK_NUMBER])))
+    _insert('record_owners', cursor, (
+        (RECORD_ID.format(index), AGENT_ID.format(index % opts.agents),
+         start, None, start, MAX_BLOCK_NUMBER)
+        for index, start in (
+            [(index, block_num) for index in range(opts.records)] +
+            [(index, update_block_num)
+             for position, (update_block_num, index, _) in enumerate(updates)
+             if position % 10 == 0])))
+    _insert('record_locations', cursor, (
+        (RECORD_ID.format(index), latitude, longitude, timestamp, None,
+         start, MAX_BLOCK_NUMBER)
+        for index, latitude, longitude, timestamp, start in (
+            [(index, index, timestamp, timestamp, block_num)
+             for index in range(opts.records)
+             for timestamp in range(opts.history)] +
+            [(index, update_block_num, update, update_block_num,
+              update_block_num)
+             for update_block_num, index, update in updates])))
+    for table in subscriber_database.STAGED_COLUMNS:
+        cursor.execute('ANALYZE {}'.format(table))
+
+
+def _insert(table, cursor, rows):
+    execute_values(
+        cursor,
+        'INSERT INTO {} ({}) VALUES %s'.format(
+            table, ', '.join(subscriber_database.STAGED_COLUMNS[table])),
+        rows,
+        page_size=subscriber_database.BULK_PAGE_SIZE)
+
+
+def ingest_blocks(workload, first_block_num, blocks, updates, records):
+    """Writes blocks of record updates the way the subscriber does with
+    per-row writes: each update reads the current ends of the record's
+    history, replaces the record's version and appends a location
+    """
+    for block_num in range(first_block_num, first_block_num + blocks):
+        workload.execute(
+            'insert_block', block_num,
+            'db-benchmark-block-{}'.format(block_num))
+        for update in range(updates):
+            record_id = RECORD_ID.format(
+                (block_num * updates + update) % records)
+            count, first_id, last_id = workload.execute(
+                'count_record_locations', MAX_BLOCK_NUMBER, record_id,
+                None)[0]
+            if count:
+                workload.execute(
+                    'fetch_ends_record_locations', first_id, last_id)
+            workload.execute(
+                'close_records', block_num, MAX_BLOCK_NUMBER, record_id)
+            workload.execute(
+                'insert_records', record_id, '', block_num, MAX_BLOCK_NUMBER)
+            workload.execute(
+                'insert_record_locations', record_id, block_num, update,
+                block_num, None, block_num, MAX_BLOCK_NUMBER)
+
+
+def serve_requests(workload, requests, agents, records):
+    """Reads records and agents the way the REST API does to serve a
+    record, and to check the owner and location of one before updating it
+    """
+    for request in range(requests):
+        record_id = RECORD_ID.format(request * 7919 % records)
+        workload.execute('fetch_record', record_id)
+        workload.execute('fetch_record_locations', record_id)
+        workload.execute('fetch_record_owners', record_id)
+        workload.execute('fetch_record_custody', record_id)
+        workload.execute('fetch_record_ancestors', record_id)
+        workload.execute('fetch_record_owner', record_id)
+        workload.execute('fetch_agent', AGENT_ID.format(request % agents))
+
+
+def sample_planning(workload, samples, block_num):
+    """Explains the most frequent statements of each workload, so their
+    planning time is measured once any generic plan has been settled on
+    """
+    record_id = RECORD_ID.format(0)
+    for _ in range(samples):
+        workload.explain(
+            'count_record_locations', MAX_BLOCK_NUMBER, record_id, None)
+        workload.explain(
+            'close_records', block_num, MAX_BLOCK_NUMBER, record_id)
+        workload.explain(
+            'insert_record_locations', record_id, 0, 0, block_num, None,
+            block_num, MAX_BLOCK_NUMBER)
+        workload.explain('fetch_record_locations', record_id)
+        workload.explain('fetch_record_ancestors', record_id)
+        workload.explain('fetch_record_owner', record_id)
+
+
+def run_mode(conn, mode, opts, drop_indexes=False):
+    """Seeds the database and runs both workloads in one mode, optionally
+    without the indexes the migrations create. Everything is rolled back
+    afterwards, so the database is left as it was.
+
+    Returns:
+        dict: Statements per second and the median latency of each
+            workload, and the median planning time of each sampled statement
+    """
+    workload = Workload(conn, mode)
+    block_num = _next_block_num(conn)
+
+    try:
+        with conn.cursor() as cursor:
+            if drop_indexes:
+                _drop_indexes(cursor)
+            seed(cursor, block_num, opts)
+
+        workloads = (
+            ('ingest', ingest_blocks, (
+                block_num + 1, opts.blocks, opts.updates, opts.records)),
+            ('requests', serve_requests, (
+                opts.requests, opts.agents, opts.records)))
+        result = collections.OrderedDict()
+        for workload_name, run, run_args in workloads:
+            workload.latencies.clear()
+            run(workload, *run_args)
+            latencies = [
+                latency
+                for statement in workload.latencies.values()
+                for latency in statement
+            ]
+            seconds = sum(latencies)
+            latencies.sort()
+            result[workload_name] = {
+                'statements': len(latencies),
+                'seconds': seconds,
+                'statements_per_sec':
+                    len(latencies) / seconds if seconds else 0.0,
+                'p50_us': latencies[len(latencies) // 2] * 1e6,
+                'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+                'statement_p50_us': collections.OrderedDict(
+                    (name, statistics.median(samples) * 1e6)
+                    for name, samples in sorted(
+                        workload.latencies.items())),
+            }
+
+        sample_planning(workload, opts.samples, block_num)
+        result['planning_ms'] = collections.OrderedDict(
+            (name, statistics.median(samples))
+            for name, samples in sorted(workload.planning.items()))
+        return result
+    finally:
+        conn.rollback()
+        if mode == 'prepared':
+            workload.deallocate()
+
+
+def run_forks(conn, opts, drop_indexes=False):
+    """Seeds the database with as many blocks of updates as the deepest
+    fork, then drops each depth of fork from them with the statements of
+    Database.drop_fork, undoing each drop before the next. Everything is
+    rolled back afterwards.
+
+    Returns:
+        dict: By depth, the rows deleted and restored, and the
+            milliseconds taken
+    """
+    workload = Workload(conn, 'prepared')
+    block_num = _next_block_num(conn)
+    last_block_num = block_num + max(opts.fork_depths)
+
+    try:
+        with conn.cursor() as cursor:
+            if drop_indexes:
+                _drop_indexes(cursor)
+            seed(cursor, block_num, opts, max(opts.fork_depths))
+
+            result = collections.OrderedDict()
+            for depth in opts.fork_depths:
+                cursor.execute('SAVEPOINT fork')
+                workload.latencies.clear()
+                rows = sum(
+                    workload.execute(name, last_block_num - depth + 1)
+                    for name in subscriber_database.FORK_STATEMENTS)
+                cursor.execute('ROLLBACK TO SAVEPOINT fork')
+                result[depth] = {
+                    'rows': rows,
+                    'ms': sum(
+                        latency
+                        for statement in workload.latencies.values()
+                        for latency in statement) * 1000,
+                }
+        return result
+    finally:
+        conn.rollback()
+        workload.deallocate()
+
+
+def _next_block_num(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT coalesce(max(block_num), 0) FROM blocks')
+        return cursor.fetchone()[0] + 1
+
+
+def _drop_indexes(cursor):
+    for name, _, _ in INDEXES:
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Compares running the subscriber and REST API database '
+        'statements formatted with their values against running them '
+        'prepared, on a live database, and optionally against running '
+        'them without the indexes the migrations create, then times '
+        'dropping forks of several depths. The database is left as it was')
+
+    parser.add_argument(
+        '--db-name',
+        help='The name of the database',
+        default='simple-supply')
+    parser.add_argument(
+        '--db-host',
+        help='The host of the database',
+        default='localhost')
+    parser.add_argument(
+        '--db-port',
+        help='The port of the database',
+        default='5432')
+    parser.add_argument(
+        '--db-user',
+        help='The authorized user of the database',
+        default='sawtooth')
+    parser.add_argument(
+        '--db-password',
+        help="The authorized user's password for database access",
+        default='sawtooth')
+    parser.add_argument(
+        '--agents',
+        type=int,
+        default=100,
+        help='Agents added before the workloads run')
+    parser.add_argument(
+        '--records',
+        type=int,
+        default=10000,
+        help='Records added before the workloads run. Raise it to compare '
+        'indexes on a larger dataset')
+    parser.add_argument(
+        '--history',
+        type=int,
+        default=10,
+        help='Locations in the history of each record added')
+    parser.add_argument(
+        '--blocks',
+        type=int,
+        default=200,
+        help='Blocks ingested')
+    parser.add_argument(
+        '--updates',
+        type=int,
+        default=20,
+        help='Record updates in each block ingested')
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=2000,
+        help='Record requests served')
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=20,
+        help='Times each statement is explained to measure its planning')
+    parser.add_argument(
+        '--fork-depths',
+        type=int,
+        nargs='+',
+        default=[1, 100, 10000],
+        help='Numbers of blocks dropped by the simulated forks. As many '
+        'blocks of updates as the deepest are added first')
+    parser.add_argument(
+        '--compare-indexes',
+        action='store_true',
+        help='Also run the prepared statements with the indexes dropped. '
+        'This locks the tables until the run ends, so use a database that '
+        'is not being served')
+    parser.add_argument(
+        '--label',
+        help='Name of this run. Defaults to the family version and the '
+        'git revision')
+    parser.add_argument(
+        '--results-dir',
+        default='benchmark_results',
+        help='Directory the results are saved to as db-<label>.json')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    dsn = 'dbname={} user={} password={} host={} port={}'.format(
+        opts.db_name,
+        opts.db_user,
+        opts.db_password,
+        opts.db_host,
+        opts.db_port)
+
+    database = subscriber_database.Database(dsn)
+    database.connect()
+    database.migrate()
+    database.disconnect()
+
+    runs = [(mode, mode, False) for mode in MODES]
+    if opts.compare_indexes:
+        runs.append(('unindexed', 'prepared', True))
+
+    conn = psycopg2.connect(dsn)
+    try:
+        results = collections.OrderedDict(
+            (name, run_mode(conn, mode, opts, drop_indexes))
+            for name, mode, drop_indexes in runs)
+        forks = collections.OrderedDict(
+            (name, run_forks(conn, opts, drop_indexes))
+            for name, mode, drop_indexes in runs if mode == 'prepared')
+    finally:
+        conn.close()
+
+    for workload_name in ('ingest', 'requests'):
+        for name in results:
+            result = results[name][workload_name]
+            print('{:<9} {:<10} {:>8} statements  {:>9.1f} statements/s  '
+                  'p50 {:>8.1f} us  p99 {:>8.1f} us'.format(
+                      workload_name, name, result['statements'],
+                      result['statements_per_sec'], result['p50_us'],
+                      result['p99_us']))
+    print('Median planning time (ms):')
+    for statement in results[MODES[0]]['planning_ms']:
+        print('  {:<28} {}'.format(statement, '  '.join(
+            '{} {:>7.3f}'.format(name, results[name]['planning_ms'][statement])
+            for name in results)))
+
+    for name, result in forks.items():
+        for depth, fork in result.items():
+            print('fork      {:<10} {:>8} blocks  {:>9} rows  '
+                  '{:>10.1f} ms'.format(
+                      name, depth, fork['rows'], fork['ms']))
+
+    label = opts.label or default_label()
+    os.makedirs(opts.results_dir, exist_ok=True)
+    filename = os.path.join(opts.results_dir, 'db-{}.json'.format(label))
+    with open(filename, 'w') as outfile:
+        json.dump({
+            'label': label,
+            'created': int(time.time()),
+            'options': {
+                key: getattr(opts, key)
+                for key in ('agents', 'records', 'history', 'blocks',
+                            'updates', 'requests', 'samples',
+                            'fork_depths', 'compare_indexes')
+            },
+            'results': results,
+            'forks': forks
+        }, outfile, indent=2)
+    print('Results saved to {}'.format(filename))
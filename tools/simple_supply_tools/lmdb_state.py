@@ -0,0 +1,108 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import collections.abc
+
+import lmdb
+
+
+DEFAULT_MAP_SIZE = 1 << 40
+
+
+class LmdbState(collections.abc.MutableMapping):
+    """Sawtooth state kept in an LMDB database, mapping addresses to
+    serialized data. It can be given to a MemoryContext as its state.
+
+    Changes are held in memory until commit() writes them all in one LMDB
+    transaction, or rollback() drops them. A batch can so be applied all or
+    nothing, and several processes can apply batches to the same database
+    at once, each only taking LMDB's write lock while it commits. Each
+    process must open the database itself, after it has started.
+
+    Args:
+        path (str): Directory of the database, created if needed
+        map_size (int): The largest the database may grow to, in bytes
+    """
+    def __init__(self, path, map_size=DEFAULT_MAP_SIZE):
+        self._env = lmdb.open(path, map_size=map_size)
+        self._changes = {}
+
+    def __getitem__(self, address):
+        if address in self._changes:
+            data = self._changes[address]
+        else:
+            with self._env.begin() as txn:
+                data = txn.get(address.encode())
+        if data is None:
+            raise KeyError(address)
+        return data
+
+    def __setitem__(self, address, data):
+        self._changes[address] = data
+
+    def __delitem__(self, address):
+        if address not in self:
+            raise KeyError(address)
+        # None marks the address to be deleted on commit
+        self._changes[address] = None
+
+    def __iter__(self):
+        with self._env.begin() as txn:
+            for key in txn.cursor().iternext(values=False):
+                address = key.decode()
+                if self._changes.get(address, b'') is not None:
+                    yield address
+        with self._env.begin() as txn:
+            for address, data in list(self._changes.items()):
+                if data is not None and txn.get(address.encode()) is None:
+                    yield address
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def commit(self):
+        """Writes the changes made since the last commit or rollback
+        """
+        if not self._changes:
+            return
+        with self._env.begin(write=True) as txn:
+            for address, data in self._changes.items():
+                if data is None:
+                    txn.delete(address.encode())
+                else:
+                    txn.put(address.encode(), data)
+        self._changes.clear()
+
+    def rollback(self):
+        """Drops the changes made since the last commit or rollback
+        """
+        self._changes.clear()
+
+    def stat(self):
+        """Returns the number of addresses in the committed state, the bytes
+        of data stored at them, and the bytes of the database file in use
+        """
+        with self._env.begin() as txn:
+            data_bytes = sum(
+                len(value) for value in txn.cursor().iternext(keys=False))
+        info = self._env.info()
+        return {
+            'entries': self._env.stat()['entries'],
+            'data_bytes': data_bytes,
+            'file_bytes': (info['last_pgno'] + 1) * self._env.stat()['psize']
+        }
+
+    def close(self):
+        self._env.close()
@@ -0,0 +1,126 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import time
+
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.protobuf.events_pb2 import Event
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.state_context_pb2 import TpStateEntry
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+
+class MemoryContext(object):
+    """A dict-backed stand-in for the SDK's Context, so transaction handlers
+    can be driven without a validator
+
+    Args:
+        state (dict): Initial state, mapping addresses to serialized data
+        get_latency (float): Seconds to sleep on every get_state call, to
+            simulate the round-trip to the validator
+        set_latency (float): Seconds to sleep on every set_state and
+            delete_state call
+    """
+    def __init__(self, state=None, get_latency=0, set_latency=0):
+        self.state = {} if state is None else state
+        self.events = []
+        self.receipt_data = []
+        self.get_count = 0
+        self.set_count = 0
+        self._get_latency = get_latency
+        self._set_latency = set_latency
+        self._inputs = None
+        self._outputs = None
+
+    def authorize(self, inputs=None, outputs=None):
+        """Restricts reads to the inputs and writes to the outputs of the
+        transaction being applied, as the validator does. Passing None lifts
+        the restriction.
+        """
+        self._inputs = inputs
+        self._outputs = outputs
+
+    def get_state(self, addresses, timeout=None):
+        self.get_count += 1
+        _check_authorized(addresses, self._inputs, 'get')
+        if self._get_latency:
+            time.sleep(self._get_latency)
+        return [
+            TpStateEntry(address=address, data=self.state[address])
+            for address in addresses
+            if self.state.get(address)
+        ]
+
+    def set_state(self, entries, timeout=None):
+        self.set_count += 1
+        _check_authorized(entries, self._outputs, 'set')
+        if self._set_latency:
+            time.sleep(self._set_latency)
+        self.state.update(entries)
+        return list(entries)
+
+    def delete_state(self, addresses, timeout=None):
+        self.set_count += 1
+        _check_authorized(addresses, self._outputs, 'delete')
+        if self._set_latency:
+            time.sleep(self._set_latency)
+        return [
+            address for address in addresses
+            if self.state.pop(address, None) is not None
+        ]
+
+    def add_receipt_data(self, data, timeout=None):
+        self.receipt_data.append(data)
+
+    def add_event(self, event_type, attributes=None, data=None, timeout=None):
+        self.events.append(Event(
+            event_type=event_type,
+            attributes=[
+                Event.Attribute(key=key, value=value)
+                for key, value in attributes or []
+            ],
+            data=data))
+
+
+def make_process_request(signer_public_key,
+                         payload_bytes,
+                         inputs=None,
+                         outputs=None):
+    """Builds the request the SDK passes to TransactionHandler.apply
+
+    Args:
+        signer_public_key (str): Public key of the transaction signer
+        payload_bytes (bytes): The serialized payload
+        inputs (list of str): Declared input addresses
+        outputs (list of str): Declared output addresses
+
+    Returns:
+        processor_pb2.TpProcessRequest: The transaction to apply
+    """
+    header = TransactionHeader(
+        signer_public_key=signer_public_key,
+        inputs=inputs or [],
+        outputs=outputs or [])
+    return TpProcessRequest(header=header, payload=payload_bytes)
+
+
+def _check_authorized(addresses, allowed, operation):
+    if allowed is None:
+        return
+    for address in addresses:
+        if not any(address.startswith(prefix) for prefix in allowed):
+            raise AuthorizationException(
+                'Tried to {} unauthorized address: {}'.format(
+                    operation, address))
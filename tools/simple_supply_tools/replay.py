@@ -0,0 +1,259 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+
+from sawtooth_sdk.processor.exceptions import AuthorizationException
+from sawtooth_sdk.processor.exceptions import InvalidTransaction
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_sdk.protobuf.processor_pb2 import TpProcessRequest
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+from simple_supply_addressing import addresser
+
+from simple_supply_tp.handler import SimpleSupplyHandler
+
+from simple_supply_tools.conflicts import ConflictAnalyzer
+from simple_supply_tools.lmdb_state import LmdbState
+from simple_supply_tools.memory_context import MemoryContext
+
+
+def read_batches(filenames):
+    """Reads the batches of files of serialized BatchLists, in order
+
+    Returns:
+        list of batch_pb2.Batch: The batches, in the order of the files
+    """
+    batches = []
+    for filename in filenames:
+        with open(filename, 'rb') as infile:
+            batch_list = BatchList()
+            batch_list.ParseFromString(infile.read())
+        batches.extend(batch_list.batches)
+    return batches
+
+
+def partition_batches(batches):
+    """Groups batches that depend on each other through the inputs and
+    outputs their transactions declare. Batches are applied all or nothing,
+    so the declarations of all of a batch's transactions are taken
+    together.
+
+    Almost every batch reads something an earlier one wrote, such as its
+    signer's agent, so a long trace is best partitioned a window at a time,
+    once the windows before it have been applied.
+
+    Returns:
+        list of list of batch_pb2.Batch: Groups with no dependencies
+        between them, each in the order the batches were given in
+    """
+    analyzer = ConflictAnalyzer()
+    for batch in batches:
+        inputs = []
+        outputs = []
+        for transaction in batch.transactions:
+            header = TransactionHeader()
+            header.ParseFromString(transaction.header)
+            inputs.extend(header.inputs)
+            outputs.extend(header.outputs)
+        analyzer.add_transaction(batch.header_signature, inputs, outputs)
+    return [
+        [batches[index] for index in partition]
+        for partition in analyzer.partitions()
+    ]
+
+
+def assign_partitions(partitions, workers):
+    """Spreads partitions across workers, largest first to the worker with
+    the fewest transactions so far
+
+    Returns:
+        list of list of bytes: The serialized batches each worker applies,
+        in order
+    """
+    loads = [0] * workers
+    assignments = [[] for _ in range(workers)]
+    for partition in sorted(partitions, key=_count_transactions,
+                            reverse=True):
+        worker = loads.index(min(loads))
+        loads[worker] += _count_transactions(partition)
+        assignments[worker].extend(
+            batch.SerializeToString() for batch in partition)
+    return [assignment for assignment in assignments if assignment]
+
+
+def apply_batches(path, batches):
+    """Applies batches to the state in an LMDB database, as a validator
+    would. A batch's changes are only committed if all of its transactions
+    are valid. Transactions of other families are not applied, so any
+    state they would have changed, such as settings, must already be in
+    the database.
+
+    Args:
+        path (str): Directory of the LMDB database
+        batches (list of bytes): Serialized batches, in order
+
+    Returns:
+        collections.Counter: Counts of the batches committed and rejected,
+            and of the transactions applied, invalid, and skipped, with the
+            seconds spent applying them
+    """
+    handler = SimpleSupplyHandler()
+    state = LmdbState(path)
+    counts = collections.Counter()
+    start = time.perf_counter()
+    for serialized in batches:
+        batch = Batch()
+        batch.ParseFromString(serialized)
+        if _apply_batch(handler, state, batch, counts):
+            state.commit()
+            counts['committed'] += 1
+        else:
+            state.rollback()
+            counts['rejected'] += 1
+    counts['seconds'] = time.perf_counter() - start
+    state.close()
+    return counts
+
+
+def _apply_batch(handler, state, batch, counts):
+    for transaction in batch.transactions:
+        header = TransactionHeader()
+        header.ParseFromString(transaction.header)
+        if header.family_name != addresser.FAMILY_NAME or \
+                header.family_version not in addresser.FAMILY_VERSIONS:
+            counts['skipped'] += 1
+            continue
+
+        context = MemoryContext(state=state)
+        context.authorize(list(header.inputs), list(header.outputs))
+        request = TpProcessRequest(
+            header=header,
+            payload=transaction.payload,
+            signature=transaction.header_signature)
+        try:
+            handler.apply(request, context)
+        except (InvalidTransaction, AuthorizationException):
+            counts['invalid'] += 1
+            return False
+        counts['applied'] += 1
+    return True
+
+
+def _apply_assignment(args):
+    return apply_batches(*args)
+
+
+def _count_transactions(batches):
+    return sum(len(batch.transactions) for batch in batches)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Replays recorded batches through SimpleSupplyHandler '
+        'against state in a local LMDB database, and reports throughput '
+        'and state growth')
+
+    parser.add_argument(
+        'files',
+        nargs='+',
+        help='Files containing serialized BatchLists, in the order their '
+        'batches were committed')
+    parser.add_argument(
+        '--state',
+        required=True,
+        help='Directory of the LMDB database to replay against. It is '
+        'created if needed, and may be seeded with settings beforehand')
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='Number of processes applying independent batches at once')
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=10000,
+        help='Number of batches partitioned at a time. Each window is only '
+        'started once the one before it has been applied')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    batches = read_batches(opts.files)
+    workers = max(opts.workers, 1)
+    window = max(opts.window, 1)
+
+    state = LmdbState(opts.state)
+    before = state.stat()
+    state.close()
+
+    results = [collections.Counter() for _ in range(workers)]
+    partition_count = 0
+    largest = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for offset in range(0, len(batches), window):
+            partitions = partition_batches(batches[offset:offset + window])
+            partition_count += len(partitions)
+            largest = max(largest, max(
+                _count_transactions(partition) for partition in partitions))
+            jobs = [
+                (opts.state, assignment)
+                for assignment in assign_partitions(partitions, workers)
+            ]
+            for index, result in enumerate(
+                    pool.map(_apply_assignment, jobs)):
+                results[index].update(result)
+    seconds = time.perf_counter() - start
+
+    state = LmdbState(opts.state)
+    after = state.stat()
+    state.close()
+
+    totals = sum(results, collections.Counter())
+    print('Batches:        {} committed, {} rejected'.format(
+        totals['committed'], totals['rejected']))
+    print('Transactions:   {} applied, {} invalid, {} other families'.format(
+        totals['applied'], totals['invalid'], totals['skipped']))
+    print('Partitions:     {} in {} windows, the largest with {} '
+          'transactions'.format(
+              partition_count, -(-len(batches) // window), largest))
+    print('Workers:        {}'.format(workers))
+    for index, result in enumerate(results):
+        print('  worker {}  {:>8} transactions  {:>8.2f} s'.format(
+            index, result['applied'] + result['invalid'],
+            result['seconds']))
+    print('Seconds:        {:.2f}'.format(seconds))
+    print('Throughput:     {:.1f} transactions/s'.format(
+        (totals['applied'] + totals['invalid']) / seconds
+        if seconds else 0.0))
+    print('State entries:  {} -> {} ({:+})'.format(
+        before['entries'], after['entries'],
+        after['entries'] - before['entries']))
+    print('State data:     {} -> {} bytes ({:+})'.format(
+        before['data_bytes'], after['data_bytes'],
+        after['data_bytes'] - before['data_bytes']))
+    print('Database file:  {} -> {} bytes'.format(
+        before['file_bytes'], after['file_bytes']))
@@ -0,0 +1,215 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from simple_supply_tools.benchmark import default_label
+
+
+# For each entry point, the module its bin script imports before parsing
+# arguments, and the modules it goes on to import before it can serve
+# requests. Keep these in step with the imports in each main() function
+ENTRY_POINTS = collections.OrderedDict([
+    ('simple-supply-tp', (
+        'simple_supply_tp.main', [
+            'sawtooth_sdk.processor.log',
+            'sawtooth_sdk.processor.core',
+            'simple_supply_tp.handler',
+            'simple_supply_tp.metrics',
+        ])),
+    ('simple-supply-rest-api', (
+        'simple_supply_rest_api.main', [
+            'zmq.asyncio',
+            'sawtooth_sdk.processor.log',
+            'simple_supply_rest_api.database',
+            'simple_supply_rest_api.messaging',
+            'aiohttp.web',
+            'simple_supply_rest_api.route_handler',
+        ])),
+    ('simple-supply-subscriber', (
+        'simple_supply_subscriber.main', [
+            'simple_supply_subscriber.database',
+            'simple_supply_subscriber.event_handling',
+            'simple_supply_subscriber.subscriber',
+        ])),
+])
+
+# Run in a fresh interpreter for every measurement, so nothing is imported
+# already. Prints the seconds taken to import the main module, and to
+# import it and every module needed to serve
+MEASURE = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+for name in sys.argv[2:]:
+    importlib.import_module(name)
+print(json.dumps([imported - start, time.perf_counter() - start]))
+'''
+
+
+def measure_entry_point(name, runs=5):
+    """Starts a fresh interpreter runs times to measure how long an entry
+    point takes to start
+
+    Args:
+        name (str): The entry point, one of ENTRY_POINTS
+        runs (int): The number of interpreters started. The median of
+            each measurement is reported
+
+    Returns:
+        dict: Milliseconds spent importing the main module (import_ms),
+            until every module needed to serve is imported (ready_ms), and
+            from starting the interpreter until then (process_ms). If the
+            entry point cannot be imported, only the error
+    """
+    module, serving_modules = ENTRY_POINTS[name]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-c', MEASURE, module] + serving_modules,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            lines = process.stderr.decode().strip().splitlines()
+            return {'error': lines[-1] if lines else 'failed'}
+        imported, ready = json.loads(process.stdout.decode())
+        samples.append((imported, ready, elapsed))
+
+    return {
+        'import_ms': statistics.median(s[0] for s in samples) * 1000,
+        'ready_ms': statistics.median(s[1] for s in samples) * 1000,
+        'process_ms': statistics.median(s[2] for s in samples) * 1000,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Returns a description of each measurement more than tolerance slower
+    than in the baseline
+
+    Args:
+        results (dict): Measurements by entry point, from this run
+        baseline (dict): Measurements by entry point, from a previous run
+        tolerance (float): The fraction a measurement may grow by
+    """
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            try:
+                previous = baseline[name][key]
+            except KeyError:
+                continue
+            if key != 'error' and value > previous * (1 + tolerance):
+                regressions.append('{} {}: {:.1f} ms, was {:.1f} ms'.format(
+                    name, key, value, previous))
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Measures how long each Simple Supply entry point takes '
+        'to import its modules and be ready to serve')
+
+    parser.add_argument(
+        'entry_points',
+        nargs='*',
+        help='Entry points to measure. Measures all of them by default: '
+        '{}'.format(', '.join(ENTRY_POINTS)))
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=5,
+        help='Interpreters started per entry point; medians are reported')
+    parser.add_argument(
+        '--label',
+        help='Name of this run. Defaults to the family version and the '
+        'git revision')
+    parser.add_argument(
+        '--results-dir',
+        default='benchmark_results',
+        help='Directory the results are saved to as startup-<label>.json')
+    parser.add_argument(
+        '--compare',
+        help='A previous results file to compare this run against')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=20,
+        help='With --compare, exit with an error if any measurement is '
+        'more than this many percent slower')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    opts = parse_args(args)
+
+    names = opts.entry_points or list(ENTRY_POINTS)
+    for name in names:
+        if name not in ENTRY_POINTS:
+            print('Unknown entry point: {}'.format(name))
+            sys.exit(1)
+
+    label = opts.label or default_label()
+    results = collections.OrderedDict(
+        (name, measure_entry_point(name, runs=opts.runs)) for name in names)
+
+    baseline = {}
+    if opts.compare:
+        with open(opts.compare) as infile:
+            baseline = json.load(infile)['results']
+
+    for name, result in results.items():
+        if 'error' in result:
+            print('{:<26} unavailable: {}'.format(name, result['error']))
+            continue
+        print('{:<26} import {:>7.1f} ms  ready {:>7.1f} ms  '
+              'process {:>7.1f} ms'.format(
+                  name, result['import_ms'], result['ready_ms'],
+                  result['process_ms']))
+
+    os.makedirs(opts.results_dir, exist_ok=True)
+    filename = os.path.join(
+        opts.results_dir, 'startup-{}.json'.format(label))
+    with open(filename, 'w') as outfile:
+        json.dump({
+            'label': label,
+            'created': int(time.time()),
+            'runs': opts.runs,
+            'results': results
+        }, outfile, indent=2)
+    print('Results saved to {}'.format(filename))
+
+    regressions = find_regressions(
+        results, baseline, opts.tolerance / 100)
+    for regression in regressions:
+        print('Regression: {}'.format(regression))
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,90 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import collections
+
+
+# The width and height of each grid cell, in millionths of a degree
+GRID_CELL_SIZE = 1000000
+
+
+class GeofenceIndex(object):
+    """A grid index of geofence polygons. Each polygon is listed in every
+    cell its bounding box overlaps, so finding the geofences around a
+    location only tests the few polygons listed in its cell, however many
+    geofences there are.
+
+    Polygons are treated as planar in latitude and longitude, and may not
+    cross the antimeridian.
+
+    Args:
+        geofences (iterable of tuple): The id of each geofence, and its
+            vertices as (latitude, longitude) pairs in millionths of a degree
+        max_speed (int): The fastest a record may move between consecutive
+            locations, in meters per second. Zero disables the check
+        cell_size (int): The width and height of each grid cell
+    """
+    def __init__(self, geofences=(), max_speed=0, cell_size=GRID_CELL_SIZE):
+        self.max_speed = max_speed
+        self._cell_size = cell_size
+        self._polygons = {}
+        self._cells = collections.defaultdict(list)
+
+        for geofence_id, vertices in geofences:
+            vertices = list(vertices)
+            self._polygons[geofence_id] = vertices
+            lats = [vertex[0] for vertex in vertices]
+            lngs = [vertex[1] for vertex in vertices]
+            for row in range(self._cell(min(lats)), self._cell(max(lats)) + 1):
+                for column in range(
+                        self._cell(min(lngs)), self._cell(max(lngs)) + 1):
+                    self._cells[(row, column)].append(geofence_id)
+
+    def __len__(self):
+        return len(self._polygons)
+
+    def find(self, latitude, longitude):
+        """Returns the ids of the geofences containing a location
+        """
+        candidates = self._cells.get(
+            (self._cell(latitude), self._cell(longitude)), [])
+        return [
+            geofence_id for geofence_id in candidates
+            if _contains(self._polygons[geofence_id], latitude, longitude)
+        ]
+
+    def contains(self, latitude, longitude):
+        """Returns whether any geofence contains a location
+        """
+        return bool(self.find(latitude, longitude))
+
+    def _cell(self, value):
+        return value // self._cell_size
+
+
+def _contains(vertices, latitude, longitude):
+    """Tests whether a point is inside a polygon by counting how many of its
+    edges a ray cast from the point crosses
+    """
+    inside = False
+    previous_lat, previous_lng = vertices[-1]
+    for lat, lng in vertices:
+        if (lat > latitude) != (previous_lat > latitude):
+            crossing = lng + (latitude - lat) * (previous_lng - lng) / (
+                previous_lat - lat)
+            if longitude < crossing:
+                inside = not inside
+        previous_lat, previous_lng = lat, lng
+    return inside
@@ -0,0 +1,388 @@
+# Copyright 2018 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+import datetime
+import math
+import time
+
+
+SYNC_TOLERANCE = 60 * 5
+MAX_LAT = 90 * 1e6
+MIN_LAT = -90 * 1e6
+MAX_LNG = 180 * 1e6
+MIN_LNG = -180 * 1e6
+MICRODEGREES = 1000000
+# The length of a degree of latitude, in meters
+METERS_PER_DEGREE = 111195
+MIN_GEOFENCE_VERTICES = 3
+MAX_NESTING_DEPTH = 8
+
+# The cosine of each whole degree from 0 to 90, times COSINE_SCALE.
+# Distances decide whether transactions are valid, so they are computed
+# from these and integer coordinates alone, never with floating point
+# functions whose results may differ between platforms
+COSINE_SCALE = 65536
+COSINES = [
+    65536, 65526, 65496, 65446, 65376, 65287, 65177, 65048, 64898, 64729,
+    64540, 64332, 64104, 63856, 63589, 63303, 62997, 62672, 62328, 61966,
+    61584, 61183, 60764, 60326, 59870, 59396, 58903, 58393, 57865, 57319,
+    56756, 56175, 55578, 54963, 54332, 53684, 53020, 52339, 51643, 50931,
+    50203, 49461, 48703, 47930, 47143, 46341, 45525, 44695, 43852, 42995,
+    42126, 41243, 40348, 39441, 38521, 37590, 36647, 35693, 34729, 33754,
+    32768, 31772, 30767, 29753, 28729, 27697, 26656, 25607, 24550, 23486,
+    22415, 21336, 20252, 19161, 18064, 16962, 15855, 14742, 13626, 12505,
+    11380, 10252, 9121, 7987, 6850, 5712, 4572, 3430, 2287, 1144, 0,
+]
+
+
+class ValidationError(Exception):
+    """Raised when an action breaks one of the rules the transaction
+    processor enforces
+    """
+
+
+class NotFoundError(ValidationError):
+    """Raised when an action refers to an agent or record that does not
+    exist
+    """
+
+
+def validate_create_agent(public_key, agent):
+    """Validates a CreateAgentAction
+
+    Args:
+        public_key (str): The public key of the signer
+        agent: The signer's existing agent, or None
+    """
+    if agent:
+        raise ValidationError('Agent with the public key {} already '
+                              'exists'.format(public_key))
+
+
+def validate_create_record(public_key,
+                           agent,
+                           record_id,
+                           owners,
+                           latitude,
+                           longitude):
+    """Validates a CreateRecordAction
+
+    Args:
+        public_key (str): The public key of the signer
+        agent: The signer's agent, or None
+        record_id (str): The id of the new record
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            an existing record with the same id, or None
+        latitude (int): Initial latitude of the record
+        longitude (int): Initial longitude of the record
+    """
+    validate_agent_exists(public_key, agent)
+
+    if record_id == '':
+        raise ValidationError('No record ID provided')
+
+    if owners:
+        raise ValidationError('Identifier {} belongs to an existing '
+                              'record'.format(record_id))
+
+    validate_latlng(latitude, longitude)
+
+
+def validate_transfer_record(public_key,
+                             receiving_agent,
+                             receiver,
+                             record_id,
+                             owners,
+                             parent_id=''):
+    """Validates a TransferRecordAction
+
+    Args:
+        public_key (str): The public key of the signer
+        receiving_agent (str): The public key of the receiving agent
+        receiver: The receiving agent, or None
+        record_id (str): The id of the record
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            the record, or None if it does not exist
+        parent_id (str): The id of the record it is attached to, if any
+    """
+    validate_agent_exists(receiving_agent, receiver)
+    validate_record_exists(record_id, owners)
+    validate_record_detached(record_id, parent_id)
+    validate_record_owner(public_key, owners)
+
+
+def validate_update_record(public_key,
+                           record_id,
+                           owners,
+                           latitude,
+                           longitude,
+                           parent_id=''):
+    """Validates an UpdateRecordAction
+
+    Args:
+        public_key (str): The public key of the signer
+        record_id (str): The id of the record
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            the record, or None if it does not exist
+        latitude (int): Updated latitude of the record
+        longitude (int): Updated longitude of the record
+        parent_id (str): The id of the record it is attached to, if any
+    """
+    validate_record_exists(record_id, owners)
+    validate_record_detached(record_id, parent_id)
+    validate_record_owner(public_key, owners)
+    validate_latlng(latitude, longitude)
+
+
+def validate_archive_history(public_key, record_id, owners, parent_id=''):
+    """Validates an ArchiveHistoryAction, except for whether the record has
+    any history from before the cutoff, which only state can tell
+
+    Args:
+        public_key (str): The public key of the signer
+        record_id (str): The id of the record
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            the record, or None if it does not exist
+        parent_id (str): The id of the record it is attached to, if any
+    """
+    validate_record_exists(record_id, owners)
+    validate_record_detached(record_id, parent_id)
+    validate_record_owner(public_key, owners)
+
+
+def validate_attach_record(public_key,
+                           record_id,
+                           owners,
+                           attached_to,
+                           parent_id,
+                           parent_owners,
+                           ancestors):
+    """Validates an AttachRecordAction
+
+    Args:
+        public_key (str): The public key of the signer
+        record_id (str): The id of the record to attach
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            the record, or None if it does not exist
+        attached_to (str): The id of the record it is already attached to,
+            if any
+        parent_id (str): The id of the record to attach it to
+        parent_owners (list of tuple): The owners of the record at the top
+            of the parent's hierarchy, or None if the parent does not exist
+        ancestors (list of str): The ids of the records the parent is
+            attached to, directly or through other records
+    """
+    validate_record_exists(record_id, owners)
+    validate_record_detached(record_id, attached_to)
+    validate_record_owner(public_key, owners)
+
+    if parent_id == '':
+        raise ValidationError('No parent ID provided')
+
+    validate_record_exists(parent_id, parent_owners)
+    validate_record_owner(public_key, parent_owners)
+
+    if record_id == parent_id or record_id in ancestors:
+        raise ValidationError(
+            'Record {} cannot be attached to itself or to a record attached '
+            'to it'.format(record_id))
+
+    if len(ancestors) >= MAX_NESTING_DEPTH:
+        raise ValidationError(
+            'Records may be nested at most {} deep'.format(MAX_NESTING_DEPTH))
+
+
+def validate_detach_record(public_key, record_id, owners, root_owners):
+    """Validates a DetachRecordAction
+
+    Args:
+        public_key (str): The public key of the signer
+        record_id (str): The id of the record to detach
+        owners (list of tuple): The (agent_id, timestamp) of each owner of
+            the record, or None if it does not exist
+        root_owners (list of tuple): The owners of the record at the top of
+            its hierarchy, or None if it is not attached
+    """
+    validate_record_exists(record_id, owners)
+
+    if root_owners is None:
+        raise ValidationError(
+            'Record {} is not attached to another record'.format(record_id))
+
+    validate_record_owner(public_key, root_owners)
+
+
+def validate_set_geofence(public_key, admins, geofence_id, vertices):
+    """Validates a SetGeofenceAction
+
+    Args:
+        public_key (str): The public key of the signer
+        admins (str): The comma separated public keys of the geofence
+            administrators, or None
+        geofence_id (str): The id of the geofence
+        vertices (list of tuple): The (latitude, longitude) of each vertex
+            of the geofence, or an empty list to remove it
+    """
+    validate_geofence_admin(public_key, admins)
+
+    if geofence_id == '':
+        raise ValidationError('No geofence ID provided')
+
+    if vertices and len(vertices) < MIN_GEOFENCE_VERTICES:
+        raise ValidationError(
+            'Geofences must have at least {} vertices. Got {}'.format(
+                MIN_GEOFENCE_VERTICES, len(vertices)))
+
+    for latitude, longitude in vertices:
+        validate_latlng(latitude, longitude)
+
+
+def validate_tenant(tenant, tenants):
+    """Validates that a tenant may be transacted for
+
+    Args:
+        tenant (str): The tenant of the action, or '' for the default tenant
+        tenants (str): The comma separated tenants listed in the tenants
+            setting, or None
+    """
+    if tenant and tenant not in (tenants or '').replace(' ', '').split(','):
+        raise ValidationError('Tenant {} is not registered'.format(tenant))
+
+
+def validate_geofence_admin(public_key, admins):
+    if public_key not in (admins or '').replace(' ', '').split(','):
+        raise ValidationError(
+            'Transaction signer is not a geofence administrator')
+
+
+def validate_geofences(geofences, latitude, longitude):
+    """Validates that a location is inside a geofence, if there are any
+
+    Args:
+        geofences (GeofenceIndex): The current geofences
+    """
+    if geofences and not geofences.contains(latitude, longitude):
+        raise ValidationError(
+            'Location ({}, {}) is outside every geofence'.format(
+                latitude/1e6, longitude/1e6))
+
+
+def validate_speed(previous, location, max_speed):
+    """Validates that moving between two consecutive locations does not
+    take a record faster than max_speed
+
+    Args:
+        previous (tuple): The latitude, longitude, and timestamp the record
+            moved from
+        location (tuple): The latitude, longitude, and timestamp it moved to
+        max_speed (int): In meters per second. Zero disables the check
+    """
+    if not max_speed:
+        return
+
+    squared_distance = get_squared_distance(previous[:2], location[:2])
+    elapsed = location[2] - previous[2]
+    # Compared as squares, in millionths of a meter, so that no square root
+    # is taken
+    max_distance = max_speed * max(elapsed, 0) * MICRODEGREES
+    if squared_distance * METERS_PER_DEGREE ** 2 > max_distance ** 2:
+        raise ValidationError(
+            'Moving {:.0f} meters in {} seconds exceeds the maximum speed of '
+            '{} meters per second'.format(
+                math.sqrt(squared_distance) * METERS_PER_DEGREE /
+                MICRODEGREES,
+                elapsed,
+                max_speed))
+
+
+def get_squared_distance(start, end):
+    """Returns the square of the distance between two (latitude, longitude)
+    pairs, in millionths of a degree of latitude, by the equirectangular
+    approximation: the difference in longitude is scaled by the cosine of
+    the mean latitude. It is computed in integers, so every validator gets
+    the same result.
+    """
+    lat_delta = end[0] - start[0]
+    lng_delta = abs(end[1] - start[1])
+    if lng_delta > 180 * MICRODEGREES:
+        lng_delta = 360 * MICRODEGREES - lng_delta
+    lng_delta = lng_delta * _cosine(abs(start[0] + end[0]) // 2) \
+        // COSINE_SCALE
+    return lat_delta ** 2 + lng_delta ** 2
+
+
+def _cosine(latitude):
+    """Returns the cosine of a latitude from 0 to 90 degrees, in millionths
+    of a degree, times COSINE_SCALE, interpolated between whole degrees
+    """
+    degree, fraction = divmod(latitude, MICRODEGREES)
+    if degree >= 90:
+        return 0
+    low, high = COSINES[degree], COSINES[degree + 1]
+    return low - (low - high) * fraction // MICRODEGREES
+
+
+def validate_agent_exists(public_key, agent):
+    if agent is None:
+        raise NotFoundError('Agent with the public key {} does '
+                            'not exist'.format(public_key))
+
+
+def validate_record_exists(record_id, owners):
+    if not owners:
+        raise NotFoundError('Record with the record id {} does not '
+                            'exist'.format(record_id))
+
+
+def validate_record_detached(record_id, parent_id):
+    if parent_id:
+        raise ValidationError(
+            'Record {} is attached to {}, and moves with it until it is '
+            'detached'.format(record_id, parent_id))
+
+
+def validate_record_owner(public_key, owners):
+    """Validates that the public key of the signer is the latest (i.e.
+    current) owner of the record
+    """
+    latest_owner = max(owners, key=lambda owner: owner[1])[0]
+    if latest_owner != public_key:
+        raise ValidationError(
+            'Transaction signer is not the owner of the record')
+
+
+def validate_latlng(latitude, longitude):
+    if not MIN_LAT <= latitude <= MAX_LAT:
+        raise ValidationError('Latitude must be between -90 and 90. '
+                              'Got {}'.format(latitude/1e6))
+    if not MIN_LNG <= longitude <= MAX_LNG:
+        raise ValidationError('Longitude must be between -180 and 180. '
+                              'Got {}'.format(longitude/1e6))
+
+
+def validate_timestamp(timestamp):
+    """Validates that the client submitted timestamp for a transaction is not
+    greater than current time, within a tolerance defined by SYNC_TOLERANCE
+
+    NOTE: Timestamp validation can be challenging since the machines that are
+    submitting and validating transactions may have different system times
+    """
+    dts = datetime.datetime.utcnow()
+    current_time = round(time.mktime(dts.timetuple()) + dts.microsecond/1e6)
+    if (timestamp - current_time) > SYNC_TOLERANCE:
+        raise ValidationError(
+            'Timestamp must be less than local time.'
+            ' Expected {0} in ({1}-{2}, {1}+{2})'.format(
+                timestamp, current_time, SYNC_TOLERANCE))